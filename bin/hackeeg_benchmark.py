@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+
+# Benchmarks the HackEEG acquisition path (framing, decoding, shared-memory IPC, recording and LSL
+# output) at each sample rate and protocol mode, without hardware, and prints the results as JSON.
+# See hackeeg/benchmark.py for what is measured.
+
+import argparse
+import json
+import sys
+
+from hackeeg.benchmark import run_benchmarks, MODES, STAGES, DEFAULT_DURATION, DEFAULT_BLOCK_SECONDS, \
+    DEFAULT_END_TO_END_DURATION
+from hackeeg.decoder import DECODE_PROFILES
+from hackeeg.driver import SPEEDS
+
+
+class HackEEGBenchmarkApplication:
+    """HackEEG acquisition benchmark tool."""
+
+    def parse_args(self):
+        parser = argparse.ArgumentParser()
+        parser.add_argument("--sps", "-s", nargs="+", type=int, choices=sorted(SPEEDS.keys()),
+                            help="samples per second settings to benchmark, default is all of them")
+        parser.add_argument("--modes", "-m", nargs="+", choices=list(MODES.keys()),
+                            help="protocol modes to benchmark, default is all of them")
+        parser.add_argument("--stages", nargs="+", choices=STAGES, default=list(STAGES),
+                            help="pipeline stages to run; framing and decode always run")
+        parser.add_argument("--duration", "-t", type=float, default=DEFAULT_DURATION,
+                            help=f"seconds of synthetic samples per run, default is {DEFAULT_DURATION}")
+        parser.add_argument("--block-seconds", "-b", type=float, default=DEFAULT_BLOCK_SECONDS,
+                            help=f"seconds of samples per serial port read, default is {DEFAULT_BLOCK_SECONDS}")
+        parser.add_argument("--decode-profile", "-D", choices=list(DECODE_PROFILES.keys()), default="channels",
+                            help="which sample fields to decode, default is channels")
+        parser.add_argument("--input", "-i", type=str,
+                            help="benchmark a captured rdatac byte stream instead of synthetic samples; "
+                                 "give exactly one --sps and one --modes value to match the capture")
+        parser.add_argument("--end-to-end", "-E", action="store_true",
+                            help="also stream from a real-time emulator through HackEEGBoard")
+        parser.add_argument("--end-to-end-duration", type=float, default=DEFAULT_END_TO_END_DURATION,
+                            help=f"seconds per end-to-end run, default is {DEFAULT_END_TO_END_DURATION}")
+        parser.add_argument("--output", "-o", type=str, help="write the JSON report to this file instead of stdout")
+        parser.add_argument("--quiet", "-q", action="store_true", help="don't print progress to stderr")
+        args = parser.parse_args()
+        if args.input and (not args.sps or len(args.sps) != 1 or not args.modes or len(args.modes) != 1):
+            parser.error("--input needs exactly one --sps and one --modes value")
+        return args
+
+    def progress(self, result):
+        if result["benchmark"] == "pipeline":
+            print(f"{result['mode']:>11} {result['samples_per_second']:>5} sps: "
+                  f"{result['throughput_sps']:.0f} samples/s ({result['realtime_factor']:.1f}x real time), "
+                  f"p99 block latency {result['latency']['p99_ms']:.3f} ms, "
+                  f"CPU {result['cpu_percent']:.0f}%", file=sys.stderr)
+        else:
+            print(f"{result['mode']:>11} {result['samples_per_second']:>5} sps: "
+                  f"end to end {result['received_sps']:.0f} samples/s, "
+                  f"{result['dropped_samples']} dropped", file=sys.stderr)
+
+    def main(self):
+        args = self.parse_args()
+        stream = None
+        if args.input:
+            with open(args.input, 'rb') as file:
+                stream = file.read()
+        report = run_benchmarks(rates=args.sps, modes=args.modes, duration=args.duration,
+                                block_seconds=args.block_seconds, stages=args.stages, end_to_end=args.end_to_end,
+                                end_to_end_duration=args.end_to_end_duration, stream=stream,
+                                decode_profile=DECODE_PROFILES[args.decode_profile],
+                                progress=None if args.quiet else self.progress)
+        if args.output:
+            with open(args.output, 'w') as file:
+                json.dump(report, file, indent=2)
+        else:
+            json.dump(report, sys.stdout, indent=2)
+            print()
+
+
+if __name__ == "__main__":
+    HackEEGBenchmarkApplication().main()
@@ -2,22 +2,58 @@ import uuid
 import time
 import sys
 import select
-from multiprocessing import Process, Queue, Value
+from multiprocessing import Event, Process, Value
 import queue, threading
 # import msvcrt
 
-from pylsl import StreamInfo, StreamOutlet
-
 import hackeeg
 from hackeeg import ads1299
 from hackeeg.driver import SPEEDS, GAINS, Status
+from hackeeg.decoder import DECODE_PROFILES
+from hackeeg.sharedmem import SharedSampleRingBuffer
+from hackeeg.recorder import BinaryRecorder
+from hackeeg.profiles import load_profile
+from hackeeg.lsl import LSLOutlet
 
 DEFAULT_NUMBER_OF_SAMPLES_TO_CAPTURE = 50000
+BUFFER_SECONDS = 60
+READ_TIMEOUT = 0.05  # seconds; how often the acquisition process checks whether it should stop
+STOP_TIMEOUT = 2.0  # seconds the acquisition process gets to finish its last block
+BAUDRATE = 2000000
 
 
 class HackEegTestApplicationException(Exception):
     pass
 
+
+def read_datastream(serial_port_name, debug, decode_profile, messagepack, samples_per_second, buffer_spec,
+                    acquiring, dropped_samples):
+    """the acquisition process: opens its own connection to the (already configured) board, starts
+    continuous reading and puts the decoded blocks straight into the shared ring buffer until
+    ``acquiring`` is cleared. Everything it needs comes in as arguments, so it runs the same with
+    the fork and spawn start methods."""
+    board = hackeeg.HackEEGBoard(serial_port_name, baudrate=BAUDRATE, debug=debug, decode_profile=decode_profile)
+    board.gap_detector.samples_per_second = samples_per_second
+    buffer = SharedSampleRingBuffer.attach(**buffer_spec)
+    try:
+        board.connect()
+        if messagepack:
+            board.messagepack_mode()
+        else:
+            board.jsonlines_mode()
+        board.start()
+        board.rdatac()
+        while acquiring.is_set():
+            block = board.read_rdatac_block(timeout=READ_TIMEOUT)
+            if len(block):
+                buffer.append_block(block.timestamp, block.channel_data)
+                dropped_samples.value = board.gap_detector.missing
+    finally:
+        buffer.close()
+        board.stop_and_sdatac_messagepack()
+        board.raw_serial_port.close()
+
+
 class HackEEGDataStream:
     """HackEEG commandline tool."""
 
@@ -28,9 +64,8 @@ class HackEEGDataStream:
         self.hex = False
         self.messagepack = False
         self.channels = 8
-        self.gain = 1
+        self.gains = None
         self.lsl = False
-        self.lsl_info = None
         self.lsl_outlet = None
         self.lsl_stream_name = "HackEEG"
         self.stream_id = str(uuid.uuid4())
@@ -39,29 +74,49 @@ class HackEEGDataStream:
         self.graph_step = 0
         self.start_time = -1
         self.data_process = None
-        self.connector = Queue()
+        self.process_thread = None
+        # cleared to ask the acquisition process to stop
+        self.acquiring = Event()
+        self.cursor = 0
+        self.recorder = None
         self.pause_toggle = False
+        # dropped samples counted by the acquisition process
+        self.dropped_samples = Value('q', 0)
         # self.manager = multiprocessing.Manager()
-        self.dataMatrix = [] # initialize data matrix to RAM
-        for i in range(0,9):
-            self.dataMatrix.append([])
 
         self.debug = args["debug"]
-        self.samples_per_second = args["sps"]
-        self.gain = args["gain"]
+        self.channel_test = args.get("channel_test", False)
+        # an acquisition profile (built-in name, profile file or spec dict); its sample rate and gain
+        # override sps and gain
+        if args.get("profile"):
+            self.profile = load_profile(args["profile"])
+        else:
+            self.profile = load_profile("test" if self.channel_test else "electrodes5",
+                                        samples_per_second=args["sps"], gain=args["gain"])
+        self.samples_per_second = self.profile.samples_per_second
+        self.gains = self.profile.gains
         self.fileName = args["filename"]
         self.continuous_mode = args["continuous"]
+        self.buffer = SharedSampleRingBuffer(self.samples_per_second * BUFFER_SECONDS, channels=self.channels)
+        self.decode_profile = args.get("decode_profile", "channels")
+        # a register snapshot (e.g. from hackeeg.recorder.read_recording_registers()) to set the board
+        # up with, instead of from sps and gain
+        self.restore_snapshot = args.get("registers")
+        self.register_snapshot = None
+        if self.restore_snapshot is not None and None not in self.restore_snapshot.channel_gains():
+            self.gains = self.restore_snapshot.channel_gains()
 
         if "lsl" in args:
             self.lsl = True
             if args["lsl_stream_name"]:
                 self.lsl_stream_name = args["lsl_stream_name"]
-            self.lsl_info = StreamInfo(self.lsl_stream_name, 'EEG', self.channels, self.samples_per_second, 'int32',
-                                       self.stream_id)
-            self.lsl_outlet = StreamOutlet(self.lsl_info)
+            self.lsl_outlet = LSLOutlet(self.samples_per_second, channels=self.channels, name=self.lsl_stream_name,
+                                        source_id=self.stream_id, microvolts=args.get("lsl_microvolts", False),
+                                        gains=self.gains, chunk_size=args.get("lsl_chunk_size"))
 
         self.serial_port_name = args["serial_port"]
-        self.hackeeg = hackeeg.HackEEGBoard(self.serial_port_name, baudrate=2000000, debug=self.debug)
+        self.hackeeg = hackeeg.HackEEGBoard(self.serial_port_name, baudrate=BAUDRATE, debug=self.debug,
+                                            decode_profile=DECODE_PROFILES[self.decode_profile])
         
         self.max_samples = args["samples"]
         self.quiet = args["quiet"]
@@ -69,130 +124,64 @@ class HackEEGDataStream:
         
         
         self.hackeeg.connect()
-        self.setup(samples_per_second=self.samples_per_second, gain=self.gain, messagepack=self.messagepack)
-
-    def setup(self, samples_per_second=500, gain=1, messagepack=False):
-        if samples_per_second not in SPEEDS.keys():
-            raise HackEegTestApplicationException("{} is not a valid speed; valid speeds are {}".format(
-                samples_per_second, sorted(SPEEDS.keys())))
-        if gain not in GAINS.keys():
-            raise HackEegTestApplicationException("{} is not a valid gain; valid gains are {}".format(
-                gain, sorted(GAINS.keys())))
+        self.setup()
 
+    def setup(self):
         self.hackeeg.stop_and_sdatac_messagepack()
         self.hackeeg.sdatac()
         self.hackeeg.blink_board_led()
-        sample_mode = SPEEDS[samples_per_second] | ads1299.CONFIG1_const
-        self.hackeeg.wreg(ads1299.CONFIG1, sample_mode)
-
-        gain_setting = GAINS[gain]
-
-        self.hackeeg.disable_all_channels()
-        if self.channel_test:
-            self.channel_config_test()
+        if self.restore_snapshot is not None:
+            self.hackeeg.restore_registers(self.restore_snapshot)
         else:
-            self.channel_config_input(gain_setting)
-
-
-        # Route reference electrode to SRB1: JP8:1-2, JP7:NC (not connected)
-        # use this with humans to reduce noise
-        #self.hackeeg.wreg(ads1299.MISC1, ads1299.SRB1 | ads1299.MISC1_const)
-
-        # Single-ended mode - setting SRB1 bit sends mid-supply voltage to the N inputs
-        # use this with a signal generator
-        self.hackeeg.wreg(ads1299.MISC1, ads1299.SRB1)
-
-        # Dual-ended mode
-        self.hackeeg.wreg(ads1299.MISC1, ads1299.MISC1_const)
-        # add channels into bias generation
-        # self.hackeeg.wreg(ads1299.BIAS_SENSP, ads1299.BIAS8P)
-
-        if messagepack:
-            self.hackeeg.messagepack_mode()
-        else:
-            self.hackeeg.jsonlines_mode()
-        self.hackeeg.start()
-        self.hackeeg.rdatac()
-        self.launch_read_datastream(self.connector)
+            # only the registers the board doesn't already have at the profile's values are written
+            self.profile.apply(self.hackeeg)
+        # read back what the board is actually set to, for the recording
+        self.register_snapshot = self.hackeeg.snapshot_registers()
+        self.launch_read_datastream()
         return
 
-    def channel_config_input(self, gain_setting):
-        # all channels enabled
-        # for channel in range(1, 9):
-        #     self.hackeeg.wreg(ads1299.CHnSET + channel, ads1299.TEST_SIGNAL | gain_setting )
-
-        # self.hackeeg.wreg(ads1299.CHnSET + 1, ads1299.INT_TEST_DC | gain_setting)
-        # self.hackeeg.wreg(ads1299.CHnSET + 6, ads1299.INT_TEST_DC | gain_setting)
-        self.hackeeg.wreg(ads1299.CHnSET + 1, ads1299.ELECTRODE_INPUT | gain_setting)
-        self.hackeeg.wreg(ads1299.CHnSET + 2, ads1299.ELECTRODE_INPUT | gain_setting)
-        self.hackeeg.wreg(ads1299.CHnSET + 3, ads1299.ELECTRODE_INPUT | gain_setting)
-        self.hackeeg.wreg(ads1299.CHnSET + 4, ads1299.ELECTRODE_INPUT | gain_setting)
-        self.hackeeg.wreg(ads1299.CHnSET + 5, ads1299.ELECTRODE_INPUT | gain_setting)
-        self.hackeeg.wreg(ads1299.CHnSET + 6, ads1299.ELECTRODE_INPUT | 0)
-        self.hackeeg.wreg(ads1299.CHnSET + 7, ads1299.ELECTRODE_INPUT | 0)
-        self.hackeeg.wreg(ads1299.CHnSET + 8, ads1299.ELECTRODE_INPUT | 0)
-
-    def channel_config_test(self):
-        # test_signal_mode = ads1299.INT_TEST_DC | ads1299.CONFIG2_const
-        test_signal_mode = ads1299.INT_TEST_4HZ | ads1299.CONFIG2_const
-        self.hackeeg.wreg(ads1299.CONFIG2, test_signal_mode)
-        self.hackeeg.wreg(ads1299.CHnSET + 1, ads1299.INT_TEST_DC | ads1299.GAIN_1X)
-        self.hackeeg.wreg(ads1299.CHnSET + 2, ads1299.SHORTED | ads1299.GAIN_1X)
-        self.hackeeg.wreg(ads1299.CHnSET + 3, ads1299.MVDD | ads1299.GAIN_1X)
-        self.hackeeg.wreg(ads1299.CHnSET + 4, ads1299.BIAS_DRN | ads1299.GAIN_1X)
-        self.hackeeg.wreg(ads1299.CHnSET + 5, ads1299.BIAS_DRP | ads1299.GAIN_1X)
-        self.hackeeg.wreg(ads1299.CHnSET + 6, ads1299.TEMP | ads1299.GAIN_1X)
-        self.hackeeg.wreg(ads1299.CHnSET + 7, ads1299.TEST_SIGNAL | ads1299.GAIN_1X)
-        self.hackeeg.disable_channel(8)
-
-        # all channels enabled
-        # for channel in range(1, 9):
-        #     self.hackeeg.wreg(ads1299.CHnSET + channel, ads1299.TEST_SIGNAL | gain_setting )
-        pass
-    
-    def read_datastream(self, queue):
-        while True:
-            result = self.hackeeg.read_rdatac_response()
-            if result:
-                status_code = result.get(self.hackeeg.MpStatusCodeKey)
-                data = result.get(self.hackeeg.MpDataKey)
-                if status_code == Status.Ok and data:
-                    timestamp = result.get('timestamp')
-                    channel_data = result.get('channel_data')
-                    queue.put((timestamp, channel_data))
-                else:
-                    if not self.quiet:
-                        print(data)
-            else:
-                print("no data to decode")
-                print(f"result: {result}")
-
-    def launch_read_datastream(self, queue):
-        self.data_process = Process(target=self.read_datastream, args=(queue,))
+    def launch_read_datastream(self):
+        # the acquisition process opens the port itself and takes it from here
+        self.hackeeg.raw_serial_port.close()
+        self.acquiring.set()
+        self.data_process = Process(target=read_datastream,
+                                    args=(self.serial_port_name, self.debug, DECODE_PROFILES[self.decode_profile],
+                                          self.messagepack, self.samples_per_second, self.buffer.spec(),
+                                          self.acquiring, self.dropped_samples))
         self.data_process.start()
 
-    def process_datastream(self, queue):
-        while ((len(self.dataMatrix[0])< self.max_samples and not self.continuous_mode) or \
-            (self.read_samples_continuously and self.continuous_mode)):
-            while not queue.empty():
-                timestamp, channel_data = queue.get()
-                if not self.quiet:
-                    print(f"timestamp:{timestamp} sample_number: {sample_number}| ",
-                            end='')
+    def process_datastream(self):
+        while self.read_samples_continuously and (self.continuous_mode or self.buffer.written < self.max_samples):
+            timestamps, channel_block, self.cursor = self.buffer.since(self.cursor)
+            if len(timestamps) == 0:
+                time.sleep(0.01)
+                continue
+            if not self.quiet:
+                for timestamp, channel_data in zip(timestamps.tolist(), channel_block.tolist()):
+                    print(f"timestamp:{timestamp} | ", end='')
                     for channel_number, sample in enumerate(channel_data):
-                        print(f"{channel_number + 1}:{sample}", end='')
-                if not self.pause_toggle:
-                    with open("../data/"+self.fileName, 'a') as file:
-                        file.writelines(str(timestamp) + '\t' + '\t'.join(str(j) for j in channel_data) + '\n')
-                    self.dataMatrix[0].append(timestamp)
-                    for channel_number, sample in enumerate(channel_data):
-                        self.dataMatrix[channel_number+1].append(sample)
+                        print(f"{channel_number + 1}:{sample} ", end='')
+                    print()
+            if not self.pause_toggle:
+                self.recorder.write_block(timestamps, channel_block)
+            if self.lsl:
+                self.lsl_outlet.push_block(timestamps, channel_block)
 
     def start(self):
+        # a paused consumer thread may not have noticed yet
+        self.stop_processing()
         self.pause_toggle = False
         self.read_samples_continuously = True
-        processThread = threading.Thread(target=self.process_datastream, args=(self.connector,))
-        processThread.start()
+        # samples that arrived while paused are not saved
+        self.cursor = self.buffer.written
+        if self.recorder is None:
+            # the shared ring buffer doesn't carry the device sample numbers
+            self.recorder = BinaryRecorder("../data/" + self.fileName, self.samples_per_second, gains=self.gains,
+                                           channels=self.channels, device_sample_numbers=False,
+                                           registers=self.register_snapshot,
+                                           channel_config=None if self.restore_snapshot else self.profile.to_dict())
+        self.process_thread = threading.Thread(target=self.process_datastream)
+        self.process_thread.start()
 
         # self.start_time = time.perf_counter()
         print("Started data acquisition thread")
@@ -209,20 +198,35 @@ class HackEEGDataStream:
     #             file.writelines('\t'.join(str(j[i]) for j in self.dataMatrix) + '\n' for i in range(0,len(self.dataMatrix[0])))
     #             # save to file
 
-    def remove(self, index):
-        for i in range(0,len(self.dataMatrix)):
-            del self.dataMatrix[i][0:index]
-
     def reset(self):
-        self.dataMatrix = [] # initialize data matrix to RAM
-        for i in range(0,9):
-            self.dataMatrix.append([])
+        self.cursor = self.buffer.written
         self.start_time = time.perf_counter()
     
-    def stop(self):
+    def stop_processing(self):
+        """stop the consumer thread and wait for it to be done with the ring buffer"""
         self.read_samples_continuously = False
-        self.data_process.terminate()
-        self.data_process.join()
+        if self.process_thread is not None:
+            self.process_thread.join()
+            self.process_thread = None
+
+    def stop(self):
+        # the consumer reads views of the shared memory, and the acquisition process writes to it:
+        # both have to be done with it before it is unmapped
+        self.stop_processing()
+        self.acquiring.clear()
+        self.data_process.join(STOP_TIMEOUT)
+        if self.data_process.is_alive():
+            # stuck in a read that never returns; nothing reads the buffer any more
+            self.data_process.terminate()
+            self.data_process.join()
+        print(f"dropped samples: {self.dropped_samples.value}")
+        self.buffer.close()
+        self.buffer.unlink()
+        if self.recorder:
+            self.recorder.close()
+        # the acquisition process has let go of the port; in case it didn't get to stop the board
+        self.hackeeg.raw_serial_port.open()
+        self.hackeeg.raw_serial_port.reset_input_buffer()
         self.hackeeg.stop_and_sdatac_messagepack()
         self.hackeeg.blink_board_led()
         
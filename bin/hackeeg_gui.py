@@ -3,24 +3,34 @@ matplotlib.use("TkAgg")
 
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2Tk
 from matplotlib.figure import Figure
+from matplotlib.patches import Polygon
 import matplotlib.animation as animation
 from matplotlib import style
 from matplotlib import pyplot as plt
 from datetime import datetime
 
-from scipy import signal
 
 import numpy as np
 
 import tkinter as tk
 from tkinter import ttk
 from hackeeg_datastream import *
+from hackeeg.filters import StreamingFilter, StreamingMedianFilter, ellip_sos, group_delay, FILTER_TYPES
+from hackeeg.decimation import MinMaxPyramid
+from hackeeg.ringbuffer import SampleRingBuffer
+from hackeeg.spectral import StreamingSpectrum
 import copy
-import threading
 
 LARGE_FONT = ("Verdana", 12)
 NORMAL_FONT = ("calibre", 10)
 TO_VOLT = 4.5/(2**23)*10**6
+PLOT_SAMPLES = 40000     # samples shown while streaming
+HISTORY_SECONDS = 60     # seconds kept for plotting, e.g. when paused, and for saving the filtered data
+BLIT_INTERVAL = 33       # milliseconds between frames in fast plotting mode
+INGEST_INTERVAL = 500    # milliseconds between reads of the acquired samples
+SPECTROGRAM_SEGMENTS = 120          # spectra shown in the spectrogram panel
+SPECTROGRAM_MAX_FREQUENCY = 100     # Hz
+SPECTROGRAM_REFRESH = 500           # milliseconds
 style.use("ggplot")
 
 fig = Figure()
@@ -29,12 +39,8 @@ subplots = []
 # a = fig.add_subplot(111)
 
 dataStream = None
+read_cursor = 0
 graph_step = 0
-data = []
-filt_data = []
-for i in range(0,9):
-    data.append([0]*8)
-    filt_data.append([0]*8)
 
 filename_var = None
 filt_filename_var = None
@@ -43,6 +49,10 @@ pause_var = False
 start_var = False
 pause_axes = []
 channel_vars = []
+blit_var = None
+plotter = None
+blit_timer = None
+ingest_id = None
 num_channel = 0
 colors = ['#ff0000','#ffa500','#ffff00','#008000','#0000ff','#4b0082','#ee82ee','k']
 
@@ -51,9 +61,20 @@ sps = 0
 c=3
 r=2
 
-filt_a,filt_b = [],[]
-
-FILTERS = ['lowpass', 'highpass', 'bandpass', 'bandstop']
+stream_filter = None
+median_filter = None
+raw_pyramid = None
+filt_pyramid = None
+filt_history = None  # timestamps and filtered data of the last HISTORY_SECONDS, for saving
+# the median filter's output lags its input: the timestamps of the input samples whose output
+# hasn't come out yet, and how many outputs of the stream's padding are still to be dropped
+filt_timestamps = np.zeros(0, dtype=np.uint32)
+filt_skip = 0
+filt_note = ""  # the delays of the filters, for the header of the saved filtered data
+spectrum = None
+spectrogram = None
+
+FILTERS = list(FILTER_TYPES)
 filter_args = {}
 
 
@@ -89,11 +110,7 @@ def animate(i):
     if sps != 0:
         fig.suptitle("Channel Data\nsps: " + str(int(sps)))
 
-    chnls = []
-    for j, c in enumerate(channel_vars):
-        if c.get():
-            chnls.append(j)
-    # print(chnls)
+    chnls = selected_channels()
 
     if start_var:
         fig.clear()
@@ -111,21 +128,16 @@ def animate(i):
         for i, ch in enumerate(chnls):
             subplots[i] = fig.add_subplot(len(chnls),1,i+1)
 
-    f_n = 9 if pause_var or len(filt_data[1]) <= 40000 else len(filt_data[1])-40000
-    f_end = len(filt_data[1])
-    n = 9 if pause_var or len(data[1]) <= 40000 else len(data[1])-40000
-    end = len(data[1])
-    
+    # decimated to about two points per pixel column, however many samples the span holds
+    pyramid = filt_pyramid if filter_var.get() else raw_pyramid
+    start = pyramid.oldest if pause_var else pyramid.written - PLOT_SAMPLES
+    width = int(fig.get_figwidth() * fig.dpi)
+    graph_x, graph_data = pyramid.query(start, pyramid.written, width)
+
     for i, ch in enumerate(chnls):
         subplots[i].clear()
         subplots[i].autoscale(axis='x', tight=True)
-
-        if filter_var.get():
-            graph_data = filt_data[i+1][f_n:f_end]
-            subplots[i].plot(np.arange(f_n,f_n+len(graph_data)), graph_data, colors[ch], label="Ch."+str(ch+1))
-        else:
-            graph_data = data[i+1][n:end]
-            subplots[i].plot(np.arange(n, n+len(graph_data)), graph_data, colors[ch], label="Ch."+str(ch+1))
+        subplots[i].plot(graph_x, graph_data[:, ch], colors[ch], label="Ch."+str(ch+1))
         subplots[i].legend(loc=1)
         if pause_var:
             subplots[i].axis(pause_axes)
@@ -137,6 +149,139 @@ def animate(i):
         anim.event_source.stop()
 
 
+def selected_channels():
+    return [j for j, c in enumerate(channel_vars) if c.get()]
+
+
+class BlitPlotter:
+    """Fast plotting mode: one Line2D (and one min/max envelope for decimated spans, which Agg
+    draws much faster than a zigzag line) per visible channel, created when the channel selection
+    changes and from then on only updated in place and blitted onto a cached background (axes,
+    ticks, labels). The x axis counts samples back from the newest one, so the background stays
+    valid while the traces scroll; it is only redrawn when a trace outgrows its y limits."""
+
+    def __init__(self, figure):
+        self.figure = figure
+        self.active = False
+        self.channels = None
+        self.axes = []
+        self.lines = []
+        self.envelopes = []
+        self.background = None
+        self.frozen = False
+        figure.canvas.mpl_connect('draw_event', self.on_draw)
+
+    def layout(self, channels):
+        self.figure.clear()
+        self.figure.suptitle("Channel Data")
+        self.channels = channels
+        self.axes = []
+        self.lines = []
+        self.envelopes = []
+        self.frozen = False
+        for i, ch in enumerate(channels):
+            ax = self.figure.add_subplot(len(channels), 1, i+1, sharex=self.axes[0] if self.axes else None)
+            line, = ax.plot([], [], colors[ch], label="Ch."+str(ch+1), animated=True)
+            envelope = Polygon(np.zeros((0, 2)), closed=True, color=colors[ch], linewidth=1, animated=True)
+            ax.add_patch(envelope)
+            ax.set_xlim(-PLOT_SAMPLES, 0)
+            ax.tick_params(labelbottom=(i == len(channels)-1))
+            ax.legend(loc=1)
+            self.axes.append(ax)
+            self.lines.append(line)
+            self.envelopes.append(envelope)
+        self.figure.canvas.draw()
+
+    def on_draw(self, event):
+        # every full redraw (resize, toolbar, rescale) leaves out the animated artists; cache the
+        # background it drew and put the traces back on top
+        if not self.active:
+            return
+        self.background = self.figure.canvas.copy_from_bbox(self.figure.bbox)
+        self.draw_traces()
+
+    def draw_traces(self):
+        for ax, line, envelope in zip(self.axes, self.lines, self.envelopes):
+            ax.draw_artist(envelope if envelope.get_visible() else line)
+
+    def update(self, x, minimums, maximums, xlim):
+        redraw = self.background is None
+        decimated = minimums is not maximums
+        for ax, line, envelope, ch in zip(self.axes, self.lines, self.envelopes, self.channels):
+            if decimated:
+                envelope.set_xy(np.column_stack((np.concatenate((x, x[::-1])),
+                                                 np.concatenate((maximums[:, ch], minimums[::-1, ch])))))
+            else:
+                line.set_data(x, minimums[:, ch])
+            envelope.set_visible(decimated)
+            if len(x):
+                low, high = ax.get_ylim()
+                ymin, ymax = minimums[:, ch].min(), maximums[:, ch].max()
+                if ymin < low or ymax > high or ymax - ymin < (high - low) / 4:
+                    margin = max((ymax - ymin) * 0.1, 1)
+                    ax.set_ylim(ymin - margin, ymax + margin)
+                    redraw = True
+        if self.axes and tuple(self.axes[0].get_xlim()) != xlim:
+            self.axes[0].set_xlim(*xlim)
+            redraw = True
+        canvas = self.figure.canvas
+        if redraw:
+            canvas.draw()
+        else:
+            canvas.restore_region(self.background)
+            self.draw_traces()
+            canvas.blit(self.figure.bbox)
+
+
+def blit_animate():
+    if not dataStream or not plotter.active:
+        return
+    chnls = selected_channels()
+    if chnls != plotter.channels:
+        plotter.layout(chnls)
+    pyramid = filt_pyramid if filter_var.get() else raw_pyramid
+    if pause_var:
+        # one last frame with the whole history, which can then be zoomed with the toolbar
+        if plotter.frozen:
+            return
+        plotter.frozen = True
+        start = pyramid.oldest
+    else:
+        plotter.frozen = False
+        start = pyramid.written - PLOT_SAMPLES
+    width = int(plotter.axes[0].bbox.width) if plotter.axes else 1
+    graph_x, minimums, maximums = pyramid.bounds(start, pyramid.written, width)
+    plotter.update(graph_x - pyramid.written, minimums, maximums,
+                   (min(start - pyramid.written, -PLOT_SAMPLES), 0))
+
+
+def update_spectrogram(psds):
+    """keep the last SPECTROGRAM_SEGMENTS spectra (up to SPECTROGRAM_MAX_FREQUENCY) for the
+    spectrogram panel; None clears them"""
+    global spectrogram
+    if psds is None:
+        spectrogram = None
+        return
+    psds = psds[:, :, spectrum.frequencies <= SPECTROGRAM_MAX_FREQUENCY]
+    if spectrogram is not None:
+        psds = np.concatenate((spectrogram, psds))
+    spectrogram = psds[-SPECTROGRAM_SEGMENTS:]
+
+
+def plot_mode_changed():
+    global start_var
+    if blit_var.get():
+        anim.event_source.stop()
+        plotter.active = True
+        plotter.channels = None
+        blit_timer.start()
+    else:
+        blit_timer.stop()
+        plotter.active = False
+        start_var = True
+        anim.event_source.start()
+
+
 # def update_graph():
 #     global data
 #     global pause_var
@@ -155,16 +300,68 @@ def animate(i):
 #                 a.plot(np.arange(n, n+len(graph_data)), graph_data, colors[i], label="Ch."+str(i+1))
     # a.legend(loc=1)
     
+class SpectrogramWindow(tk.Toplevel):
+    """Optional panel with the spectrogram and rolling Welch PSD of one channel of the raw data,
+    and its band powers and line noise."""
+
+    def __init__(self, *args, **kwargs):
+        tk.Toplevel.__init__(self, *args, **kwargs)
+        self.wm_title("Spectrogram")
+        controls = tk.Frame(self)
+        controls.pack(side=tk.TOP)
+        tk.Label(controls, text="Channel", font=NORMAL_FONT).pack(side=tk.LEFT)
+        self.channel_var = tk.IntVar(value=1)
+        tk.Spinbox(controls, from_=1, to=8, width=3, textvariable=self.channel_var).pack(side=tk.LEFT)
+        self.figure = Figure(figsize=(8, 5))
+        self.spectrogram_axes = self.figure.add_subplot(211)
+        self.psd_axes = self.figure.add_subplot(212)
+        self.canvas = FigureCanvasTkAgg(self.figure, self)
+        self.canvas.get_tk_widget().pack(side=tk.TOP, fill=tk.BOTH, expand=True)
+        self.stats_label = tk.Label(self, font=NORMAL_FONT, justify=tk.LEFT)
+        self.stats_label.pack(side=tk.BOTTOM)
+        self.refresh_id = None
+        self.refresh()
+
+    def refresh(self):
+        history = spectrogram
+        if spectrum is not None and history is not None and len(history):
+            ch = self.channel_var.get() - 1
+            frequencies = spectrum.frequencies[:history.shape[2]]
+            seconds = len(history) * spectrum.hop / spectrum.samples_per_second
+            self.spectrogram_axes.clear()
+            self.spectrogram_axes.imshow(10 * np.log10(history[:, ch, :].T + 1e-12), aspect='auto', origin='lower',
+                                         extent=[-seconds, 0, frequencies[0], frequencies[-1]])
+            self.spectrogram_axes.set_ylabel("Hz")
+            self.spectrogram_axes.set_title("Ch." + str(ch+1))
+            self.psd_axes.clear()
+            self.psd_axes.semilogy(frequencies, spectrum.psd[ch, :len(frequencies)] + 1e-12)
+            self.psd_axes.set_xlabel("Hz")
+            self.psd_axes.set_ylabel("uV^2/Hz")
+            self.canvas.draw_idle()
+            bands = "  ".join(name + ": " + "%.2f" % power[ch] for name, power in spectrum.band_powers().items())
+            line = "  ".join(str(frequency) + " Hz: " + "%+.1f dB" % noise[ch]
+                             for frequency, noise in spectrum.line_noise().items())
+            self.stats_label.config(text="band power (uV^2)  " + bands + "\nline noise  " + line)
+        self.refresh_id = self.after(SPECTROGRAM_REFRESH, self.refresh)
+
+    def destroy(self):
+        if self.refresh_id is not None:
+            self.after_cancel(self.refresh_id)
+        tk.Toplevel.destroy(self)
+
+
 def save_window():
     global filt_filename_var
     popup = tk.Tk()
     
     
     def save_leave():
-        global data
         global filt_filename_var
+        timestamps, filtered = filt_history.latest(filt_history.capacity) if filt_history else ([], [])
         with open("../data/"+filt_filename_var.get(), 'w') as file:
-            file.writelines('\t'.join(str(j[i]) for j in data) + '\n' for i in range(9,len(data[0])))
+            if len(timestamps):
+                np.savetxt(file, np.column_stack((timestamps, filtered)), delimiter='\t',
+                           fmt=['%d'] + ['%.6f'] * filtered.shape[1], header=filt_note)
         popup.destroy()
 
     popup.wm_title("Save Filtered Data to File")
@@ -179,18 +376,31 @@ def save_window():
     popup.mainloop()
 
 def reset():
-    global data
-    global filt_data
-    data = []
-    filt_data=[]
-    for i in range(0,9):
-        data.append([0]*8)
-        filt_data.append([0]*8)
+    global filt_timestamps
+    global filt_skip
+    if filt_history:
+        filt_history.reset()
+    filt_timestamps = np.zeros(0, dtype=np.uint32)
+    filt_skip = median_filter.delay if median_filter else 0
+
+
+def align_filtered(timestamps, filtered):
+    """pair the filtered samples with the timestamps of the samples they were filtered from, making
+    up for the median filter's delay; the outputs for the padding at the start are dropped"""
+    global filt_timestamps
+    global filt_skip
+    timeline = np.concatenate((filt_timestamps, timestamps))
+    skip = min(filt_skip, len(filtered))
+    filtered = filtered[skip:]
+    filt_skip -= skip
+    filt_timestamps = timeline[len(filtered):]
+    return timeline[:len(filtered)], filtered
 
 class HackEEGapp(tk.Tk):
     def __init__(self, *args, **kwargs):
         global filter_var
         global channel_vars
+        global blit_var
 
         tk.Tk.__init__(self, *args, **kwargs)
 
@@ -225,6 +435,11 @@ class HackEEGapp(tk.Tk):
         for i in range(0,8):
             channel_vars.append(tk.IntVar(value=0))
             channelmenu.add_checkbutton(label="Channel " + str(i+1), onvalue=1, offvalue=0, variable=channel_vars[i])
+        channelmenu.add_separator()
+        blit_var = tk.IntVar(value=0)
+        channelmenu.add_checkbutton(label="Fast Plotting", onvalue=1, offvalue=0, variable=blit_var,
+                                    command=plot_mode_changed)
+        channelmenu.add_command(label="Spectrogram", command=SpectrogramWindow)
         menubar.add_cascade(label="View", menu=channelmenu)
 
         tk.Tk.config(self, menu=menubar)
@@ -362,19 +577,42 @@ class StartPage(tk.Frame):
 
         def submit():
             global dataStream
-            global filt_a,filt_b
+            global stream_filter
+            global median_filter
+            global raw_pyramid
+            global filt_pyramid
+            global filt_history
+            global spectrum
+            global spectrogram
             global filter_args
+            global filt_note
             dataStream = HackEEGDataStream(parse_args())
-            filter_vals = {}
-            filter_vals["N"] = filter_args["N"].get()
-            filter_vals["rp"] = float(filter_args["rp"].get())
-            filter_vals["rs"] = float(filter_args["rs"].get())
-            filter_vals["Wn"] = [int(x)*2/sps_var.get() for x in filter_args["Wn"].get().split(", ")]
-            filter_vals["btype"] = filter_args["btype"].get()
-            filter_vals["analog"] = False
-            print(filter_vals)
-            filt_b,filt_a = signal.ellip(**filter_vals)
-            print(filt_b,filt_a)
+            spectrum = StreamingSpectrum(dataStream.samples_per_second, channels=dataStream.channels)
+            spectrogram = None
+            median_filter = StreamingMedianFilter(kernel_size=9, channels=dataStream.channels)
+            history = dataStream.samples_per_second * HISTORY_SECONDS
+            raw_pyramid = MinMaxPyramid(history, channels=dataStream.channels)
+            filt_pyramid = MinMaxPyramid(history, channels=dataStream.channels)
+            filt_history = SampleRingBuffer(history, channels=dataStream.channels, dtype=np.float64)
+            frequencies = [float(x) for x in filter_args["Wn"].get().split(",")]
+            if len(frequencies) == 1:
+                frequencies = frequencies[0]
+            sos = ellip_sos(filter_args["N"].get(), float(filter_args["rp"].get()), float(filter_args["rs"].get()),
+                            frequencies, dataStream.samples_per_second, btype=filter_args["btype"].get())
+            print(sos)
+            # the median filter's delay is taken out of the saved timestamps; the IIR filter's
+            # depends on the frequency and is left in
+            edges = np.atleast_1d(frequencies)
+            delays = group_delay(sos, edges, dataStream.samples_per_second) * 1000 / dataStream.samples_per_second
+            filt_note = ("median of %d samples, delay compensated in the timestamps; then %s IIR filter, "
+                         % (median_filter.kernel_size, filter_args["btype"].get())
+                         + "group delay not compensated: "
+                         + ", ".join("%.1f ms at %g Hz" % (delay, edge) for delay, edge in zip(delays, edges)))
+            reset()
+            if stream_filter is None:
+                stream_filter = StreamingFilter(sos, channels=dataStream.channels)
+            else:
+                stream_filter.set_design(sos)
             controller.show_frame(RawGraphPage)
             
 
@@ -391,7 +629,12 @@ class RawGraphPage(tk.Frame):
         def data_toggle():
             if datathread_button.config('text')[-1] == "Start Data Acquisition":
                 global subplots
+                global read_cursor
+                read_cursor = dataStream.buffer.written
                 dataStream.start()
+                # a tick scheduled before a quick pause and restart would start a second chain
+                if ingest_id is not None:
+                    self.after_cancel(ingest_id)
                 filter_data()
                 datathread_button.config(text="Pause Data Acquisition")
             else:
@@ -404,14 +647,15 @@ class RawGraphPage(tk.Frame):
             global pause_axes
             if graph_button.config('text')[-1] == "Pause Graphing":
                 pause_var = True
-                if subplots[0]:
+                if not blit_var.get() and subplots and subplots[0]:
                     xmin, xmax, ymin, ymax = subplots[0].axis()
                     pause_axes = [xmin, xmax, ymin, ymax]
                 graph_button.config(text="Continue Graphing")
             else:
                 pause_var = False
                 start_var = True
-                anim.event_source.start()
+                if not blit_var.get():
+                    anim.event_source.start()
                 graph_button.config(text="Pause Graphing")
 
         datathread_button = ttk.Button(self, text="Start Data Acquisition", command=data_toggle)
@@ -428,57 +672,66 @@ class RawGraphPage(tk.Frame):
         toolbar.update()
         canvas._tkcanvas.pack(side=tk.TOP, fill=tk.BOTH, expand=True)
 
+        global plotter
+        global blit_timer
+        plotter = BlitPlotter(fig)
+        blit_timer = canvas.new_timer(interval=BLIT_INTERVAL)
+        blit_timer.add_callback(blit_animate)
+
         def filter_data():
+            # runs on the Tk thread (scheduled with after()), like the plotting that reads the
+            # pyramids and spectrogram it updates
             global dataStream
-            global data
             global sps
+            global read_cursor
+            global ingest_id
+            ingest_id = None
             
-            def filter(ch, len_new):
-                global data
-                global filt_data 
-                global filter_args
-                global filt_a
-                global filt_b
-
-                # filt_data[ch].extend(signal.lfilter(filt_b, filt_a, data[ch][-len_new:]))
-
-                for k in range(len(data[ch])-len_new, len(data[ch])):
-                    y_k = filt_b[0]*data[ch][k]
-                    for n in range(1, len(filt_a)):
-                        y_k += filt_b[n]*data[ch][k-n]-filt_a[n]*filt_data[ch][k-n]
-                    filt_data[ch].append(y_k)
-
             # print("HA")
             if not dataStream or dataStream.pause_toggle:
                 return
             
-            tmp_ds = dataStream.dataMatrix[0:len(dataStream.dataMatrix)]
+            timestamps, channel_block, read_cursor = dataStream.buffer.since(read_cursor)
 
             sps = 0
-            if len(tmp_ds[0]) > 9:
-                diffs = np.subtract(tmp_ds[0][1:-1],tmp_ds[0][0:-2])
-                sps = 1000000/(sum(diffs)/len(diffs))
-
-            for i in range(0,len(tmp_ds)):
-                if i != 0:
-                    tmp_ds[i] = [d*TO_VOLT for d in tmp_ds[i]]
-                data[i].extend(tmp_ds[i])
-                if len(data[i]) <= 9 or i == 0:
-                    continue
-                data[i][-9-len(tmp_ds[i]):] = signal.medfilt(data[i][-9-len(tmp_ds[i]):], kernel_size=9)
-                filter(i, len(tmp_ds[i]))
-            dataStream.remove(len(tmp_ds[0]))
-            threading.Timer(0.5, filter_data).start()
+            if len(timestamps) > 9:
+                # device timestamps are microseconds, wrapping at 2**32
+                diffs = np.diff(timestamps.astype(np.int64)) % 2**32
+                sps = 1000000/diffs.mean()
+
+            # median then IIR filter all channels of the new samples in one go; both filters keep
+            # their state between calls and the raw data is left as it is
+            if len(timestamps):
+                microvolts = channel_block * TO_VOLT
+                raw_pyramid.append_block(microvolts)
+                update_spectrogram(spectrum.process(microvolts))
+                filtered = stream_filter.process(median_filter.process(microvolts))
+                filt_pyramid.append_block(filtered)
+                filt_history.append_block(*align_filtered(timestamps, filtered))
+            ingest_id = self.after(INGEST_INTERVAL, filter_data)
 
         def stop_return():
             global dataStream
             global filename_var
+            global read_cursor
             dataStream.stop()
             dataStream = None
+            read_cursor = 0
+            if stream_filter:
+                stream_filter.reset()
+            if median_filter:
+                median_filter.reset()
+            if raw_pyramid:
+                raw_pyramid.reset()
+                filt_pyramid.reset()
+            if spectrum:
+                spectrum.reset()
+                update_spectrogram(None)
             filename_var = tk.StringVar(value="RAW_DATA - "+datetime.now().strftime("%Y-%m-%d_%H_%M_%S"))
             datathread_button.config(text="Start Data Acquisition")
             controller.show_frame(StartPage)
-            anim.event_source.start()
+            if not blit_var.get():
+                anim.event_source.start()
             graph_button.config(text="Pause Graphing")
             reset()
 
@@ -7,6 +7,7 @@ import time
 
 import hackeeg
 from hackeeg import ads1299
+from hackeeg.profiles import load_profile, ProfileException, BUILTIN_PROFILES
 
 
 # TODO
@@ -218,35 +219,40 @@ class HackEEGShell(cmd.Cmd):
         self._format_response(self.hackeeg.nop())
 
     def do_setup(self, arg):
-        """Sets up the ADS1299."""
+        """Resets and sets up the ADS1299 with an acquisition profile, then turns rdatac mode on.
+        setup [profile]- a built-in profile name or a .json, .yaml or .toml profile file; default is shell."""
+        try:
+            profile = load_profile(arg.strip() or "shell")
+        except ProfileException as e:
+            print(e)
+            return
         self.hackeeg.blink_board_led()
         self.hackeeg.reset()
-        sample_mode = ads1299.HIGH_RES_250_SPS | ads1299.CONFIG1_const
-        self.hackeeg.wreg(ads1299.CONFIG1, sample_mode)
-        self.hackeeg.disable_channel(1)
-        self.hackeeg.disable_channel(2)
-        self.hackeeg.disable_channel(3)
-        self.hackeeg.disable_channel(4)
-        #self.hackeeg.disable_channel(5)
-        self.hackeeg.disable_channel(6)
-        #self.hackeeg.disable_channel(7)
-        self.hackeeg.disable_channel(8)
-        self.hackeeg.wreg(ads1299.CH5SET, ads1299.TEST_SIGNAL | ads1299.GAIN_2X)
-        #self.hackeeg.wreg(ads1299.CH7SET, ads1299.TEMP | ads1299.GAIN_12X)
-        self.hackeeg.rreg(ads1299.CH5SET)
-        #self.hackeeg.wreg(ads1299.CH8SET, ads1299.ELECTRODE_INPUT | ads1299.GAIN_24X)
-        self.hackeeg.wreg(ads1299.CH7SET, ads1299.ELECTRODE_INPUT | ads1299.GAIN_2X)
-        #self.hackeeg.wreg(ads1299.CH2SET, ads1299.ELECTRODE_INPUT | ads1299.GAIN_24X)
-        self.hackeeg.rreg(ads1299.CH8SET)
-        #self.hackeeg.rreg(ads1299.CH2SET)
-        self.hackeeg.wreg(ads1299.CH2SET, ads1299.ELECTRODE_INPUT | ads1299.GAIN_24X)
-        # Unipolar mode - setting SRB1 bit sends mid-supply voltage to the N inputs
-        self.hackeeg.wreg(ads1299.MISC1, ads1299.SRB1)
-        # add channels into bias generation
-        self.hackeeg.wreg(ads1299.BIAS_SENSP, ads1299.BIAS8P)
+        profile.apply(self.hackeeg)
         self.hackeeg.rdatac()
         return
 
+    def do_profile(self, arg):
+        """Switches to an acquisition profile, writing only the registers that change.
+        profile [profile]- a built-in profile name or a .json, .yaml or .toml profile file; lists the
+        built-in profiles if none is given."""
+        if not arg.strip():
+            for name, spec in BUILTIN_PROFILES.items():
+                print(f"{name}: {spec.get('description', '')}")
+            return
+        try:
+            profile = load_profile(arg.strip())
+        except ProfileException as e:
+            print(e)
+            return
+        rdatac_mode = self.hackeeg.rdatac_mode
+        if rdatac_mode:
+            self.hackeeg.sdatac()
+        writes = profile.apply(self.hackeeg)
+        if rdatac_mode:
+            self.hackeeg.rdatac()
+        print(f"{len(writes)} registers written.")
+
     def do_exit(self, arg):
         """Exit the HackEEG commandline."""
         sys.exit(0)
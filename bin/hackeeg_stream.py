@@ -7,6 +7,7 @@
 # (--messagepack option)
 
 import argparse
+import json
 import uuid
 import time
 import sys
@@ -14,11 +15,16 @@ import select
 import threading
 # import msvcrt
 
-from pylsl import StreamInfo, StreamOutlet
-
 import hackeeg
 from hackeeg import ads1299
 from hackeeg.driver import SPEEDS, GAINS, Status
+from hackeeg.decoder import DECODE_PROFILES
+from hackeeg.recorder import BinaryRecorder, read_recording_header, read_recording_registers, recording_gains
+from hackeeg.bdf import BDFWriter
+from hackeeg.lsl import LSLOutlet
+from hackeeg.impedance import LeadOffMonitor
+from hackeeg.profiles import load_profile, BUILTIN_PROFILES
+from hackeeg.filters import StreamingFilter, butter_sos, notch_sos, cascade
 
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 from matplotlib.figure import Figure
@@ -86,19 +92,29 @@ class HackEegTestApplication:
         self.quiet = False
         self.hex = False
         self.messagepack = False
+        self.binary = False
         self.channels = 8
         self.samples_per_second = 500
         self.gain = 1
+        self.decode_profile = "channels"
         self.max_samples = 5000
         self.lsl = False
-        self.lsl_info = None
         self.lsl_outlet = None
         self.lsl_stream_name = "HackEEG"
+        self.lsl_microvolts = False
+        self.lsl_chunk_size = None
+        self.stream_filter = None
         self.stream_id = str(uuid.uuid4())
         self.read_samples_continuously = True
         self.continuous_mode = False
         self.sample_counter = 0
-        self.dataMatrix = [[],[],[],[],[],[],[],[],[]] # initialize data matrix to RAM
+        self.fileName = None
+        self.recorder = None
+        self.gaps_file = None
+        self.impedance_monitor = None
+        self.profile = None
+        self.restore_snapshot = None
+        self.register_snapshot = None
 
         print(f"platform: {sys.platform}")
         if sys.platform == "linux" or sys.platform == "linux2" or sys.platform == "darwin":
@@ -108,59 +124,29 @@ class HackEegTestApplication:
         self.non_blocking_console.init()
         # self.debug = True
 
-    def find_dropped_samples(self, samples, number_of_samples):
-        sample_numbers = {self.get_sample_number(sample): 1 for sample in samples}
-        correct_sequence = {index: 1 for index in range(0, number_of_samples)}
-        missing_samples = [sample_number for sample_number in correct_sequence.keys()
-                           if sample_number not in sample_numbers]
-        return len(missing_samples)
-
-    def get_sample_number(self, sample):
-        sample_number = sample.get('sample_number', -1)
-        return sample_number
-
     def read_keyboard_input(self):
         char = self.non_blocking_console.get_data()
         if char:
             self.read_samples_continuously = False
 
-    def setup(self, samples_per_second=500, gain=1, messagepack=False):
-        if samples_per_second not in SPEEDS.keys():
-            raise HackEegTestApplicationException("{} is not a valid speed; valid speeds are {}".format(
-                samples_per_second, sorted(SPEEDS.keys())))
-        if gain not in GAINS.keys():
-            raise HackEegTestApplicationException("{} is not a valid gain; valid gains are {}".format(
-                gain, sorted(GAINS.keys())))
-
+    def setup(self, messagepack=False, binary=False):
         self.hackeeg.stop_and_sdatac_messagepack()
         self.hackeeg.sdatac()
         self.hackeeg.blink_board_led()
-        sample_mode = SPEEDS[samples_per_second] | ads1299.CONFIG1_const
-        self.hackeeg.wreg(ads1299.CONFIG1, sample_mode)
-
-        gain_setting = GAINS[gain]
-
-        self.hackeeg.disable_all_channels()
-        if self.channel_test:
-            self.channel_config_test()
+        if self.restore_snapshot is not None:
+            self.hackeeg.restore_registers(self.restore_snapshot)
         else:
-            self.channel_config_input(gain_setting)
-
+            # only the registers the board doesn't already have at the profile's values are written
+            self.profile.apply(self.hackeeg)
 
-        # Route reference electrode to SRB1: JP8:1-2, JP7:NC (not connected)
-        # use this with humans to reduce noise
-        #self.hackeeg.wreg(ads1299.MISC1, ads1299.SRB1 | ads1299.MISC1_const)
+        if self.impedance_monitor:
+            self.impedance_monitor.configure(self.hackeeg)
+        # read back what the board is actually set to, for the recording
+        self.register_snapshot = self.hackeeg.snapshot_registers()
 
-        # Single-ended mode - setting SRB1 bit sends mid-supply voltage to the N inputs
-        # use this with a signal generator
-        self.hackeeg.wreg(ads1299.MISC1, ads1299.SRB1)
-
-        # Dual-ended mode
-        self.hackeeg.wreg(ads1299.MISC1, ads1299.MISC1_const)
-        # add channels into bias generation
-        # self.hackeeg.wreg(ads1299.BIAS_SENSP, ads1299.BIAS8P)
-
-        if messagepack:
+        if binary:
+            self.hackeeg.binary_mode()
+        elif messagepack:
             self.hackeeg.messagepack_mode()
         else:
             self.hackeeg.jsonlines_mode()
@@ -168,41 +154,6 @@ class HackEegTestApplication:
         self.hackeeg.rdatac()
         return
 
-    def channel_config_input(self, gain_setting):
-        # all channels enabled
-        # for channel in range(1, 9):
-        #     self.hackeeg.wreg(ads1299.CHnSET + channel, ads1299.TEST_SIGNAL | gain_setting )
-
-        # self.hackeeg.wreg(ads1299.CHnSET + 1, ads1299.INT_TEST_DC | gain_setting)
-        # self.hackeeg.wreg(ads1299.CHnSET + 6, ads1299.INT_TEST_DC | gain_setting)
-        self.hackeeg.wreg(ads1299.CHnSET + 1, ads1299.ELECTRODE_INPUT | gain_setting)
-        self.hackeeg.wreg(ads1299.CHnSET + 2, ads1299.ELECTRODE_INPUT | gain_setting)
-        self.hackeeg.wreg(ads1299.CHnSET + 3, ads1299.ELECTRODE_INPUT | gain_setting)
-        self.hackeeg.wreg(ads1299.CHnSET + 4, ads1299.ELECTRODE_INPUT | gain_setting)
-        self.hackeeg.wreg(ads1299.CHnSET + 5, ads1299.ELECTRODE_INPUT | 0)
-        self.hackeeg.wreg(ads1299.CHnSET + 6, ads1299.ELECTRODE_INPUT | 0)
-        self.hackeeg.wreg(ads1299.CHnSET + 7, ads1299.ELECTRODE_INPUT | 0)
-        self.hackeeg.wreg(ads1299.CHnSET + 8, ads1299.ELECTRODE_INPUT | 0)
-
-    def channel_config_test(self):
-        # test_signal_mode = ads1299.INT_TEST_DC | ads1299.CONFIG2_const
-        test_signal_mode = ads1299.INT_TEST_4HZ | ads1299.CONFIG2_const
-        self.hackeeg.wreg(ads1299.CONFIG2, test_signal_mode)
-        self.hackeeg.wreg(ads1299.CHnSET + 1, ads1299.INT_TEST_DC | ads1299.GAIN_1X)
-        self.hackeeg.wreg(ads1299.CHnSET + 2, ads1299.SHORTED | ads1299.GAIN_1X)
-        self.hackeeg.wreg(ads1299.CHnSET + 3, ads1299.MVDD | ads1299.GAIN_1X)
-        self.hackeeg.wreg(ads1299.CHnSET + 4, ads1299.BIAS_DRN | ads1299.GAIN_1X)
-        self.hackeeg.wreg(ads1299.CHnSET + 5, ads1299.BIAS_DRP | ads1299.GAIN_1X)
-        self.hackeeg.wreg(ads1299.CHnSET + 6, ads1299.TEMP | ads1299.GAIN_1X)
-        self.hackeeg.wreg(ads1299.CHnSET + 7, ads1299.TEST_SIGNAL | ads1299.GAIN_1X)
-        self.hackeeg.disable_channel(8)
-
-        # all channels enabled
-        # for channel in range(1, 9):
-        #     self.hackeeg.wreg(ads1299.CHnSET + channel, ads1299.TEST_SIGNAL | gain_setting )
-        pass
-
-
     def parse_args(self):
         parser = argparse.ArgumentParser()
         parser.add_argument("serial_port", help="serial port device path",
@@ -225,42 +176,111 @@ class HackEegTestApplication:
         parser.add_argument("--lsl-stream-name", "-N",
                             help=f"Name of LSL stream to create",
                             default=self.lsl_stream_name, type=str),
+        parser.add_argument("--lsl-microvolts", "-U",
+                            help=f"send float32 microvolts to LSL instead of int32 ADC counts",
+                            action="store_true"),
+        parser.add_argument("--lsl-chunk-size",
+                            help=f"maximum number of samples per LSL chunk, default is everything read at once",
+                            type=int),
+        parser.add_argument("--bandpass",
+                            help=f"band-pass filter the LSL output between these two frequencies (Hz)",
+                            nargs=2, type=float)
+        parser.add_argument("--notch",
+                            help=f"notch filter the LSL output at this line frequency (Hz), e.g. 50 or 60",
+                            type=float)
         parser.add_argument("--messagepack", "-M",
                             help=f"MessagePack mode– use MessagePack format to send sample data to the host, rather than JSON Lines",
                             action="store_true")
+        parser.add_argument("--binary", "-B",
+                            help=f"binary mode– use raw binary frames to send sample data to the host (needs driver support)",
+                            action="store_true")
         parser.add_argument("--channel-test", "-T",
-                            help=f"set the channels to internal test settings for software testing",
+                            help=f"set the channels to internal test settings for software testing "
+                                 f"(the same as --profile test)",
                             action="store_true")
+        parser.add_argument("--profile", "-P",
+                            help=f"acquisition profile: a .json, .yaml or .toml profile file or one of "
+                                 f"{sorted(BUILTIN_PROFILES)}; the sample rate and gain are the profile's. "
+                                 f"Default is electrodes with --sps and --gain",
+                            type=str)
         parser.add_argument("--hex", "-H",
                             help=f"hex mode– output sample data in hexidecimal format for debugging",
                             action="store_true")
         parser.add_argument("--quiet", "-q",
                             help=f"quiet mode– do not print sample data (used for performance testing)",
                             action="store_true")
+        parser.add_argument("--decode-profile", "-D",
+                            help=f"which sample fields to decode- must be one of {list(DECODE_PROFILES.keys())}, default is {self.decode_profile}",
+                            choices=list(DECODE_PROFILES.keys()), default=self.decode_profile, type=str)
         parser.add_argument("--fileName", "-f",
-                            help=f"data output file name",
+                            help=f"data output file name; names ending in .bdf are written as BDF",
+                            type=str)
+        parser.add_argument("--gaps", "-G",
+                            help=f"write the dropped-sample and sample timing counters to this file as JSON",
+                            type=str)
+        parser.add_argument("--impedance", "-Z",
+                            help=f"enable AC lead-off detection and print electrode impedances once a second "
+                                 f"(adds the excitation tone at a quarter of the sample rate to the data; "
+                                 f"lead-off flags need --decode-profile status or full)",
+                            action="store_true")
+        parser.add_argument("--restore", "-R",
+                            help=f"set the board up with the register snapshot of this HackEEG recording, "
+                                 f"instead of from --sps, --gain and --channel-test",
                             type=str)
         args = parser.parse_args()
         if args.debug:
             self.debug = True
             print("debug mode on")
-        self.samples_per_second = args.sps
-        self.gain = args.gain
+        if args.profile:
+            self.profile = load_profile(args.profile)
+        else:
+            self.profile = load_profile("test" if args.channel_test else "electrodes",
+                                        samples_per_second=args.sps, gain=args.gain)
+        self.samples_per_second = self.profile.samples_per_second
+        self.gains = self.profile.gains
+        if args.restore:
+            self.restore_snapshot = read_recording_registers(args.restore)
+            if self.restore_snapshot is None:
+                raise HackEegTestApplicationException(f"{args.restore} has no register snapshot")
+            metadata, header_length = read_recording_header(args.restore)
+            self.samples_per_second = metadata["samples_per_second"]
+            # the gains the snapshot sets the channels to
+            self.gains = self.restore_snapshot.channel_gains()
+            if None in self.gains:
+                self.gains = recording_gains(metadata)
         self.fileName = args.fileName
+        self.gaps_file = args.gaps
+        self.decode_profile = args.decode_profile
 
         if args.continuous:
             self.continuous_mode = True
 
+        designs = []
+        if args.bandpass:
+            designs.append(butter_sos(4, args.bandpass, self.samples_per_second))
+        if args.notch:
+            designs.append(notch_sos(args.notch, self.samples_per_second))
+        if designs:
+            self.stream_filter = StreamingFilter(cascade(*designs), channels=self.channels)
+
         if args.lsl:
             self.lsl = True
             if args.lsl_stream_name:
                 self.lsl_stream_name = args.lsl_stream_name
-            self.lsl_info = StreamInfo(self.lsl_stream_name, 'EEG', self.channels, self.samples_per_second, 'int32',
-                                       self.stream_id)
-            self.lsl_outlet = StreamOutlet(self.lsl_info)
+            self.lsl_microvolts = args.lsl_microvolts
+            self.lsl_chunk_size = args.lsl_chunk_size
+            # filtered samples aren't whole counts; they go out as float32 either way
+            self.lsl_outlet = LSLOutlet(self.samples_per_second, channels=self.channels, name=self.lsl_stream_name,
+                                        source_id=self.stream_id, microvolts=self.lsl_microvolts, gains=self.gains,
+                                        chunk_size=self.lsl_chunk_size, filtered=self.stream_filter is not None)
+
+        if args.impedance:
+            self.impedance_monitor = LeadOffMonitor(self.samples_per_second, channels=self.channels,
+                                                    gains=self.gains)
 
         self.serial_port_name = args.serial_port
-        self.hackeeg = hackeeg.HackEEGBoard(self.serial_port_name, baudrate=2000000, debug=self.debug)
+        self.hackeeg = hackeeg.HackEEGBoard(self.serial_port_name, baudrate=2000000, debug=self.debug,
+                                            decode_profile=DECODE_PROFILES[self.decode_profile])
         # self.non_blocking_console.init(self.hackeeg.raw_serial_port)
         self.non_blocking_console.init()
         self.max_samples = args.samples
@@ -268,41 +288,46 @@ class HackEegTestApplication:
         self.quiet = args.quiet
         self.hex = args.hex
         self.messagepack = args.messagepack
+        self.binary = args.binary
         self.hackeeg.connect()
-        self.setup(samples_per_second=self.samples_per_second, gain=self.gain, messagepack=self.messagepack)
-
-    def process_sample(self, result):
-        if result:
-            status_code = result.get(self.hackeeg.MpStatusCodeKey)
-            data = result.get(self.hackeeg.MpDataKey)
-            #samples.append(result)
-            if status_code == Status.Ok and data:
-                timestamp = result.get('timestamp')
-                sample_number = result.get('sample_number')
-                # ads_gpio = result.get(‘ads_gpio’)
-                # loff_statp = result.get(‘loff_statp’)
-                # loff_statn = result.get(‘loff_statn’)
-                channel_data = result.get('channel_data')
-                # data_hex = result.get(‘data_hex’)
-                if not self.quiet:
-                    print(f"timestamp:{timestamp} sample_number: {sample_number}| ",
-                            end='')
-                    for channel_number, sample in enumerate(channel_data):
-                        print(f"{channel_number + 1}:{sample}", end='')
-               
-                self.dataMatrix[0].append(timestamp)
+        self.setup(messagepack=self.messagepack, binary=self.binary)
+        if self.fileName and self.fileName.lower().endswith(".bdf"):
+            self.recorder = BDFWriter("../data/" + self.fileName, self.samples_per_second, gains=self.gains,
+                                      channels=self.channels)
+        elif self.fileName:
+            self.recorder = BinaryRecorder("../data/" + self.fileName, self.samples_per_second, gains=self.gains,
+                                           channels=self.channels, registers=self.register_snapshot,
+                                           channel_config=None if self.restore_snapshot else self.profile.to_dict())
+
+    def process_block(self, block):
+        if len(block) == 0:
+            if not self.quiet:
+                print("no data to decode")
+            return
+        if not self.quiet:
+            for timestamp, sample_number, channel_data in zip(block.timestamp, block.sample_number,
+                                                               block.channel_data.tolist()):
+                print(f"timestamp:{timestamp} sample_number: {sample_number}| ", end='')
                 for channel_number, sample in enumerate(channel_data):
-                    self.dataMatrix[channel_number+1].append(sample)
-                if self.lsl:
-                    self.lsl_outlet.push_sample(channel_data)
+                    print(f"{channel_number + 1}:{sample} ", end='')
+                print()
+
+        if self.recorder:
+            self.recorder.write_block(block.timestamp, block.channel_data, block.sample_number)
+        if self.impedance_monitor:
+            report = self.impedance_monitor.process_sample_block(block)
+            if report:
+                print("impedance (kOhm): " + " ".join(f"{channel + 1}:{impedance / 1000:.1f}"
+                                                      for channel, impedance in enumerate(report["impedance_ohms"])))
+                if "leads_off_p" in report:
+                    off = [channel + 1 for channel in range(self.channels)
+                           if report["leads_off_p"][channel] or report["leads_off_n"][channel]]
+                    print(f"leads off: {off if off else 'none'}")
+        if self.lsl:
+            if self.stream_filter:
+                self.lsl_outlet.push_block(block.timestamp, self.stream_filter.process(block.channel_data))
             else:
-                if not self.quiet:
-                    print(data)
-        else:
-            print("no data to decode")
-            print(f"result: {result}")
-
-
+                self.lsl_outlet.push_sample_block(block)
 
     def main(self):
 
@@ -318,22 +343,24 @@ class HackEegTestApplication:
 
         while ((self.sample_counter < self.max_samples and not self.continuous_mode) or \
             (self.read_samples_continuously and self.continuous_mode)):
-            result = self.hackeeg.read_rdatac_response()
+            if self.continuous_mode:
+                block = self.hackeeg.read_rdatac_block()
+            else:
+                block = self.hackeeg.read_rdatac_block(max_samples=self.max_samples - self.sample_counter)
             # end_time = time.perf_counter()
-            self.sample_counter += 1
+            self.sample_counter += len(block)
             if self.continuous_mode:
                 self.read_keyboard_input()
-            self.process_sample(result)
+            self.process_block(block)
 
         end_time = time.perf_counter() 
         duration = end_time - start_time
 
         self.hackeeg.stop_and_sdatac_messagepack()
 
-        print('Saving data ....')
-        if self.fileName:
-            with open("../data/"+filt_filename_var.get(), 'w') as file:
-                file.writelines('\t'.join(str(j[i]) for j in self.dataMatrix) + '\n' for i in range(9,len(self.dataMatrix[0])))
+        if self.recorder:
+            print('Saving data ....')
+            self.recorder.close()
 
         self.hackeeg.blink_board_led()
 
@@ -342,9 +369,13 @@ class HackEegTestApplication:
         # plotted_per_second = plot_counter / duration
         print(f"samples per second: {samples_per_second}")
         # print(f"plotted samples per second: {plotted_per_second}")
-        # dropped_samples = self.find_dropped_samples(samples, sample_counter)
-        dropped_samples = len(self.dataMatrix[0])-self.sample_counter
-        print(f"dropped samples: {dropped_samples}")
+        gap_detector = self.hackeeg.gap_detector
+        print(f"dropped samples: {gap_detector.missing} in {gap_detector.gaps} gaps "
+              f"(largest gap: {gap_detector.max_gap} samples), {gap_detector.corrupt} corrupt")
+        print(f"sample timing: {gap_detector.counters()['jitter_histogram_us']}")
+        if self.gaps_file:
+            with open(self.gaps_file, 'w') as file:
+                json.dump(gap_detector.counters(), file, indent=2)
 
 
 if __name__ == "__main__":
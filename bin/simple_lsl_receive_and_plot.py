@@ -1,10 +1,12 @@
 #!/usr/bin/env python
 
 import numpy as np
-from pylsl import StreamInlet, resolve_stream, local_clock
+from pylsl import StreamInlet, resolve_stream
 import pyqtgraph as pg
 from pyqtgraph.Qt import QtCore, QtGui
 
+from hackeeg.decimation import MinMaxPyramid
+
 
 plot_duration = 2.0
 
@@ -22,33 +24,24 @@ win.setWindowTitle('LSL Plot ' + inlet.info().name())
 plt = win.addPlot()
 plt.setLimits(xMin=0.0, xMax=plot_duration, yMin=-1.0 * (inlet.channel_count - 1), yMax=1.0)
 
-t0 = [local_clock()] * inlet.channel_count
+# the last plot_duration seconds, decimated to the width of the plot
+samples_per_second = inlet.info().nominal_srate()
+pyramid = MinMaxPyramid(int(plot_duration * samples_per_second), channels=inlet.channel_count)
 curves = []
 for ch_ix in range(inlet.channel_count):
     curves += [plt.plot()]
 
 
 def update():
-    global inlet, curves, t0
+    global inlet, curves, pyramid
     # Read data from the inlet. Use a timeout of 0.0 so we don't block GUI interaction.
     chunk, timestamps = inlet.pull_chunk(timeout=0.0, max_samples=32)
     if timestamps:
-        timestamps = np.asarray(timestamps)
-        y = np.asarray(chunk)
-
+        pyramid.append_block(np.asarray(chunk))
+        x, y = pyramid.query(width=plt.vb.width())
+        x = (x - pyramid.oldest) / samples_per_second
         for ch_ix in range(inlet.channel_count):
-            old_x, old_y = curves[ch_ix].getData()
-            if old_x is not None:
-                old_x += t0[ch_ix]  # Undo t0 subtraction
-                this_x = np.hstack((old_x, timestamps))
-                this_y = np.hstack((old_y, y[:, ch_ix] - ch_ix))
-            else:
-                this_x = timestamps
-                this_y = y[:, ch_ix] - ch_ix
-            t0[ch_ix] = this_x[-1] - plot_duration
-            this_x -= t0[ch_ix]
-            b_keep = this_x >= 0
-            curves[ch_ix].setData(this_x[b_keep], this_y[b_keep])
+            curves[ch_ix].setData(x, y[:, ch_ix] - ch_ix)
 
 
 
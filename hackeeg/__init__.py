@@ -1,4 +1,15 @@
 from .driver import HackEEGBoard, Status
+from .decoder import SampleBlock, decode_block
+from .gaps import GapDetector
+from .registers import RegisterMap
+from .aio import AsyncHackEEGBoard
+from .ringbuffer import SampleRingBuffer
+from .sharedmem import SharedSampleRingBuffer
+from .recorder import BinaryRecorder, read_recording
+from .bdf import BDFWriter
+from .decimation import MinMaxPyramid
+from .reader import open_recording
+from .emulator import HackEEGEmulator
 from .ads1299 import *
 
 from .__version__ import __version__    # noqa
@@ -0,0 +1,383 @@
+import asyncio
+import json
+from json import JSONDecodeError
+
+import serial
+
+from . import ads1299
+from .decoder import decode_block, DECODE_FULL
+from .driver import HackEEGBoard, HackEEGException, RdatacStreamParser, RegisterCacheMixin, DEFAULT_BAUDRATE, \
+    DEFAULT_COMMAND_WINDOW
+from .gaps import GapDetector
+from .registers import RegisterMap
+
+
+class AsyncHackEEGBoard(RegisterCacheMixin):
+    """asyncio client for the HackEEG driver.
+
+    All serial I/O runs on the event loop: when the serial port has a file descriptor it is watched
+    with ``loop.add_reader()``, otherwise (e.g. ``loop://`` and other pyserial URL handlers) it is
+    polled every ``PollInterval`` seconds. A single dispatcher owns the incoming byte stream: outside
+    of rdatac mode it splits it into JSON Lines responses for the awaiting command, in rdatac mode it
+    decodes sample blocks, which are read with ``async for block in board.sample_blocks()``.
+
+    Only JSON Lines, MessagePack and binary modes are supported; commands are always JSON Lines.
+
+        board = AsyncHackEEGBoard(serial_port_path)
+        await board.connect()
+        await board.wreg(ads1299.CONFIG1, ads1299.HIGH_RES_500_SPS | ads1299.CONFIG1_const)
+        await board.messagepack_mode()
+        await board.start()
+        await board.rdatac()
+        async for block in board.sample_blocks():
+            ...
+    """
+
+    JsonLinesMode = HackEEGBoard.JsonLinesMode
+    MessagePackMode = HackEEGBoard.MessagePackMode
+    BinaryMode = HackEEGBoard.BinaryMode
+
+    CommandKey = HackEEGBoard.CommandKey
+    ParametersKey = HackEEGBoard.ParametersKey
+    StatusCodeKey = HackEEGBoard.StatusCodeKey
+    StatusTextKey = HackEEGBoard.StatusTextKey
+    DataKey = HackEEGBoard.DataKey
+    MpDataKey = HackEEGBoard.MpDataKey
+
+    PollInterval = 0.002
+    CommandTimeout = 1.0
+    ConnectionSleepTime = 0.1
+
+    def __init__(self, serial_port_path=None, baudrate=DEFAULT_BAUDRATE, debug=False, decode_profile=DECODE_FULL,
+                 serial_port=None):
+        self.debug = debug
+        self.decode_profile = decode_profile
+        self.mode = self.JsonLinesMode
+        self.rdatac_mode = False
+        if serial_port is None:
+            serial_port = serial.serial_for_url(serial_port_path, baudrate=baudrate, timeout=0)
+        self.raw_serial_port = serial_port
+        self.loop = None
+        self.reader_fd = None
+        self.poll_task = None
+        self.command_lock = None
+        self.responses = None
+        self.blocks = None
+        self.line_buffer = bytearray()
+        self.rdatac_parser = None
+        self.start_rdatac_after_line = False
+        self.gap_detector = GapDetector()
+        # ADS1299 register values last written or read; None where unknown
+        self.registers = RegisterMap()
+
+    async def open(self):
+        """start watching the serial port on the running event loop"""
+        self.loop = asyncio.get_running_loop()
+        self.command_lock = asyncio.Lock()
+        self.responses = asyncio.Queue()
+        self.blocks = asyncio.Queue()
+        try:
+            self.reader_fd = self.raw_serial_port.fileno()
+        except (AttributeError, OSError):
+            self.reader_fd = None
+        if self.reader_fd is not None:
+            self.loop.add_reader(self.reader_fd, self._on_readable)
+        else:
+            self.poll_task = asyncio.ensure_future(self._poll())
+
+    async def close(self):
+        if self.reader_fd is not None:
+            self.loop.remove_reader(self.reader_fd)
+            self.reader_fd = None
+        if self.poll_task is not None:
+            self.poll_task.cancel()
+            try:
+                await self.poll_task
+            except asyncio.CancelledError:
+                pass
+            self.poll_task = None
+        self.raw_serial_port.close()
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def _poll(self):
+        while True:
+            self._on_readable()
+            await asyncio.sleep(self.PollInterval)
+
+    def _on_readable(self):
+        waiting = self.raw_serial_port.in_waiting
+        if self.reader_fd is None and not waiting:
+            return
+        data = self.raw_serial_port.read(waiting or 1)
+        if data:
+            self._on_data(data)
+
+    def _on_data(self, data):
+        if self.rdatac_parser is not None:
+            self._feed_samples(data)
+            return
+        self.line_buffer += data
+        while True:
+            end = self.line_buffer.find(b'\n')
+            if end < 0:
+                break
+            line = bytes(self.line_buffer[:end])
+            del self.line_buffer[:end + 1]
+            self._handle_line(line)
+            if self.start_rdatac_after_line:
+                # the rdatac response is the last line before the sample stream starts
+                self.start_rdatac_after_line = False
+                self.rdatac_parser = RdatacStreamParser(self.mode, debug=self.debug)
+                rest = bytes(self.line_buffer)
+                self.line_buffer.clear()
+                if rest:
+                    self._feed_samples(rest)
+                break
+
+    def _handle_line(self, line):
+        line = line.strip()
+        if not line:
+            return
+        try:
+            response = json.loads(line)
+        except (JSONDecodeError, UnicodeDecodeError):
+            # a response right after the end of a MessagePack or binary sample stream
+            # can be prefixed with the tail of the last sample
+            start = line.rfind(b'{"')
+            try:
+                response = json.loads(line[start:]) if start > 0 else None
+            except (JSONDecodeError, UnicodeDecodeError):
+                response = None
+        if self.debug:
+            print(f"read_response line: {line}")
+        if not isinstance(response, dict):
+            return
+        if self.StatusCodeKey not in response and self.MpDataKey in response:
+            # a JSON Lines sample still in flight after sdatac
+            return
+        self.responses.put_nowait(response)
+
+    def _feed_samples(self, data):
+        self.rdatac_parser.feed(data)
+        if self.rdatac_parser.pending():
+            block = decode_block(self.rdatac_parser.take(), profile=self.decode_profile)
+            self.gap_detector.update_block(block, corrupt=self.rdatac_parser.take_errors())
+            self.blocks.put_nowait(block)
+
+    def _send_command(self, command, parameters=None):
+        if self.debug:
+            print(f"command: {command}  parameters: {parameters}")
+        new_command = json.dumps({self.CommandKey: command, self.ParametersKey: parameters})
+        self.raw_serial_port.write(new_command.encode() + b'\n')
+        self.raw_serial_port.flush()
+
+    async def _read_response(self, timeout=None):
+        if timeout is None:
+            timeout = self.CommandTimeout
+        return await asyncio.wait_for(self.responses.get(), timeout)
+
+    async def execute_command(self, command, parameters=None):
+        if parameters is None:
+            parameters = []
+        async with self.command_lock:
+            # drop responses nobody waited for, so they can't be mistaken for this one's
+            while not self.responses.empty():
+                self.responses.get_nowait()
+            self._send_command(command, parameters)
+            try:
+                response = await self._read_response()
+            except asyncio.TimeoutError:
+                await self._resync([(command, parameters)])
+                raise
+        self._track_registers(command, parameters, response)
+        return response
+
+    async def execute_commands(self, commands, window=DEFAULT_COMMAND_WINDOW):
+        """execute several commands, pipelined: up to ``window`` commands are kept in flight, and
+        responses are matched to commands in order; ``commands`` are (command, parameters) pairs.
+        Returns the list of responses. If a response times out, asyncio.TimeoutError is raised
+        after the commands in flight have been dropped from the register cache (see _resync())."""
+        commands = [(command, [] if parameters is None else parameters) for command, parameters in commands]
+        async with self.command_lock:
+            while not self.responses.empty():
+                self.responses.get_nowait()
+            responses = []
+            sent = 0
+            while len(responses) < len(commands):
+                if sent < len(commands) and sent - len(responses) < window:
+                    burst = commands[sent:len(responses) + window]
+                    if self.debug:
+                        print(f"pipelined commands: {burst}")
+                    self.raw_serial_port.write(b"".join(
+                        json.dumps({self.CommandKey: command, self.ParametersKey: parameters}).encode() + b'\n'
+                        for command, parameters in burst))
+                    self.raw_serial_port.flush()
+                    sent += len(burst)
+                try:
+                    response = await self._read_response()
+                except asyncio.TimeoutError:
+                    await self._resync(commands[len(responses):sent])
+                    raise
+                self._track_registers(*commands[len(responses)], response)
+                responses.append(response)
+        return responses
+
+    async def _resync(self, lost):
+        """after a response timed out: the ``lost`` commands (still in flight) may or may not have been
+        carried out, and their responses may still arrive; forget the registers they write and read
+        until the response to a ``nop`` sent after them, so late responses can't be taken for the
+        next command's. Call with the command lock held."""
+        self._forget_registers(lost)
+        self._send_command("nop", [])
+        for _ in range(len(lost) + 1):
+            try:
+                await self._read_response()
+            except asyncio.TimeoutError:
+                break
+
+    async def apply_registers(self, desired):
+        """bring the ADS1299 registers to ``desired``, writing only the ones whose cached value
+        differs, all in one burst; see HackEEGBoard.apply_registers()"""
+        return await self._write_registers(self.registers.changes(desired))
+
+    async def _write_registers(self, writes):
+        return self._check_writes(writes, await self.execute_commands(self._write_commands(writes)))
+
+    async def snapshot_registers(self):
+        """read the whole ADS1299 register map in one pipelined burst; returns a RegisterMap"""
+        return self._snapshot_from_responses(await self.execute_commands(self._snapshot_commands()))
+
+    async def restore_registers(self, snapshot):
+        """write every writable register of ``snapshot`` in one pipelined burst; see
+        HackEEGBoard.restore_registers()"""
+        return await self._write_registers(self._restore_writes(snapshot))
+
+    async def connect(self):
+        if self.loop is None:
+            await self.open()
+        self._send_command("stop")
+        self._send_command("sdatac")
+        await asyncio.sleep(self.ConnectionSleepTime)
+        self.rdatac_parser = None
+        self.line_buffer.clear()
+        try:
+            response = await self.nop()
+        except asyncio.TimeoutError:
+            raise HackEEGException("Can't connect to Arduino")
+        return response
+
+    async def sample_blocks(self):
+        """async iterator over the decoded SampleBlocks received in rdatac mode; ends after sdatac()"""
+        while True:
+            block = await self.blocks.get()
+            if block is None:
+                return
+            yield block
+
+    async def wreg(self, register, value):
+        return await self.execute_command("wreg", [register, value])
+
+    async def rreg(self, register):
+        return await self.execute_command("rreg", [register])
+
+    async def nop(self):
+        return await self.execute_command("nop")
+
+    async def boardledon(self):
+        return await self.execute_command("boardledon")
+
+    async def boardledoff(self):
+        return await self.execute_command("boardledoff")
+
+    async def ledon(self):
+        return await self.execute_command("ledon")
+
+    async def ledoff(self):
+        return await self.execute_command("ledoff")
+
+    async def micros(self):
+        return await self.execute_command("micros")
+
+    async def reset(self):
+        return await self.execute_command("reset")
+
+    async def start(self):
+        return await self.execute_command("start")
+
+    async def stop(self):
+        return await self.execute_command("stop")
+
+    async def rdata(self):
+        return await self.execute_command("rdata")
+
+    async def version(self):
+        return await self.execute_command("version")
+
+    async def status(self):
+        return await self.execute_command("status")
+
+    async def jsonlines_mode(self):
+        response = await self.execute_command("jsonlines")
+        self.mode = self.JsonLinesMode
+        return response
+
+    async def messagepack_mode(self):
+        response = await self.execute_command("messagepack")
+        self.mode = self.MessagePackMode
+        return response
+
+    async def binary_mode(self):
+        response = await self.execute_command("binary")
+        self.mode = self.BinaryMode
+        return response
+
+    async def rdatac(self):
+        async with self.command_lock:
+            while not self.responses.empty():
+                self.responses.get_nowait()
+            while not self.blocks.empty():
+                self.blocks.get_nowait()
+            self.start_rdatac_after_line = True
+            self.gap_detector.reset()
+            self._send_command("rdatac", [])
+            try:
+                result = await self._read_response()
+            except asyncio.TimeoutError:
+                self.start_rdatac_after_line = False
+                raise
+        if self.ok(result):
+            self.rdatac_mode = True
+        else:
+            self.rdatac_parser = None
+        return result
+
+    async def sdatac(self):
+        async with self.command_lock:
+            while not self.responses.empty():
+                self.responses.get_nowait()
+            self._send_command("sdatac", [])
+            # everything from here on is treated as responses again
+            self.rdatac_parser = None
+            self.line_buffer.clear()
+            self.rdatac_mode = False
+            self.blocks.put_nowait(None)
+            return await self._read_response()
+
+    async def enable_channel(self, channel, gain=None):
+        if gain is None:
+            gain = ads1299.GAIN_1X
+        return await self.wreg(ads1299.CHnSET + channel, ads1299.ELECTRODE_INPUT | gain)
+
+    async def disable_channel(self, channel):
+        return await self.wreg(ads1299.CHnSET + channel, ads1299.PDn | ads1299.SHORTED)
+
+    async def blink_board_led(self):
+        await self.boardledon()
+        await asyncio.sleep(0.3)
+        await self.boardledoff()
@@ -0,0 +1,178 @@
+import datetime
+import itertools
+
+import numpy as np
+
+from .decoder import NUMBER_OF_CHANNELS
+from .recorder import read_recording, recording_gains
+
+# BDF is the 24-bit variant of EDF (BioSemi), which matches the ADS1299 samples exactly:
+# https://www.biosemi.com/faq/file_format.htm
+
+BDF_VERSION = b'\xffBIOSEMI'
+BDF_RESERVED = '24BIT'
+REFERENCE_VOLTAGE = 4.5  # volts, internal ADS1299 reference
+DIGITAL_MINIMUM = -2 ** 23
+DIGITAL_MAXIMUM = 2 ** 23 - 1
+DEFAULT_TSV_CHUNK_SAMPLES = 65536
+
+
+class BDFException(Exception):
+    pass
+
+
+def _field(value, length):
+    text = str(value)
+    if len(text) > length:
+        raise BDFException(f"BDF header field {text!r} is longer than {length} characters")
+    return text.ljust(length).encode('ascii')
+
+
+def _number_field(value, length=8):
+    """format a number in at most ``length`` characters, dropping decimals as needed"""
+    if float(value).is_integer():
+        return _field(int(value), length)
+    for decimals in range(length, -1, -1):
+        text = f"{value:.{decimals}f}"
+        if len(text) <= length:
+            return _field(text, length)
+    raise BDFException(f"{value} does not fit in a BDF header field")
+
+
+def physical_range(gain):
+    """physical minimum and maximum in microvolts for a channel with this ADS1299 gain"""
+    full_scale = REFERENCE_VOLTAGE / gain * 1e6
+    return -full_scale, full_scale
+
+
+class BDFWriter:
+    """Streams channel data to a BDF file, one data record at a time.
+
+    Samples are collected until a data record (``record_duration`` seconds) is complete and then
+    written out, so memory use doesn't depend on the length of the recording. The number of data
+    records in the header is filled in by ``close()``; a final partial record is padded with zeros.
+    ``gains`` is either one ADS1299 gain for all channels or one gain per channel; they set the
+    physical range of each channel (+/-4.5 V / gain, in uV)."""
+
+    def __init__(self, path, samples_per_second, gains=1, channels=NUMBER_OF_CHANNELS, labels=None,
+                 record_duration=1, patient_id="X", recording_id="X", start_time=None):
+        samples_per_record = samples_per_second * record_duration
+        if samples_per_record != int(samples_per_record):
+            raise BDFException(f"{record_duration} s data records don't hold a whole number of samples "
+                               f"at {samples_per_second} samples per second")
+        if isinstance(gains, int):
+            gains = [gains] * channels
+        if len(gains) != channels:
+            raise BDFException(f"got {len(gains)} gains for {channels} channels")
+        if labels is None:
+            labels = [f"Ch{channel + 1}" for channel in range(channels)]
+        if start_time is None:
+            start_time = datetime.datetime.now()
+        self.path = path
+        self.channels = channels
+        self.samples_per_record = int(samples_per_record)
+        self.record = np.zeros((self.samples_per_record, channels), dtype=np.int32)
+        self.buffered = 0
+        self.number_of_records = 0
+        self.file = open(path, 'wb')
+        self._write_header(labels, gains, record_duration, patient_id, recording_id, start_time)
+
+    def _write_header(self, labels, gains, record_duration, patient_id, recording_id, start_time):
+        channels = self.channels
+        header = [BDF_VERSION,
+                  _field(patient_id, 80),
+                  _field(recording_id, 80),
+                  _field(start_time.strftime("%d.%m.%y"), 8),
+                  _field(start_time.strftime("%H.%M.%S"), 8),
+                  _field(256 * (channels + 1), 8),
+                  _field(BDF_RESERVED, 44),
+                  _field(-1, 8),  # number of data records, filled in by close()
+                  _number_field(record_duration),
+                  _field(channels, 4)]
+        ranges = [physical_range(gain) for gain in gains]
+        header += [_field(label, 16) for label in labels]
+        header += [_field("", 80)] * channels  # transducer type
+        header += [_field("uV", 8)] * channels
+        header += [_number_field(minimum) for minimum, _ in ranges]
+        header += [_number_field(maximum) for _, maximum in ranges]
+        header += [_field(DIGITAL_MINIMUM, 8)] * channels
+        header += [_field(DIGITAL_MAXIMUM, 8)] * channels
+        header += [_field("", 80)] * channels  # prefiltering
+        header += [_field(self.samples_per_record, 8)] * channels
+        header += [_field("", 32)] * channels
+        self.file.write(b"".join(header))
+
+    def write_block(self, timestamps, channel_data, sample_numbers=None):
+        """append an (N, channels) block of channel data; timestamps and sample numbers are accepted
+        so BDFWriter can stand in for a BinaryRecorder, but BDF has no place to store them"""
+        number_of_samples = len(channel_data)
+        offset = 0
+        while offset < number_of_samples:
+            count = min(number_of_samples - offset, self.samples_per_record - self.buffered)
+            self.record[self.buffered:self.buffered + count] = channel_data[offset:offset + count]
+            self.buffered += count
+            offset += count
+            if self.buffered == self.samples_per_record:
+                self._write_record()
+
+    def write_sample_block(self, block):
+        """append a SampleBlock, as returned by HackEEGBoard.read_rdatac_block()"""
+        self.write_block(block.timestamp, block.channel_data, block.sample_number)
+
+    def _write_record(self):
+        # each signal's samples are stored together, as 24-bit little-endian two's complement
+        samples = self.record.astype('<i4').T.copy()
+        self.file.write(samples.view(np.uint8).reshape(self.channels, self.samples_per_record, 4)[:, :, :3].tobytes())
+        self.number_of_records += 1
+        self.buffered = 0
+
+    def close(self):
+        if self.file.closed:
+            return
+        if self.buffered:
+            self.record[self.buffered:] = 0
+            self._write_record()
+        self.file.seek(236)
+        self.file.write(_field(self.number_of_records, 8))
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def convert_tsv_to_bdf(tsv_path, bdf_path, samples_per_second, gains=1, scale=1.0,
+                       chunk_samples=DEFAULT_TSV_CHUNK_SAMPLES, **kwargs):
+    """convert a legacy tab-separated capture (timestamp followed by one column per channel) to BDF.
+
+    The TSV values are divided by ``scale`` to get back to ADC counts; captures saved by hackeeg_gui
+    are in microvolts at unity gain, so use ``scale=4.5e6 / 2 ** 23`` for those. TSV captures don't
+    record their gains, so pass ``gains`` (one ADS1299 gain for all channels or one per channel) as
+    the channels were set up. The file is read ``chunk_samples`` lines at a time. Extra keyword
+    arguments are passed on to BDFWriter."""
+    writer = None
+    with open(tsv_path) as tsv_file:
+        while True:
+            lines = list(itertools.islice(tsv_file, chunk_samples))
+            if not lines:
+                break
+            chunk = np.loadtxt(lines, ndmin=2)
+            if writer is None:
+                writer = BDFWriter(bdf_path, samples_per_second, gains=gains, channels=chunk.shape[1] - 1, **kwargs)
+            writer.write_block(chunk[:, 0], np.rint(chunk[:, 1:] / scale).astype(np.int32))
+    if writer is None:
+        raise BDFException(f"{tsv_path} has no samples")
+    writer.close()
+
+
+def convert_recording_to_bdf(recording_path, bdf_path, chunk_samples=DEFAULT_TSV_CHUNK_SAMPLES, **kwargs):
+    """convert a HackEEG binary recording to BDF, using the sample rate and channel gains from its
+    metadata (see recording_gains())"""
+    metadata, records = read_recording(recording_path)
+    with BDFWriter(bdf_path, metadata["samples_per_second"], gains=recording_gains(metadata),
+                   channels=metadata["channels"], **kwargs) as writer:
+        for start in range(0, len(records), chunk_samples):
+            chunk = records[start:start + chunk_samples]
+            writer.write_block(chunk['timestamp'], chunk['channel_data'], chunk['sample_number'])
@@ -0,0 +1,253 @@
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from .decoder import decode_block, DECODE_CHANNELS
+from .driver import HackEEGBoard, RdatacStreamParser, SPEEDS
+from .emulator import HackEEGEmulator
+from .lsl import LSLOutlet, LSLException
+from .recorder import BinaryRecorder, RECORDING_EXTENSION
+from .sharedmem import SharedSampleRingBuffer
+
+# Acquisition benchmarks. The pipeline benchmark pushes an rdatac byte stream (synthetic, from the
+# emulator, or captured from a board) through the same stages as a live session, as fast as they
+# will go, in chunks the size the serial port would deliver them:
+#
+#   framing  split the byte stream into sample payloads (RdatacStreamParser)
+#   decode   decode the payloads into a SampleBlock
+#   ipc      append the block to a shared-memory ring buffer and read it back with a cursor
+#   record   write the block to a binary recording in a temporary directory
+#   lsl      push the block to an LSL outlet (skipped if pylsl isn't available)
+#
+# The end-to-end benchmark reads from a real-time emulator through HackEEGBoard for a fixed time,
+# and reports the sample rate actually received and the samples lost on the way (see hackeeg.gaps).
+
+MODES = {"jsonlines": HackEEGBoard.JsonLinesMode,
+         "messagepack": HackEEGBoard.MessagePackMode,
+         "binary": HackEEGBoard.BinaryMode}
+STAGES = ("framing", "decode", "ipc", "record", "lsl")
+
+DEFAULT_DURATION = 10.0  # seconds of samples per pipeline run
+DEFAULT_END_TO_END_DURATION = 5.0
+DEFAULT_BLOCK_SECONDS = 0.01  # how much data the host picks up from the serial port per read
+RING_BUFFER_SECONDS = 10
+
+
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return peak / 2 ** 20  # bytes
+    return peak / 2 ** 10  # kilobytes
+
+
+def _latency_summary(latencies):
+    if not latencies:
+        return {"p50_ms": None, "p99_ms": None, "max_ms": None}
+    latencies = np.array(latencies) * 1000
+    return {"p50_ms": float(np.percentile(latencies, 50)),
+            "p99_ms": float(np.percentile(latencies, 99)),
+            "max_ms": float(latencies.max())}
+
+
+def system_info():
+    return {"python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "machine": platform.machine(),
+            "processor": platform.processor(),
+            "cpu_count": os.cpu_count()}
+
+
+def synthetic_stream(mode, samples_per_second, number_of_samples, seed=0):
+    """an rdatac byte stream of ``number_of_samples`` emulated samples in protocol ``mode``"""
+    emulator = HackEEGEmulator(samples_per_second=samples_per_second, realtime=False, seed=seed, mode=mode)
+    return emulator.sample_stream(number_of_samples)
+
+
+def run_pipeline(stream, mode, samples_per_second, number_of_samples=None, block_seconds=DEFAULT_BLOCK_SECONDS,
+                 stages=STAGES, decode_profile=DECODE_CHANNELS):
+    """push ``stream`` through the acquisition stages in ``stages`` and return the measurements as a dict.
+
+    ``number_of_samples`` is the number of samples in the stream, if known; it is used to size the
+    chunks and to count dropped samples."""
+    mode_name = next(name for name, value in MODES.items() if value == mode)
+    if number_of_samples is None:
+        # near enough to size the chunks; the count of decoded samples is exact
+        number_of_samples = max(len(stream) // len(synthetic_stream(mode, samples_per_second, 1)), 1)
+    block_samples = max(int(samples_per_second * block_seconds), 1)
+    chunk_length = max(len(stream) * block_samples // number_of_samples, 1)
+
+    parser = RdatacStreamParser(mode)
+    ring_buffer = recorder = outlet = None
+    skipped = {}
+    if "ipc" in stages:
+        ring_buffer = SharedSampleRingBuffer(samples_per_second * RING_BUFFER_SECONDS)
+    directory = tempfile.TemporaryDirectory()
+    if "record" in stages:
+        recorder = BinaryRecorder(os.path.join(directory.name, "benchmark" + RECORDING_EXTENSION),
+                                  samples_per_second)
+    if "lsl" in stages:
+        try:
+            outlet = LSLOutlet(samples_per_second, name="HackEEG benchmark",
+                               source_id=f"hackeeg-benchmark-{os.getpid()}")
+        except LSLException as e:
+            skipped["lsl"] = str(e)
+    # every block goes through framing and decode; the other stages are optional
+    active_stages = ["framing", "decode"] + [stage for stage in ("ipc", "record", "lsl")
+                                             if stage in stages and stage not in skipped]
+    stage_latencies = {stage: [] for stage in active_stages}
+    block_latencies = []
+    decoded_samples = 0
+    cursor = 0
+
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    for offset in range(0, len(stream), chunk_length):
+        times = [time.perf_counter()]
+        parser.feed(stream[offset:offset + chunk_length])
+        payloads = parser.take()
+        times.append(time.perf_counter())
+        block = decode_block(payloads, profile=decode_profile)
+        times.append(time.perf_counter())
+        decoded_samples += len(block)
+        if ring_buffer is not None:
+            ring_buffer.append_block(block.timestamp, block.channel_data)
+            _, _, cursor = ring_buffer.since(cursor)
+            times.append(time.perf_counter())
+        if recorder is not None:
+            recorder.write_block(block.timestamp, block.channel_data, block.sample_number)
+            times.append(time.perf_counter())
+        if outlet is not None:
+            outlet.push_sample_block(block)
+            times.append(time.perf_counter())
+        for stage, start, end in zip(active_stages, times, times[1:]):
+            stage_latencies[stage].append(end - start)
+        block_latencies.append(times[-1] - times[0])
+    if recorder is not None:
+        recorder.close()
+    wall_time = time.perf_counter() - wall_start
+    cpu_time = time.process_time() - cpu_start
+
+    if ring_buffer is not None:
+        ring_buffer.close()
+        ring_buffer.unlink()
+    directory.cleanup()
+
+    throughput = decoded_samples / wall_time if wall_time else None
+    result = {"benchmark": "pipeline",
+              "mode": mode_name,
+              "samples_per_second": samples_per_second,
+              "samples": number_of_samples,
+              "decoded_samples": decoded_samples,
+              "dropped_samples": max(number_of_samples - decoded_samples, 0),
+              "bytes": len(stream),
+              "block_samples": block_samples,
+              "blocks": len(block_latencies),
+              "wall_time_s": wall_time,
+              "throughput_sps": throughput,
+              "realtime_factor": throughput / samples_per_second if throughput else None,
+              "latency": _latency_summary(block_latencies),
+              "stages": {stage: dict(_latency_summary(latencies), total_s=float(sum(latencies)))
+                         for stage, latencies in stage_latencies.items()},
+              "cpu_percent": 100 * cpu_time / wall_time if wall_time else None,
+              "peak_rss_mb": _peak_rss_mb()}
+    for stage, reason in skipped.items():
+        result["stages"][stage] = {"skipped": reason}
+    return result
+
+
+def run_end_to_end(mode, samples_per_second, duration=DEFAULT_END_TO_END_DURATION,
+                   decode_profile=DECODE_CHANNELS):
+    """stream from a real-time emulator through HackEEGBoard for ``duration`` seconds.
+
+    The emulator runs in the same process and thread, so the CPU figures include producing the
+    samples as well as reading them."""
+    mode_name = next(name for name, value in MODES.items() if value == mode)
+    board = HackEEGBoard(f"hackeeg://?samples_per_second={samples_per_second}", decode_profile=decode_profile)
+    board.connect()
+    if mode == HackEEGBoard.BinaryMode:
+        board.binary_mode()
+    elif mode == HackEEGBoard.MessagePackMode:
+        board.messagepack_mode()
+    board.start()
+    board.rdatac()
+
+    block_latencies = []
+    received = 0
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    while time.perf_counter() - wall_start < duration:
+        start = time.perf_counter()
+        block = board.read_rdatac_block()
+        if len(block):
+            block_latencies.append(time.perf_counter() - start)
+            received += len(block)
+    wall_time = time.perf_counter() - wall_start
+    cpu_time = time.process_time() - cpu_start
+    board.stop_and_sdatac_messagepack()
+    board.raw_serial_port.close()
+
+    return {"benchmark": "end_to_end",
+            "mode": mode_name,
+            "samples_per_second": samples_per_second,
+            "duration_s": wall_time,
+            "received_samples": received,
+            "received_sps": received / wall_time,
+            "dropped_samples": board.gap_detector.missing,
+            "gaps": board.gap_detector.counters(),
+            "latency": _latency_summary(block_latencies),
+            "cpu_percent": 100 * cpu_time / wall_time,
+            "peak_rss_mb": _peak_rss_mb()}
+
+
+def run_benchmarks(rates=None, modes=None, duration=DEFAULT_DURATION, block_seconds=DEFAULT_BLOCK_SECONDS,
+                   stages=STAGES, end_to_end=False, end_to_end_duration=DEFAULT_END_TO_END_DURATION,
+                   stream=None, decode_profile=DECODE_CHANNELS, progress=None):
+    """run the pipeline benchmark (and optionally the end-to-end one) for every rate and mode
+    and return a report dict, ready for json.dump().
+
+    ``rates`` default to all of SPEEDS and ``modes`` (names from MODES) to all of them. With
+    ``stream`` (a captured rdatac byte stream) only one rate and one mode make sense; they must
+    match the capture. ``progress`` is called with each result as it comes in."""
+    if rates is None:
+        rates = sorted(SPEEDS.keys())
+    if modes is None:
+        modes = list(MODES.keys())
+    results = []
+    for mode_name in modes:
+        mode = MODES[mode_name]
+        for samples_per_second in rates:
+            if stream is None:
+                number_of_samples = int(samples_per_second * duration)
+                run_stream = synthetic_stream(mode, samples_per_second, number_of_samples)
+            else:
+                number_of_samples = None
+                run_stream = stream
+            runs = [run_pipeline(run_stream, mode, samples_per_second, number_of_samples,
+                                 block_seconds=block_seconds, stages=stages, decode_profile=decode_profile)]
+            if end_to_end:
+                runs.append(run_end_to_end(mode, samples_per_second, end_to_end_duration,
+                                           decode_profile=decode_profile))
+            for result in runs:
+                if progress:
+                    progress(result)
+                results.append(result)
+    return {"system": system_info(),
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "settings": {"duration_s": duration,
+                         "block_seconds": block_seconds,
+                         "stages": list(stages),
+                         "synthetic": stream is None},
+            "results": results}
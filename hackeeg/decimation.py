@@ -0,0 +1,120 @@
+import numpy as np
+
+from .decoder import NUMBER_OF_CHANNELS
+
+DEFAULT_FACTOR = 4
+
+
+class MinMaxPyramid:
+    """Multi-resolution min/max summary of a stream of (N, channels) blocks, for plotting.
+
+    Level 0 holds the last ``capacity`` samples; each level above holds the minimum and maximum of
+    ``factor`` consecutive entries of the one below, so level L has one (min, max) pair per
+    ``factor ** L`` samples. Levels are brought up to date incrementally as blocks are appended;
+    only the new entries (plus the unfinished one before them) are reduced.
+
+    ``query(start, stop, width)`` returns a span of the stream at the coarsest level that still has
+    at least ``width / factor`` entries in it, i.e. at most ``2 * width`` points per channel (a min
+    and a max per entry), so a plot of any span costs about the same whatever its length; since
+    every entry keeps its extremes, peaks are never lost. Samples are addressed by their index in
+    the stream (the count of samples appended before them), which is also the x value returned."""
+
+    def __init__(self, capacity, channels=NUMBER_OF_CHANNELS, factor=DEFAULT_FACTOR, dtype=np.float64):
+        if factor < 2:
+            raise ValueError(f"factor must be at least 2, got {factor}")
+        self.capacity = capacity
+        self.channels = channels
+        self.factor = factor
+        self.dtype = np.dtype(dtype)
+        self.data = np.zeros((capacity, channels), dtype=self.dtype)
+        self.levels = []  # (bucket size, capacity, minimums, maximums) of level 1 upwards
+        bucket = factor
+        while bucket <= capacity:
+            level_capacity = capacity // bucket + 2
+            self.levels.append((bucket, level_capacity, np.zeros((level_capacity, channels), dtype=self.dtype),
+                                np.zeros((level_capacity, channels), dtype=self.dtype)))
+            bucket *= factor
+        self.written = 0
+
+    def reset(self):
+        self.written = 0
+
+    @property
+    def oldest(self):
+        """index of the oldest sample still held"""
+        return max(self.written - self.capacity, 0)
+
+    def append_block(self, channel_data):
+        """append an (N, channels) block of samples"""
+        channel_data = np.asarray(channel_data, dtype=self.dtype).reshape(-1, self.channels)
+        for offset in range(0, len(channel_data), self.capacity):
+            self._append(channel_data[offset:offset + self.capacity])
+
+    def _append(self, channel_data):
+        start = self.written
+        stop = start + len(channel_data)
+        self.data[np.arange(start, stop) % self.capacity] = channel_data
+        self.written = stop
+        # recompute every level's entries from the one that was unfinished before this block up
+        # to the last one that is complete now, from the complete entries of the level below
+        below_minimums = below_maximums = self.data
+        below_capacity = self.capacity
+        below_start, below_stop = start, stop
+        for bucket, capacity, minimums, maximums in self.levels:
+            first, last = below_start // self.factor, below_stop // self.factor
+            if last <= first:
+                break
+            indexes = np.arange(first * self.factor, last * self.factor) % below_capacity
+            minimums[np.arange(first, last) % capacity] = \
+                below_minimums[indexes].reshape(-1, self.factor, self.channels).min(axis=1)
+            maximums[np.arange(first, last) % capacity] = \
+                below_maximums[indexes].reshape(-1, self.factor, self.channels).max(axis=1)
+            below_minimums, below_maximums, below_capacity = minimums, maximums, capacity
+            below_start, below_stop = first, last
+
+    def query(self, start=None, stop=None, width=1000):
+        """samples ``start`` to ``stop`` (default: all that are held) decimated for a plot ``width``
+        pixels wide; returns (x, y): the sample indexes and an (M, channels) array of values, with
+        M at most about ``2 * width``. Decimated entries come out as a min/max pair, both at the
+        index of the entry's first sample."""
+        x, minimums, maximums = self.bounds(start, stop, width)
+        if minimums is maximums:
+            return x, minimums
+        y = np.empty((2 * len(x), self.channels), dtype=self.dtype)
+        y[0::2] = minimums
+        y[1::2] = maximums
+        return np.repeat(x, 2), y
+
+    def bounds(self, start=None, stop=None, width=1000):
+        """like query(), but returns the decimated entries as an envelope: (x, minimums, maximums),
+        with x the index of each entry's first sample. If the span is narrow enough to be shown
+        sample by sample, x are the sample indexes and minimums and maximums are both the samples
+        (the same array)."""
+        start = self.oldest if start is None else max(int(start), self.oldest)
+        stop = self.written if stop is None else min(int(stop), self.written)
+        if stop <= start:
+            empty = np.zeros((0, self.channels), dtype=self.dtype)
+            return np.zeros(0, dtype=np.int64), empty, empty
+        width = max(int(width), 1)
+        if stop - start <= width or not self.levels:
+            indexes = np.arange(start, stop)
+            samples = self.data[indexes % self.capacity]
+            return indexes, samples, samples
+        level = self.levels[-1]
+        for candidate in self.levels:
+            if -(-(stop - start) // candidate[0]) <= width:
+                level = candidate
+                break
+
+        bucket, capacity, minimums, maximums = level
+        first, complete = start // bucket, self.written // bucket
+        last = min(-(-stop // bucket), complete)
+        entries = np.arange(first, last)
+        low, high = minimums[entries % capacity], maximums[entries % capacity]
+        if last * bucket < stop:
+            # the newest entry isn't finished yet; summarize what there is of it from the raw samples
+            tail = self.data[np.arange(last * bucket, stop) % self.capacity]
+            low = np.concatenate((low, tail.min(axis=0, keepdims=True)))
+            high = np.concatenate((high, tail.max(axis=0, keepdims=True)))
+            entries = np.append(entries, last)
+        return entries * bucket, low, high
@@ -0,0 +1,119 @@
+import base64
+import binascii
+
+import numpy as np
+
+NUMBER_OF_CHANNELS = 8
+SAMPLE_RECORD_LENGTH = 35  # 4 bytes timestamp + 4 bytes sample number + 3 bytes status + 8 * 3 bytes channel data
+
+# decode profiles: which fields get decoded for each sample
+DECODE_CHANNELS = 0  # timestamp, sample number and channel data
+DECODE_STATUS = 1  # ... plus the ADS1299 status word fields (lead-off status, GPIO)
+DECODE_FULL = 2  # ... plus the raw data and hex dump, for debugging
+
+DECODE_PROFILES = {"channels": DECODE_CHANNELS,
+                   "status": DECODE_STATUS,
+                   "full": DECODE_FULL}
+
+# one rdatac sample record as sent by the driver; timestamp and sample number are little-endian,
+# the ADS1299 status word and channel samples are big-endian (ADS1299 datasheet, p36)
+SAMPLE_RECORD_DTYPE = np.dtype([('timestamp', '<u4'),
+                                ('sample_number', '<u4'),
+                                ('ads_status', 'u1', (3,)),
+                                ('channel_data', 'u1', (NUMBER_OF_CHANNELS, 3))])
+
+
+class SampleBlock:
+    """A block of decoded rdatac samples, stored column-wise as NumPy arrays.
+
+    ``channel_data`` is an (N, 8) int32 matrix; all other fields are length N vectors. ``missing`` is
+    only set on blocks merged from several boards (see hackeeg.group.StreamMerger): an (N, boards)
+    array of flags for the samples a board didn't deliver."""
+
+    def __init__(self, timestamp, sample_number, channel_data, ads_status=None, ads_gpio=None,
+                 loff_statn=None, loff_statp=None, extra=None, data_raw=None, missing=None):
+        self.timestamp = timestamp
+        self.sample_number = sample_number
+        self.channel_data = channel_data
+        self.ads_status = ads_status
+        self.ads_gpio = ads_gpio
+        self.loff_statn = loff_statn
+        self.loff_statp = loff_statp
+        self.extra = extra
+        self.data_raw = data_raw
+        self.missing = missing
+
+    def __len__(self):
+        return len(self.sample_number)
+
+    @classmethod
+    def empty(cls):
+        return decode_block(b"")
+
+
+def _payload_bytes(payload):
+    if type(payload) is str:
+        try:
+            return base64.b64decode(payload)
+        except binascii.Error:
+            print(f"incorrect padding: {payload}")
+            return b""
+    return bytes(payload)
+
+
+def decode_block(payloads, record_length=SAMPLE_RECORD_LENGTH, profile=DECODE_FULL):
+    """decode a block of rdatac sample payloads in one pass.
+
+    ``payloads`` is either one contiguous bytes-like buffer of back-to-back sample records,
+    or an iterable of individual payloads (bytes, or base64 strings as sent in JSON Lines mode).
+    Payloads of the wrong length are skipped. Fields not included in the decode ``profile``
+    are left as None."""
+    if isinstance(payloads, (bytes, bytearray, memoryview)):
+        buffer = payloads
+    else:
+        buffer = b"".join(payload for payload in map(_payload_bytes, payloads) if len(payload) == record_length)
+
+    dtype = SAMPLE_RECORD_DTYPE
+    if record_length != dtype.itemsize:
+        dtype = np.dtype({'names': dtype.names,
+                          'formats': [dtype.fields[name][0] for name in dtype.names],
+                          'offsets': [dtype.fields[name][1] for name in dtype.names],
+                          'itemsize': record_length})
+    records = np.frombuffer(buffer, dtype=dtype, count=len(buffer) // record_length)
+    number_of_samples = len(records)
+
+    # sign-extend the 24-bit big-endian channel samples: copy each one into the top three bytes
+    # of a big-endian 32-bit word, then shift right arithmetically
+    padded = np.zeros((number_of_samples, NUMBER_OF_CHANNELS, 4), dtype=np.uint8)
+    padded[:, :, :3] = records['channel_data']
+    channel_data = (padded.view('>i4')[:, :, 0] >> 8).astype(np.int32)
+
+    block = SampleBlock(timestamp=records['timestamp'].astype(np.uint32),
+                        sample_number=records['sample_number'].astype(np.uint32),
+                        channel_data=channel_data)
+    if profile >= DECODE_STATUS:
+        status_bytes = records['ads_status'].astype(np.uint32)
+        ads_status = (status_bytes[:, 0] << 16) | (status_bytes[:, 1] << 8) | status_bytes[:, 2]
+        block.ads_status = ads_status
+        block.ads_gpio = (ads_status & 0x0f).astype(np.uint8)
+        block.loff_statn = ((ads_status >> 4) & 0xff).astype(np.uint8)
+        block.loff_statp = ((ads_status >> 12) & 0xff).astype(np.uint8)
+        block.extra = ((ads_status >> 20) & 0xff).astype(np.uint8)
+    if profile >= DECODE_FULL:
+        block.data_raw = np.frombuffer(buffer, dtype=np.uint8,
+                                       count=number_of_samples * record_length).reshape(-1, record_length)
+    return block
+
+
+def encode_block(timestamps, sample_numbers, channel_data, ads_status):
+    """the inverse of decode_block(): pack N samples into back-to-back sample records, as the
+    driver sends them; returns an (N, SAMPLE_RECORD_LENGTH) uint8 array"""
+    number_of_samples = len(timestamps)
+    records = np.zeros(number_of_samples, dtype=SAMPLE_RECORD_DTYPE)
+    records['timestamp'] = np.asarray(timestamps, dtype=np.int64) & 0xffffffff
+    records['sample_number'] = np.asarray(sample_numbers, dtype=np.int64) & 0xffffffff
+    ads_status = np.broadcast_to(np.asarray(ads_status, dtype=np.uint32), (number_of_samples,))
+    records['ads_status'] = np.stack([ads_status >> 16, ads_status >> 8, ads_status], axis=1) & 0xff
+    samples = np.asarray(channel_data, dtype='>i4').reshape(number_of_samples, NUMBER_OF_CHANNELS)
+    records['channel_data'] = samples.view(np.uint8).reshape(number_of_samples, NUMBER_OF_CHANNELS, 4)[:, :, 1:]
+    return records.view(np.uint8).reshape(number_of_samples, SAMPLE_RECORD_LENGTH)
@@ -1,8 +1,10 @@
 import base64
 import binascii
+import collections
 import io
 import json
 import sys
+from concurrent.futures import Future
 from json import JSONDecodeError
 
 import msgpack
@@ -10,6 +12,10 @@ import serial
 import time
 
 from . import ads1299
+from .decoder import decode_block, DECODE_CHANNELS, DECODE_STATUS, DECODE_FULL, SAMPLE_RECORD_LENGTH
+from .framing import BinaryFrameParser, FRAME_LENGTH
+from .gaps import GapDetector
+from .registers import RegisterMap, NUMBER_OF_REGISTERS, READ_ONLY_REGISTERS
 
 # TODO
 # - MessagePack
@@ -17,6 +23,7 @@ from . import ads1299
 
 NUMBER_OF_SAMPLES = 10000
 DEFAULT_BAUDRATE = 115200
+DEFAULT_COMMAND_WINDOW = 16  # commands in flight at once; keeps the firmware's receive buffer from overflowing
 SAMPLE_LENGTH_IN_BYTES = 38  # 216 bits encoded with base64 + '\r\n\'
 
 SPEEDS = {250: ads1299.HIGH_RES_250_SPS,
@@ -26,6 +33,8 @@ SPEEDS = {250: ads1299.HIGH_RES_250_SPS,
           4000: ads1299.HIGH_RES_4k_SPS,
           8000: ads1299.HIGH_RES_8k_SPS,
           16000: ads1299.HIGH_RES_16k_SPS}
+SAMPLE_RATES = {config: samples_per_second for samples_per_second, config in SPEEDS.items()}
+DATA_RATE_MASK = ads1299.DR2 | ads1299.DR1 | ads1299.DR0
 
 GAINS = {1: ads1299.GAIN_1X,
          2: ads1299.GAIN_2X,
@@ -46,13 +55,325 @@ class HackEEGException(Exception):
     pass
 
 
-class HackEEGBoard:
+class RdatacStreamParser:
+    """Splits a raw rdatac byte stream into sample payloads.
+
+    Bytes read from the serial port are fed in with ``feed()``, in whatever chunks they arrive;
+    complete sample payloads are queued until they are collected with ``take()``. In binary mode
+    the payloads are kept back to back in one buffer and ``take()`` returns a bytes object.
+
+    Samples that can't be decoded (JSON Lines that aren't valid JSON, binary frames with a bad CRC)
+    are dropped and counted; ``take_errors()`` collects the count. With ``debug`` they are printed
+    too."""
+
+    def __init__(self, mode, debug=False):
+        self.mode = mode
+        self.debug = debug
+        self.decode_errors = 0
+        self.errors_taken = 0
+        self.message_pack_unpacker = msgpack.Unpacker(raw=False, use_list=False)
+        self.binary_frame_parser = BinaryFrameParser()
+        self.line_buffer = bytearray()
+        self.payloads = collections.deque()
+        self.record_buffer = bytearray()
+
+    def feed(self, chunk):
+        if self.mode == HackEEGBoard.BinaryMode:
+            self.record_buffer += self.binary_frame_parser.feed(chunk)
+        elif self.mode == HackEEGBoard.MessagePackMode:
+            self.message_pack_unpacker.feed(chunk)
+            for message in self.message_pack_unpacker:
+                self._add_message(message)
+        else:
+            self.line_buffer += chunk
+            end = self.line_buffer.rfind(b'\n')
+            if end < 0:
+                return
+            lines = self.line_buffer[:end].split(b'\n')
+            del self.line_buffer[:end + 1]
+            for line in lines:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    message = json.loads(line)
+                except (JSONDecodeError, UnicodeDecodeError):
+                    self.decode_errors += 1
+                    if self.debug:
+                        print(f"json decode error: {line}")
+                    continue
+                self._add_message(message)
+
+    def _add_message(self, message):
+        if not isinstance(message, dict):
+            return
+        status_code = message.get(HackEEGBoard.MpStatusCodeKey, message.get(HackEEGBoard.StatusCodeKey))
+        data = message.get(HackEEGBoard.MpDataKey, message.get(HackEEGBoard.DataKey))
+        if status_code == Status.Ok and data:
+            self.payloads.append(data)
+
+    @property
+    def errors(self):
+        """number of samples dropped because they couldn't be decoded"""
+        return self.decode_errors + self.binary_frame_parser.crc_errors
+
+    def take_errors(self):
+        """number of samples dropped since the last call"""
+        errors = self.errors
+        taken, self.errors_taken = errors - self.errors_taken, errors
+        return taken
+
+    def pending(self):
+        if self.mode == HackEEGBoard.BinaryMode:
+            return len(self.record_buffer) // SAMPLE_RECORD_LENGTH
+        return len(self.payloads)
+
+    def take(self, max_samples=None):
+        if self.mode == HackEEGBoard.BinaryMode:
+            number_of_samples = self.pending()
+            if max_samples is not None:
+                number_of_samples = min(number_of_samples, max_samples)
+            records = bytes(self.record_buffer[:number_of_samples * SAMPLE_RECORD_LENGTH])
+            del self.record_buffer[:number_of_samples * SAMPLE_RECORD_LENGTH]
+            return records
+        if max_samples is None or max_samples >= len(self.payloads):
+            payloads = list(self.payloads)
+            self.payloads.clear()
+        else:
+            payloads = [self.payloads.popleft() for _ in range(max_samples)]
+        return payloads
+
+
+class CommandFuture(Future):
+    """The response to a command submitted to a CommandPipeline. ``result()`` reads responses
+    from the board until this one is in, so it can be called without a thread doing the reading."""
+
+    def __init__(self, pipeline, command, parameters, request_id=None):
+        super().__init__()
+        self.pipeline = pipeline
+        self.command = command
+        self.parameters = parameters
+        self.request_id = request_id
+
+    def result(self, timeout=None):
+        if not self.done():
+            self.pipeline.wait(self)
+        return super().result(timeout)
+
+    def exception(self, timeout=None):
+        if not self.done():
+            self.pipeline.wait(self)
+        return super().exception(timeout)
+
+
+class CommandPipeline:
+    """Pipelined command execution for a HackEEGBoard.
+
+    ``submit()`` queues a command and returns a CommandFuture for its response. Queued commands are
+    written out together, and up to ``window`` commands are kept in flight before the oldest
+    response is waited for, so a run of commands costs about one round trip instead of one per
+    command. Responses are matched to commands in order or, with ``request_ids``, by an ``ID``
+    field added to each command, for firmware that echoes it; responses without an ID are still
+    matched in order. Leaving a ``with`` block waits for every response::
+
+        with board.pipeline() as pipeline:
+            futures = [pipeline.submit("rreg", [register]) for register in range(0x18)]
+        values = [future.result()[board.DataKey] for future in futures]
+
+    The board must not be in rdatac mode. A response that doesn't arrive within the serial port
+    timeout fails its command's future with a HackEEGException, and so does every other command
+    in flight: their responses may still arrive late and would be taken for the responses to the
+    commands after them. The registers those commands write are dropped from the board's register
+    cache, since they may or may not have been written, and the pipeline reads until the response
+    to a ``nop`` sent after them before it goes on."""
+
+    def __init__(self, board, window=DEFAULT_COMMAND_WINDOW, request_ids=False):
+        if window < 1:
+            raise HackEEGException(f"command window must be at least 1, got {window}")
+        self.board = board
+        self.window = window
+        self.request_ids = request_ids
+        self.next_request_id = 1
+        self.unsent = []
+        self.in_flight = collections.deque()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.drain()
+
+    def submit(self, command, parameters=None):
+        """queue a command; returns a CommandFuture for its response"""
+        if self.board.rdatac_mode:
+            raise HackEEGException("commands can't be pipelined in rdatac mode")
+        if parameters is None:
+            parameters = []
+        request_id = None
+        if self.request_ids:
+            request_id = self.next_request_id
+            self.next_request_id += 1
+        future = CommandFuture(self, command, parameters, request_id)
+        while len(self.in_flight) + len(self.unsent) >= self.window:
+            self._send()
+            self._receive()
+        self.unsent.append(future)
+        return future
+
+    def drain(self):
+        """send everything queued and wait for all the responses"""
+        self._send()
+        while self.in_flight:
+            self._receive()
+
+    def wait(self, future):
+        """send everything queued and read responses until ``future`` is done"""
+        self._send()
+        while not future.done() and self.in_flight:
+            self._receive()
+
+    def _send(self):
+        if not self.unsent:
+            return
+        board = self.board
+        lines = []
+        for future in self.unsent:
+            command = {board.CommandKey: future.command, board.ParametersKey: future.parameters}
+            if future.request_id is not None:
+                command[board.RequestIdKey] = future.request_id
+            lines.append(json.dumps(command) + '\n')
+        if board.debug:
+            print(f"pipelined commands: {lines}")
+        # written to the raw port: a write through the text wrapper would throw away responses it
+        # has already read ahead
+        board.raw_serial_port.write("".join(lines).encode())
+        board.raw_serial_port.flush()
+        self.in_flight.extend(self.unsent)
+        self.unsent = []
+
+    def _receive(self):
+        try:
+            response = self.board.read_response()
+        except JSONDecodeError:
+            response = None
+        if response is None:
+            self._resync()
+            return
+        future = None
+        request_id = response.get(self.board.RequestIdKey)
+        if request_id is not None:
+            future = next((waiting for waiting in self.in_flight if waiting.request_id == request_id), None)
+        if future is None:
+            future = self.in_flight[0]
+        self.in_flight.remove(future)
+        self.board._track_registers(future.command, future.parameters, response)
+        future.set_result(response)
+
+    def _resync(self):
+        board = self.board
+        lost = list(self.in_flight)
+        self.in_flight.clear()
+        board._forget_registers((future.command, future.parameters) for future in lost)
+        timed_out = lost[0]
+        for future in lost:
+            message = f"no response to {future.command} {future.parameters}"
+            if future is not timed_out:
+                message += f" (abandoned after no response to {timed_out.command} {timed_out.parameters})"
+            future.set_exception(HackEEGException(message))
+
+        # everything the board still sends for the lost commands comes before the barrier's response
+        barrier = {board.CommandKey: "nop", board.ParametersKey: []}
+        request_id = None
+        if self.request_ids:
+            request_id = self.next_request_id
+            self.next_request_id += 1
+            barrier[board.RequestIdKey] = request_id
+        board.raw_serial_port.write((json.dumps(barrier) + '\n').encode())
+        board.raw_serial_port.flush()
+        for _ in range(len(lost) + 1):
+            try:
+                response = board.read_response()
+            except JSONDecodeError:
+                continue
+            if response is None or (request_id is not None and response.get(board.RequestIdKey) == request_id):
+                break
+
+
+class RegisterCacheMixin:
+    """The register bookkeeping shared by HackEEGBoard and AsyncHackEEGBoard: the register cache
+    (``self.registers``) kept up to date from command responses, and the commands and response
+    checks of register bursts. The boards only add the I/O: running the commands (``wreg``,
+    ``rreg`` and the pipelined ``execute_commands()``), blocking or async."""
+
+    def ok(self, response):
+        return response is not None and response.get(self.StatusCodeKey) == Status.Ok
+
+    def _track_registers(self, command, parameters, response):
+        """keep the register cache (and the gap detector's sample rate) up to date"""
+        if command == "wreg":
+            register, value = parameters
+            if register == ads1299.CONFIG1:
+                self.gap_detector.samples_per_second = SAMPLE_RATES.get(value & DATA_RATE_MASK)
+            if self.ok(response) and register not in READ_ONLY_REGISTERS:
+                self.registers[register] = value
+        elif command == "rreg":
+            if self.ok(response):
+                self.registers[parameters[0]] = response.get(self.DataKey)
+        elif command == "reset":
+            self.registers.invalidate()
+
+    def _forget_registers(self, commands):
+        """drop the registers written by unanswered ``commands`` ((command, parameters) pairs) from
+        the register cache: they may or may not have reached the board"""
+        for command, parameters in commands:
+            if command == "wreg" and 0 <= parameters[0] < NUMBER_OF_REGISTERS:
+                self.registers[parameters[0]] = None
+            elif command == "reset":
+                self.registers.invalidate()
+
+    @staticmethod
+    def _write_commands(writes):
+        return [("wreg", [register, value]) for register, value in writes]
+
+    def _check_writes(self, writes, responses):
+        for (register, value), response in zip(writes, responses):
+            if not self.ok(response):
+                raise HackEEGException(f"could not write register {register:#04x}: {response}")
+        return writes
+
+    @staticmethod
+    def _snapshot_commands():
+        return [("rreg", [register]) for register in range(NUMBER_OF_REGISTERS)]
+
+    def _snapshot_from_responses(self, responses):
+        snapshot = RegisterMap()
+        for register, response in enumerate(responses):
+            if not self.ok(response):
+                raise HackEEGException(f"could not read register {register:#04x}: {response}")
+            snapshot[register] = response.get(self.DataKey)
+        return snapshot
+
+    @staticmethod
+    def _restore_writes(snapshot):
+        """the writes that put every writable register of ``snapshot`` back"""
+        if not isinstance(snapshot, RegisterMap):
+            snapshot = RegisterMap(snapshot)
+        return [(register, value) for register, value in snapshot.items() if register not in READ_ONLY_REGISTERS]
+
+
+class HackEEGBoard(RegisterCacheMixin):
     TextMode = 0
     JsonLinesMode = 1
     MessagePackMode = 2
+    BinaryMode = 3
+
+    DecodeChannels = DECODE_CHANNELS
+    DecodeStatus = DECODE_STATUS
+    DecodeFull = DECODE_FULL
 
     CommandKey = "COMMAND"
     ParametersKey = "PARAMETERS"
+    RequestIdKey = "ID"
     HeadersKey = "HEADERS"
     DataKey = "DATA"
     DecodedDataKey = "DECODED_DATA"
@@ -68,12 +389,18 @@ class HackEEGBoard:
     MaxConnectionAttempts = 10
     ConnectionSleepTime = 0.1
 
-    def __init__(self, serial_port_path=None, baudrate=DEFAULT_BAUDRATE, debug=False):
+    def __init__(self, serial_port_path=None, baudrate=DEFAULT_BAUDRATE, debug=False, decode_profile=DECODE_FULL):
         self.mode = None
         self.message_pack_unpacker = None
         self.debug = debug
+        self.decode_profile = decode_profile
         self.baudrate = baudrate
         self.rdatac_mode = False
+        self.rdatac_parser = None
+        # sample continuity of the current rdatac session; the sample rate is picked up from CONFIG1 writes
+        self.gap_detector = GapDetector()
+        # ADS1299 register values last written or read; None where unknown
+        self.registers = RegisterMap()
         self.serial_port_path = serial_port_path
         if serial_port_path:
             self.raw_serial_port = serial.serial_for_url(serial_port_path, baudrate=self.baudrate, timeout=0.1)
@@ -133,7 +460,8 @@ class HackEEGBoard:
     def _decode_data(self, response):
         """decode ADS1299 sample status bits - datasheet, p36
         The format is:
-        1100 + LOFF_STATP[0:7] + LOFF_STATN[0:7] + bits[4:7] of the GPIOregister"""
+        1100 + LOFF_STATP[0:7] + LOFF_STATN[0:7] + bits[4:7] of the GPIOregister
+        Only the fields in the board's decode profile are added to the response."""
         error = False
         if response:
             data = response.get(self.DataKey)
@@ -146,16 +474,8 @@ class HackEEGBoard:
                         print(f"incorrect padding: {data}")
 
             if data and (type(data) is list or type(data) is bytes):
-                data_hex = ":".join("{:02x}".format(c) for c in data)
-                if error:
-                    print(data_hex)
                 timestamp = int.from_bytes(data[0:4], byteorder='little')
                 sample_number = int.from_bytes(data[4:8], byteorder='little')
-                ads_status = int.from_bytes(data[8:11], byteorder='big')
-                ads_gpio = ads_status & 0x0f
-                loff_statn = (ads_status >> 4) & 0xff
-                loff_statp = (ads_status >> 12) & 0xff
-                extra = (ads_status >> 20) & 0xff
 
                 channel_data = []
                 for channel in range(0, 8):
@@ -165,18 +485,45 @@ class HackEEGBoard:
 
                 response['timestamp'] = timestamp
                 response['sample_number'] = sample_number
-                response['ads_status'] = ads_status
-                response['ads_gpio'] = ads_gpio
-                response['loff_statn'] = loff_statn
-                response['loff_statp'] = loff_statp
-                response['extra'] = extra
                 response['channel_data'] = channel_data
-                response['data_hex'] = data_hex
-                response['data_raw'] = data
+
+                if self.decode_profile >= self.DecodeStatus:
+                    ads_status = int.from_bytes(data[8:11], byteorder='big')
+                    response['ads_status'] = ads_status
+                    response['ads_gpio'] = ads_status & 0x0f
+                    response['loff_statn'] = (ads_status >> 4) & 0xff
+                    response['loff_statp'] = (ads_status >> 12) & 0xff
+                    response['extra'] = (ads_status >> 20) & 0xff
+
+                if self.decode_profile >= self.DecodeFull:
+                    data_hex = ":".join("{:02x}".format(c) for c in data)
+                    if error:
+                        print(data_hex)
+                    response['data_hex'] = data_hex
+                    response['data_raw'] = data
         return response
 
+    def decode_block(self, responses):
+        """decode the sample data of many rdatac responses at once into a SampleBlock"""
+        payloads = []
+        for response in responses:
+            if not response:
+                continue
+            data = response.get(self.DataKey)
+            if data is None:
+                data = response.get(self.MpDataKey)
+            if data:
+                payloads.append(data)
+        return decode_block(payloads, profile=self.decode_profile)
+
     def set_debug(self, debug):
         self.debug = debug
+        if self.rdatac_parser is not None:
+            self.rdatac_parser.debug = debug
+
+    def set_decode_profile(self, decode_profile):
+        """select which sample fields get decoded: DecodeChannels, DecodeStatus or DecodeFull"""
+        self.decode_profile = decode_profile
 
     def read_response(self, serial_port=None):
         """read a response from the Arduino– must be in JSON Lines mode"""
@@ -194,10 +541,25 @@ class HackEEGBoard:
             print(self.format_json(response_obj))
         return self._decode_data(response_obj)
 
+    def _serial_read_binary_frame(self):
+        if self.rdatac_parser is None or self.rdatac_parser.mode != self.mode:
+            self.rdatac_parser = RdatacStreamParser(self.mode, debug=self.debug)
+        while not self.rdatac_parser.pending():
+            chunk = self.raw_serial_port.read(FRAME_LENGTH)
+            if not chunk:
+                return None
+            self.rdatac_parser.feed(chunk)
+        message = {self.MpStatusCodeKey: Status.Ok, self.MpDataKey: self.rdatac_parser.take(1)}
+        if self.debug:
+            print(f"message: {message}")
+        return message
+
     def read_rdatac_response(self):
-        """read a response from the Arduino– JSON Lines or MessagePack mode are ok"""
+        """read a response from the Arduino– JSON Lines, MessagePack or binary mode are ok"""
         if self.mode == self.MessagePackMode:
             response_obj = self._serial_read_messagepack_message()
+        elif self.mode == self.BinaryMode:
+            response_obj = self._serial_read_binary_frame()
         else:
             message = self._serial_readline()
             try:
@@ -215,6 +577,36 @@ class HackEEGBoard:
             pass
         return result
 
+    def read_rdatac_block(self, max_samples=None, timeout=None):
+        """read all samples currently available from the Arduino and decode them as one SampleBlock.
+        JSON Lines, MessagePack or binary mode are ok.
+
+        Everything waiting in the serial port is drained with a single read; at most ``max_samples``
+        samples are returned and the rest are kept for the next call. If nothing is available,
+        waits up to ``timeout`` seconds (default: the serial port timeout) for data to arrive.
+        Don't mix this with read_rdatac_response() in the same rdatac session.
+        Every block is accounted for in ``gap_detector``, and so are the samples that couldn't be
+        decoded."""
+        if self.rdatac_parser is None or self.rdatac_parser.mode != self.mode:
+            self.rdatac_parser = RdatacStreamParser(self.mode, debug=self.debug)
+        parser = self.rdatac_parser
+        if timeout is None:
+            timeout = self.raw_serial_port.timeout or 0
+        deadline = time.perf_counter() + timeout
+        while True:
+            waiting = self.raw_serial_port.in_waiting
+            if waiting or not parser.pending():
+                chunk = self.raw_serial_port.read(waiting or 1)
+                if self.debug:
+                    print(f"read_rdatac_block: {len(chunk)} bytes")
+                if chunk:
+                    parser.feed(chunk)
+            if parser.pending() or time.perf_counter() >= deadline:
+                break
+        block = decode_block(parser.take(max_samples), profile=self.decode_profile)
+        self.gap_detector.update_block(block, corrupt=parser.take_errors())
+        return block
+
     def format_json(self, json_obj):
         return json.dumps(json_obj, indent=4, sort_keys=True)
 
@@ -240,6 +632,38 @@ class HackEEGBoard:
         response = self.read_response(serial_port=serial_port)
         return response
 
+    def pipeline(self, window=DEFAULT_COMMAND_WINDOW, request_ids=False):
+        """a CommandPipeline for submitting several commands without waiting for each response"""
+        return CommandPipeline(self, window=window, request_ids=request_ids)
+
+    def execute_commands(self, commands, window=DEFAULT_COMMAND_WINDOW):
+        """execute several commands, pipelined, saving a round trip per command; ``commands`` are
+        (command, parameters) pairs. Must not be in rdatac mode. Returns the list of responses (None
+        for a command that got no response)."""
+        with self.pipeline(window) as pipeline:
+            futures = [pipeline.submit(command, parameters) for command, parameters in commands]
+        return [None if future.exception() else future.result() for future in futures]
+
+    def apply_registers(self, desired):
+        """bring the ADS1299 registers to ``desired`` (a RegisterMap, dict or (register, value)
+        pairs): only registers whose cached value differs are written, all in one burst. Returns
+        the (register, value) writes made. Must not be in rdatac mode."""
+        return self._write_registers(self.registers.changes(desired))
+
+    def _write_registers(self, writes):
+        return self._check_writes(writes, self.execute_commands(self._write_commands(writes)))
+
+    def snapshot_registers(self):
+        """read the whole ADS1299 register map, ID through WCT2, in one pipelined burst; returns a
+        RegisterMap. Must not be in rdatac mode."""
+        return self._snapshot_from_responses(self.execute_commands(self._snapshot_commands()))
+
+    def restore_registers(self, snapshot):
+        """write every writable register of ``snapshot`` (a RegisterMap, e.g. from
+        snapshot_registers(), or anything RegisterMap() takes) in one pipelined burst, whatever the
+        cached values; returns the (register, value) writes made. Must not be in rdatac mode."""
+        return self._write_registers(self._restore_writes(snapshot))
+
     def _sense_protocol_mode(self):
         try:
             self.send_command("stop")
@@ -249,18 +673,18 @@ class HackEEGBoard:
         except Exception:
             return self.TextMode
 
-    def ok(self, response):
-        return response.get(self.StatusCodeKey) == Status.Ok
-
     def wreg(self, register, value):
         command = "wreg"
         parameters = [register, value]
-        return self.execute_command(command, parameters)
+        response = self.execute_command(command, parameters)
+        self._track_registers(command, parameters, response)
+        return response
 
     def rreg(self, register):
         command = "rreg"
         parameters = [register]
         response = self.execute_command(command, parameters)
+        self._track_registers(command, parameters, response)
         return response
 
     def nop(self):
@@ -285,6 +709,7 @@ class HackEEGBoard:
         return self.send_command("text")
 
     def reset(self):
+        self.registers.invalidate()
         return self.execute_command("reset")
 
     def start(self):
@@ -309,7 +734,7 @@ class HackEEGBoard:
         if old_mode == self.TextMode:
             self.send_text_command("jsonlines")
             return self.read_response()
-        if old_mode == self.JsonLinesMode:
+        if old_mode in (self.JsonLinesMode, self.BinaryMode):
             self.execute_command("jsonlines")
 
     def messagepack_mode(self):
@@ -324,10 +749,25 @@ class HackEEGBoard:
             response = self.execute_command("messagepack")
             return response
 
+    def binary_mode(self):
+        """switch rdatac sample data to raw binary framing (see hackeeg.framing);
+        needs a driver firmware that supports the binary command"""
+        old_mode = self.mode
+        self.mode = self.BinaryMode
+        if old_mode == self.TextMode:
+            self.send_text_command("jsonlines")
+            response = self.read_response()
+            self.execute_command("binary")
+            return response
+        else:
+            response = self.execute_command("binary")
+            return response
+
     def rdatac(self):
         result = self.execute_command("rdatac", serial_port="raw")
         if self.ok(result):
             self.rdatac_mode = True
+            self.gap_detector.reset()
         return result
 
     def sdatac(self):
@@ -337,6 +777,7 @@ class HackEEGBoard:
             self.send_command("sdatac")
             result = self.read_response(serial_port="raw")
         self.rdatac_mode = False
+        self.rdatac_parser = None
         return result
 
     def stop_and_sdatac_messagepack(self):
@@ -345,6 +786,7 @@ class HackEEGBoard:
         self.send_command("stop")
         self.send_command("sdatac")
         self.send_command("nop")
+        self.rdatac_parser = None
         try:
             line = self.serial_port.read()
         except UnicodeDecodeError:
@@ -356,24 +798,27 @@ class HackEEGBoard:
         temp_rdatac_mode = self.rdatac_mode
         if self.rdatac_mode:
             self.sdatac()
-        command = "wreg"
-        parameters = [ads1299.CHnSET + channel, ads1299.ELECTRODE_INPUT | gain]
-        self.execute_command(command, parameters)
+        self.wreg(ads1299.CHnSET + channel, ads1299.ELECTRODE_INPUT | gain)
         if temp_rdatac_mode:
             self.rdatac()
 
     def disable_channel(self, channel):
-        command = "wreg"
-        parameters = [ads1299.CHnSET + channel, ads1299.PDn | ads1299.SHORTED]
-        self.execute_command(command, parameters)
+        self.wreg(ads1299.CHnSET + channel, ads1299.PDn | ads1299.SHORTED)
 
     def enable_all_channels(self):
-        for channel in range(1, 9):
-            self.enable_channel(channel)
+        self._apply_channel_settings(ads1299.ELECTRODE_INPUT | ads1299.GAIN_1X)
 
     def disable_all_channels(self):
-        for channel in range(1, 9):
-            self.disable_channel(channel)
+        self._apply_channel_settings(ads1299.PDn | ads1299.SHORTED)
+
+    def _apply_channel_settings(self, setting):
+        # one burst of writes, and only one sdatac/rdatac round if streaming
+        temp_rdatac_mode = self.rdatac_mode
+        if self.rdatac_mode:
+            self.sdatac()
+        self.apply_registers((ads1299.CHnSET + channel, setting) for channel in range(1, 9))
+        if temp_rdatac_mode:
+            self.rdatac()
 
     def blink_board_led(self):
         self.execute_command("boardledon")
@@ -0,0 +1,452 @@
+import base64
+import json
+import os
+import select
+import threading
+import time
+import tty
+from json import JSONDecodeError
+
+import msgpack
+import numpy as np
+import serial
+
+from . import ads1299
+from .decoder import NUMBER_OF_CHANNELS, encode_block
+from .driver import HackEEGBoard, Status, GAINS, SAMPLE_RATES, DATA_RATE_MASK
+from .framing import DEFAULT_ADS_STATUS, encode_frames
+from .impedance import excitation_frequency, lead_off_current
+from .registers import NUMBER_OF_REGISTERS, READ_ONLY_REGISTERS
+
+# make hackeeg:// URLs available to serial.serial_for_url(), and so to HackEEGBoard and
+# AsyncHackEEGBoard; see hackeeg.protocol_hackeeg
+if 'hackeeg' not in serial.protocol_handler_packages:
+    serial.protocol_handler_packages.append('hackeeg')
+
+EMULATOR_VERSION = "emulator"
+
+# ADS1299 power-on register values (datasheet, p45)
+DEFAULT_REGISTERS = [0x3e, 0x96, 0xc0, 0x60, 0x00] + [0x61] * NUMBER_OF_CHANNELS + [0x00] * 7 + [0x0f] + [0x00] * 5
+
+REFERENCE_VOLTAGE = 4.5  # volts
+CLOCK_FREQUENCY = 2.048e6  # Hz, ADS1299 internal oscillator
+TEMPERATURE_SENSOR_OUTPUT = 145300  # uV at 25 C (datasheet, p29)
+MVDD_OUTPUT = 2.5e6  # uV
+
+CHANNEL_GAINS = {config: gain for gain, config in GAINS.items()}
+GAIN_MASK = ads1299.GAINn2 | ads1299.GAINn1 | ads1299.GAINn0
+MUX_MASK = ads1299.MUXn2 | ads1299.MUXn1 | ads1299.MUXn0
+
+DEFAULT_LINE_FREQUENCY = 60
+DEFAULT_ELECTRODE_IMPEDANCE = 5000.0  # ohms
+DEFAULT_BURST_SAMPLES = 256
+MAX_OUTPUT_BUFFER = 4 * 1024 * 1024
+
+
+class HackEEGEmulator:
+    """Software stand-in for a HackEEG board running the Arduino driver firmware.
+
+    It speaks the driver's command protocol (text and JSON Lines commands, JSON Lines responses)
+    and, in rdatac mode after ``start``, streams synthetic ADS1299 samples in JSON Lines,
+    MessagePack or binary framing. The register file starts at the ADS1299 power-on values and
+    drives the samples: the data rate comes from CONFIG1 and each channel's signal from its
+    CHnSET input mux and gain: electrode input is a 10 Hz sine plus line noise, shorted inputs
+    are noise only, and the test signal follows CONFIG2. With lead-off detection enabled (LOFF,
+    LOFF_SENSP/N), the excitation current flows through ``electrode_impedance`` ohms (one value
+    for all channels or one per channel; ``inf`` for a lead that is off), and with the comparators
+    on (CONFIG4) leads that are off are flagged in the status word.
+
+    ``samples_per_second`` overrides the CONFIG1 data rate, so the emulator can be run faster than
+    any real ADS1299. With ``realtime=True`` samples are produced on the device's schedule; if the
+    host doesn't keep up, samples are dropped (and the sample numbers skip) once
+    ``MAX_OUTPUT_BUFFER`` bytes are waiting, just as the firmware drops them. With ``realtime=False``
+    samples are produced as fast as the host reads them.
+
+    The emulator is byte oriented: the host side ``write()``\\ s commands and ``read()``\\ s responses
+    and samples. It is usually reached through a ``hackeeg://`` pyserial URL or a pty (``serve_pty()``):
+
+        board = HackEEGBoard("hackeeg://?samples_per_second=16000")
+    """
+
+    def __init__(self, samples_per_second=None, realtime=True, line_frequency=DEFAULT_LINE_FREQUENCY,
+                 noise=1.0, seed=None, mode=HackEEGBoard.JsonLinesMode, burst_samples=DEFAULT_BURST_SAMPLES,
+                 electrode_impedance=DEFAULT_ELECTRODE_IMPEDANCE):
+        self.samples_per_second = samples_per_second
+        self.electrode_impedance = np.broadcast_to(np.asarray(electrode_impedance, dtype=np.float64),
+                                                   (NUMBER_OF_CHANNELS,))
+        self.realtime = realtime
+        self.line_frequency = line_frequency
+        self.noise = noise
+        self.random = np.random.default_rng(seed)
+        self.mode = mode
+        self.burst_samples = burst_samples
+        self.registers = list(DEFAULT_REGISTERS)
+        self.input_buffer = bytearray()
+        self.output_buffer = bytearray()
+        self.request_id = None
+        self.lock = threading.RLock()
+        self.boot_time = time.perf_counter()
+        self.started = False
+        self.rdatac_mode = False
+        self.stream_start_time = None
+        self.stream_samples_per_second = None
+        self.samples_generated = 0
+        self.sample_number = 0
+        self.stream_first_sample = 0
+        self.dropped_samples = 0
+        self.pty_thread = None
+        self.pty_running = False
+        self.master_fd = None
+        self.slave_fd = None
+
+    def micros(self):
+        return int((time.perf_counter() - self.boot_time) * 1e6) & 0xffffffff
+
+    def current_samples_per_second(self):
+        if self.samples_per_second:
+            return self.samples_per_second
+        return SAMPLE_RATES.get(self.registers[ads1299.CONFIG1] & DATA_RATE_MASK, 250)
+
+    @property
+    def streaming(self):
+        return self.started and self.rdatac_mode
+
+    # host side
+
+    def write(self, data):
+        """bytes from the host: commands, one per line"""
+        with self.lock:
+            self.input_buffer += data
+            while True:
+                end = self.input_buffer.find(b'\n')
+                if end < 0:
+                    break
+                line = bytes(self.input_buffer[:end]).strip()
+                del self.input_buffer[:end + 1]
+                if line:
+                    self._handle_line(line)
+        return len(data)
+
+    def read(self, size=None):
+        """up to ``size`` bytes of responses and samples for the host (default: all waiting)"""
+        with self.lock:
+            self.update(size)
+            if size is None:
+                size = len(self.output_buffer)
+            data = bytes(self.output_buffer[:size])
+            del self.output_buffer[:size]
+        return data
+
+    @property
+    def in_waiting(self):
+        with self.lock:
+            self.update()
+            return len(self.output_buffer)
+
+    def time_to_next_sample(self):
+        """seconds until the next sample is due, or None if not streaming"""
+        if not self.streaming:
+            return None
+        if not self.realtime:
+            return 0
+        due = self.stream_start_time + self.samples_generated / self.stream_samples_per_second
+        return max(due - time.perf_counter(), 0)
+
+    def update(self, wanted=None):
+        """produce the samples that are due: in real time, everything up to now; otherwise
+        enough bursts to have ``wanted`` bytes (or one burst) waiting"""
+        if not self.streaming:
+            return
+        if self.realtime:
+            elapsed = time.perf_counter() - self.stream_start_time
+            due = int(elapsed * self.stream_samples_per_second) - self.samples_generated
+            if due <= 0:
+                return
+            if len(self.output_buffer) >= MAX_OUTPUT_BUFFER:
+                # the host isn't reading; the samples are lost
+                self.samples_generated += due
+                self.sample_number += due
+                self.dropped_samples += due
+                return
+            self._emit_samples(due)
+        else:
+            wanted = wanted or 1
+            while len(self.output_buffer) < wanted and len(self.output_buffer) < MAX_OUTPUT_BUFFER:
+                self._emit_samples(self.burst_samples)
+
+    # commands
+
+    def _handle_line(self, line):
+        if self.mode == HackEEGBoard.TextMode:
+            words = line.decode('ascii', errors='replace').split()
+            self._execute(words[0].lower(), [int(word, 0) for word in words[1:] if _is_number(word)])
+            return
+        try:
+            command = json.loads(line)
+            name = command[HackEEGBoard.CommandKey]
+            parameters = command.get(HackEEGBoard.ParametersKey) or []
+            request_id = command.get(HackEEGBoard.RequestIdKey)
+        except (JSONDecodeError, UnicodeDecodeError, KeyError, TypeError, AttributeError):
+            self._respond(Status.BadRequest, "Bad Request")
+            return
+        # echo the request ID, if any, so pipelined responses can be matched to their commands
+        self.request_id = request_id
+        try:
+            self._execute(name, parameters)
+        finally:
+            self.request_id = None
+
+    def _execute(self, command, parameters):
+        handler = getattr(self, f"_command_{command}", None)
+        if handler is None:
+            self._respond(Status.BadRequest, "Unknown command")
+            return
+        try:
+            handler(*parameters)
+        except (TypeError, ValueError, IndexError):
+            self._respond(Status.BadRequest, "Bad parameters")
+
+    def _respond(self, status_code=Status.Ok, status_text="Ok", data=None):
+        if self.mode == HackEEGBoard.TextMode:
+            text = f"{status_code} {status_text}"
+            if data is not None:
+                text += f" {data}"
+            self.output_buffer += text.encode() + b'\r\n'
+            return
+        response = {HackEEGBoard.StatusCodeKey: status_code, HackEEGBoard.StatusTextKey: status_text}
+        if data is not None:
+            response[HackEEGBoard.DataKey] = data
+        if self.request_id is not None:
+            response[HackEEGBoard.RequestIdKey] = self.request_id
+        self.output_buffer += json.dumps(response).encode() + b'\r\n'
+
+    def _command_nop(self):
+        self._respond()
+
+    def _command_version(self):
+        self._respond(status_text=EMULATOR_VERSION)
+
+    def _command_status(self):
+        self._respond(data={"rdatac": self.rdatac_mode, "started": self.started,
+                            "dropped_samples": self.dropped_samples})
+
+    def _command_micros(self):
+        self._respond(data=self.micros())
+
+    def _command_text(self):
+        self.mode = HackEEGBoard.TextMode
+        self._respond()
+
+    def _command_jsonlines(self):
+        self.mode = HackEEGBoard.JsonLinesMode
+        self._respond()
+
+    def _command_messagepack(self):
+        self.mode = HackEEGBoard.MessagePackMode
+        self._respond()
+
+    def _command_binary(self):
+        self.mode = HackEEGBoard.BinaryMode
+        self._respond()
+
+    def _command_boardledon(self):
+        self._respond()
+
+    _command_boardledoff = _command_ledon = _command_ledoff = _command_wakeup = _command_standby = _command_boardledon
+
+    def _command_reset(self):
+        self.registers = list(DEFAULT_REGISTERS)
+        self.started = False
+        self.rdatac_mode = False
+        self._respond()
+
+    def _command_start(self):
+        self.started = True
+        self._start_stream()
+        self._respond()
+
+    def _command_stop(self):
+        self.started = False
+        self._respond()
+
+    def _command_rdatac(self):
+        self.rdatac_mode = True
+        self._respond()
+        self._start_stream()
+
+    def _command_sdatac(self):
+        self.rdatac_mode = False
+        self._respond()
+
+    def _command_rdata(self):
+        records = self._sample_records(1)
+        self._respond(data=base64.b64encode(records.tobytes()).decode('ascii'))
+
+    def _command_rreg(self, register):
+        self._respond(data=self.registers[register])
+
+    def _command_wreg(self, register, value):
+        if register not in READ_ONLY_REGISTERS:
+            self.registers[register] = value & 0xff
+        self._respond()
+
+    # sample generation
+
+    def _start_stream(self):
+        if self.streaming:
+            self.stream_start_time = time.perf_counter()
+            self.stream_samples_per_second = self.current_samples_per_second()
+            self.samples_generated = 0
+            self.stream_first_sample = self.sample_number
+
+    def _signal(self, channel, t):
+        """input signal of one channel in microvolts at times ``t``"""
+        setting = self.registers[ads1299.CHnSET + 1 + channel]
+        mux = setting & MUX_MASK
+        noise = self.noise
+        if setting & ads1299.PDn:
+            return np.zeros(len(t))
+        if mux == ads1299.ELECTRODE_INPUT:
+            signal = 20.0 * np.sin(2 * np.pi * 10.0 * t + channel * np.pi / 4)
+            signal += 5.0 * np.sin(2 * np.pi * self.line_frequency * t)
+        elif mux == ads1299.TEST_SIGNAL:
+            config2 = self.registers[ads1299.CONFIG2]
+            amplitude = REFERENCE_VOLTAGE / 2.4 * 1000 * (2 if config2 & ads1299.TEST_AMP else 1)
+            frequency = config2 & (ads1299.TEST_FREQ1 | ads1299.TEST_FREQ0)
+            if frequency == ads1299.TEST_FREQ1 | ads1299.TEST_FREQ0:
+                signal = np.full(len(t), amplitude)
+            else:
+                period = 2 ** (21 - frequency) / CLOCK_FREQUENCY
+                signal = np.where((t % period) < period / 2, amplitude, -amplitude)
+        elif mux == ads1299.TEMP:
+            signal = np.full(len(t), float(TEMPERATURE_SENSOR_OUTPUT))
+        elif mux == ads1299.MVDD:
+            signal = np.full(len(t), MVDD_OUTPUT)
+        elif mux == ads1299.SHORTED:
+            signal = np.zeros(len(t))
+            noise = noise / 2
+        else:
+            signal = np.zeros(len(t))
+        if noise:
+            signal = signal + self.random.normal(0, noise, len(t))
+        return signal
+
+    def _lead_off(self, index, samples_per_second):
+        """lead-off excitation in microvolts, (N, channels), and the LOFF_STATP/N status bits"""
+        sensp, sensn = self.registers[ads1299.LOFF_SENSP], self.registers[ads1299.LOFF_SENSN]
+        excitation = np.zeros((len(index), NUMBER_OF_CHANNELS))
+        if not sensp | sensn:
+            return excitation, 0, 0
+        loff = self.registers[ads1299.LOFF]
+        frequency = excitation_frequency(loff, samples_per_second)
+        if frequency:
+            period = int(round(samples_per_second / frequency))
+            square = np.where(index % period < period / 2, 1.0, -1.0)
+        else:
+            square = np.ones(len(index))
+        enabled = np.array([bool((sensp | sensn) & (1 << channel)) for channel in range(NUMBER_OF_CHANNELS)])
+        off = np.isinf(self.electrode_impedance)
+        # a lead that is off is pulled to the rail
+        amplitude = np.where(off, REFERENCE_VOLTAGE * 1e6, lead_off_current(loff) * self.electrode_impedance * 1e6)
+        excitation[:, enabled] = square[:, np.newaxis] * amplitude[enabled]
+        if not self.registers[ads1299.CONFIG4] & ads1299.PD_LOFF_COMP:
+            return excitation, 0, 0
+        off_mask = sum(1 << channel for channel in range(NUMBER_OF_CHANNELS) if off[channel])
+        return excitation, sensp & off_mask, sensn & off_mask
+
+    def _sample_records(self, number_of_samples):
+        samples_per_second = self.stream_samples_per_second or self.current_samples_per_second()
+        index = np.arange(self.sample_number, self.sample_number + number_of_samples)
+        t = index / samples_per_second
+        if self.stream_start_time is None:
+            timestamps = np.full(number_of_samples, self.micros())
+        else:
+            stream_time = (index - self.stream_first_sample) / samples_per_second
+            timestamps = (self.stream_start_time - self.boot_time + stream_time) * 1e6
+        excitation, loff_statp, loff_statn = self._lead_off(index, samples_per_second)
+        channel_data = np.empty((number_of_samples, NUMBER_OF_CHANNELS), dtype=np.int32)
+        for channel in range(NUMBER_OF_CHANNELS):
+            setting = self.registers[ads1299.CHnSET + 1 + channel]
+            gain = CHANNEL_GAINS.get(setting & GAIN_MASK, 1)
+            signal = self._signal(channel, t)
+            if setting & MUX_MASK == ads1299.ELECTRODE_INPUT and not setting & ads1299.PDn:
+                signal += excitation[:, channel]
+            counts = signal * gain / (REFERENCE_VOLTAGE * 1e6) * 2 ** 23
+            channel_data[:, channel] = np.clip(np.rint(counts), -2 ** 23, 2 ** 23 - 1)
+        ads_status = DEFAULT_ADS_STATUS | (loff_statp << 12) | (loff_statn << 4) | (self.registers[ads1299.GPIO] >> 4)
+        self.sample_number += number_of_samples
+        return encode_block(timestamps.astype(np.int64), index, channel_data, ads_status)
+
+    def sample_stream(self, number_of_samples):
+        """the next ``number_of_samples`` samples as the rdatac byte stream for the current mode"""
+        records = self._sample_records(number_of_samples)
+        if self.mode == HackEEGBoard.BinaryMode:
+            return encode_frames(records)
+        if self.mode == HackEEGBoard.MessagePackMode:
+            return b"".join(msgpack.packb({HackEEGBoard.MpStatusCodeKey: Status.Ok,
+                                           HackEEGBoard.MpDataKey: record.tobytes()}) for record in records)
+        lines = []
+        for record in records:
+            data = base64.b64encode(record.tobytes()).decode('ascii')
+            lines.append(f'{{"C":{Status.Ok},"D":"{data}"}}\r\n')
+        return "".join(lines).encode()
+
+    def _emit_samples(self, number_of_samples):
+        self.output_buffer += self.sample_stream(number_of_samples)
+        self.samples_generated += number_of_samples
+
+    # pty transport
+
+    def serve_pty(self):
+        """serve the emulator on a new pseudo-terminal from a background thread; returns the path
+        of the device to open (e.g. with HackEEGBoard or any other program); ``stop()`` ends it"""
+        self.master_fd, self.slave_fd = os.openpty()
+        tty.setraw(self.slave_fd)
+        os.set_blocking(self.master_fd, False)
+        self.pty_running = True
+        self.pty_thread = threading.Thread(target=self._serve_pty, daemon=True)
+        self.pty_thread.start()
+        return os.ttyname(self.slave_fd)
+
+    def _serve_pty(self):
+        master_fd = self.master_fd
+        while self.pty_running:
+            with self.lock:
+                timeout = self.time_to_next_sample()
+                pending_output = bool(self.output_buffer)
+            if timeout is None or timeout > 0.05:
+                timeout = 0.05
+            readable, writable, _ = select.select([master_fd], [master_fd] if pending_output else [], [], timeout)
+            if readable:
+                try:
+                    data = os.read(master_fd, 65536)
+                except (BlockingIOError, OSError):
+                    data = b""
+                if data:
+                    self.write(data)
+            with self.lock:
+                self.update(65536)
+                if self.output_buffer:
+                    try:
+                        written = os.write(master_fd, self.output_buffer[:65536])
+                    except (BlockingIOError, OSError):
+                        written = 0
+                    del self.output_buffer[:written]
+
+    def stop(self):
+        self.pty_running = False
+        if self.pty_thread is not None:
+            self.pty_thread.join()
+            self.pty_thread = None
+        for fd in (self.master_fd, self.slave_fd):
+            if fd is not None:
+                os.close(fd)
+        self.master_fd = self.slave_fd = None
+
+
+def _is_number(text):
+    try:
+        int(text, 0)
+    except ValueError:
+        return False
+    return True
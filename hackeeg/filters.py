@@ -0,0 +1,218 @@
+from bisect import bisect_left, insort
+
+import numpy as np
+from scipy import signal
+
+from .decoder import NUMBER_OF_CHANNELS
+
+FILTER_TYPES = ('lowpass', 'highpass', 'bandpass', 'bandstop')
+DEFAULT_CROSSFADE_SAMPLES = 256
+DEFAULT_NOTCH_QUALITY = 30
+
+
+class FilterException(Exception):
+    pass
+
+
+def ellip_sos(order, ripple, attenuation, frequencies, samples_per_second, btype='bandpass'):
+    """elliptic filter as second-order sections; ``ripple`` (passband) and ``attenuation`` (stopband)
+    are in dB, ``frequencies`` in Hz (one for lowpass/highpass, two for bandpass/bandstop)"""
+    _check_type(btype)
+    return signal.ellip(order, ripple, attenuation, frequencies, btype=btype, fs=samples_per_second, output='sos')
+
+
+def butter_sos(order, frequencies, samples_per_second, btype='bandpass'):
+    """Butterworth filter as second-order sections; ``frequencies`` in Hz"""
+    _check_type(btype)
+    return signal.butter(order, frequencies, btype=btype, fs=samples_per_second, output='sos')
+
+
+def notch_sos(frequency, samples_per_second, quality=DEFAULT_NOTCH_QUALITY):
+    """notch filter at ``frequency`` Hz (e.g. 50 or 60 Hz line noise) as second-order sections"""
+    b, a = signal.iirnotch(frequency, quality, fs=samples_per_second)
+    return signal.tf2sos(b, a)
+
+
+def cascade(*designs):
+    """chain filter designs (arrays of second-order sections) into one"""
+    return np.vstack([np.atleast_2d(design) for design in designs])
+
+
+def group_delay(sos, frequencies, samples_per_second):
+    """group delay in samples of a filter design (second-order sections) at ``frequencies`` Hz;
+    the delay of a cascade is the sum of the delays of its sections"""
+    frequencies = np.atleast_1d(np.asarray(frequencies, dtype=np.float64))
+    delay = np.zeros(len(frequencies))
+    for section in np.atleast_2d(sos):
+        _, section_delay = signal.group_delay((section[:3], section[3:]), w=frequencies, fs=samples_per_second)
+        delay += section_delay
+    return delay
+
+
+def _check_type(btype):
+    if btype not in FILTER_TYPES:
+        raise FilterException(f"{btype} is not a valid filter type; valid types are {FILTER_TYPES}")
+
+
+class StreamingFilter:
+    """Applies an IIR filter (second-order sections) to a stream of (N, channels) blocks.
+
+    Each block is filtered for all channels in one ``sosfilt`` call; the per-channel filter state
+    is carried over from block to block, so the output is the same as filtering the whole stream
+    at once. The state starts at the filter's steady state for the first sample, which avoids the
+    step transient from the DC offset of the ADC data.
+
+    ``set_design()`` swaps in a new filter while streaming: the new filter starts at its steady
+    state for the last input sample, and the output crossfades from the old filter to the new one
+    over ``crossfade_samples`` samples, so there is no glitch in the output."""
+
+    def __init__(self, sos, channels=NUMBER_OF_CHANNELS, crossfade_samples=DEFAULT_CROSSFADE_SAMPLES):
+        self.sos = np.atleast_2d(np.asarray(sos, dtype=np.float64))
+        self.channels = channels
+        self.crossfade_samples = crossfade_samples
+        self.zi = None
+        self.last_input = None
+        self.fading = None  # (old sos, old state, samples faded so far, crossfade length)
+
+    def reset(self):
+        self.zi = None
+        self.last_input = None
+        self.fading = None
+
+    def _steady_state(self, sos, sample):
+        return signal.sosfilt_zi(sos)[:, :, np.newaxis] * sample[np.newaxis, np.newaxis, :]
+
+    def set_design(self, sos, crossfade_samples=None):
+        """replace the filter; see the class description"""
+        sos = np.atleast_2d(np.asarray(sos, dtype=np.float64))
+        if crossfade_samples is None:
+            crossfade_samples = self.crossfade_samples
+        if self.zi is not None:
+            if crossfade_samples > 0:
+                self.fading = (self.sos, self.zi, 0, crossfade_samples)
+            self.zi = self._steady_state(sos, self.last_input)
+        self.sos = sos
+
+    def process(self, block):
+        """filter an (N, channels) block; returns an (N, channels) float64 array"""
+        block = np.asarray(block, dtype=np.float64).reshape(-1, self.channels)
+        if len(block) == 0:
+            return block
+        if self.zi is None:
+            self.zi = self._steady_state(self.sos, block[0])
+        output, self.zi = signal.sosfilt(self.sos, block, axis=0, zi=self.zi)
+        if self.fading is not None:
+            old_sos, old_zi, faded, length = self.fading
+            old_output, old_zi = signal.sosfilt(old_sos, block, axis=0, zi=old_zi)
+            count = min(length - faded, len(block))
+            weights = ((faded + np.arange(1, count + 1)) / length)[:, np.newaxis]
+            output[:count] = weights * output[:count] + (1 - weights) * old_output[:count]
+            faded += count
+            self.fading = (old_sos, old_zi, faded, length) if faded < length else None
+        self.last_input = block[-1]
+        return output
+
+
+class StreamingMedianFilter:
+    """Running median over ``kernel_size`` samples of a stream of (N, channels) blocks.
+
+    Each channel keeps its last ``kernel_size - 1`` input samples in a sorted list between blocks,
+    so every sample costs one insertion and one removal (a binary search and a short memmove)
+    rather than a sort of the whole window, and nothing is re-filtered. Like
+    ``scipy.signal.medfilt`` the window is centered, so the output lags the input by ``delay``
+    samples; the stream starts as if preceded by copies of its first sample.
+
+    With a ``spike_threshold`` it is a Hampel filter instead: samples further than
+    ``spike_threshold`` scaled median absolute deviations from the window's median are replaced by
+    the median and all others are passed through unchanged. The deviation is found by a binary
+    search in the same sorted window. The input is never modified; it must not contain NaNs."""
+
+    def __init__(self, kernel_size=9, channels=NUMBER_OF_CHANNELS, spike_threshold=None):
+        if kernel_size < 1 or kernel_size % 2 == 0:
+            raise FilterException(f"kernel size must be odd, got {kernel_size}")
+        self.kernel_size = kernel_size
+        self.channels = channels
+        self.spike_threshold = spike_threshold
+        self.history = None
+        self.windows = None
+        self.spikes = 0
+
+    @property
+    def delay(self):
+        return self.kernel_size // 2
+
+    def reset(self):
+        self.history = None
+        self.windows = None
+        self.spikes = 0
+
+    def process(self, block):
+        """filter an (N, channels) block; returns a new (N, channels) float64 array"""
+        block = np.asarray(block, dtype=np.float64).reshape(-1, self.channels)
+        if len(block) == 0:
+            return block
+        if self.history is None:
+            self.history = np.repeat(block[:1], self.kernel_size - 1, axis=0)
+            self.windows = [sorted(column) for column in self.history.T.tolist()]
+        samples = np.concatenate((self.history, block))
+        self.history = samples[len(samples) - (self.kernel_size - 1):]
+        output = np.empty_like(block)
+        for channel, (window, column) in enumerate(zip(self.windows, samples.T.tolist())):
+            if self.spike_threshold is None:
+                output[:, channel] = self._median(window, column)
+            else:
+                output[:, channel] = self._hampel(window, column)
+        return output
+
+    def _median(self, window, column):
+        half = self.delay
+        medians = []
+        for leaving, arriving in zip(column, column[self.kernel_size - 1:]):
+            insort(window, arriving)
+            medians.append(window[half])
+            del window[bisect_left(window, leaving)]
+        return medians
+
+    def _hampel(self, window, column):
+        half = self.delay
+        quarter = half // 2
+        threshold = self.spike_threshold * 1.4826
+        output = []
+        for leaving, center, arriving in zip(column, column[half:], column[self.kernel_size - 1:]):
+            insort(window, arriving)
+            median = window[half]
+            distance = abs(center - median)
+            # at least half of the half + 1 smallest deviations are on one side of the median, so the
+            # median deviation is at least the smaller of the deviations of that rank on either side;
+            # most samples are clearly not spikes by that bound alone
+            if half and distance > threshold * min(median - window[half - quarter],
+                                                   window[half + quarter + 1] - median) and \
+                    distance > threshold * _median_deviation(window, half):
+                output.append(median)
+                self.spikes += 1
+            else:
+                output.append(center)
+            del window[bisect_left(window, leaving)]
+        return output
+
+
+def _median_deviation(window, half):
+    """median absolute deviation from the median of a sorted window of ``2 * half + 1`` values.
+
+    The deviations below the median, a[i] = median - window[half - i] (half + 1 of them), and above
+    it, b[j] = window[half + 1 + j] - median (half of them), are both sorted; the answer is the
+    largest of the half + 1 smallest deviations overall, found by a binary search for how many of
+    those come from a."""
+    median = window[half]
+    low, high = 1, half + 1
+    while low < high:
+        taken = (low + high) // 2
+        # b[half - taken] <= a[taken]: taking ``taken`` from a is enough
+        if window[2 * half + 1 - taken] - median <= median - window[half - taken]:
+            high = taken
+        else:
+            low = taken + 1
+    deviation = median - window[half + 1 - low]
+    if low <= half:
+        deviation = max(deviation, window[2 * half + 1 - low] - median)
+    return deviation
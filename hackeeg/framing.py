@@ -0,0 +1,142 @@
+import struct
+
+import numpy as np
+
+from .decoder import SAMPLE_RECORD_LENGTH
+
+# Raw binary rdatac framing. Each sample is sent as a fixed-length frame:
+#
+#   sync word (2 bytes, 0xA5 0x5A)
+#   sample record (35 bytes): timestamp (uint32 LE), sample number (uint32 LE, the frame sequence number),
+#                             ADS1299 status word (3 bytes BE), 8 channels (3 bytes BE each)
+#   CRC-16/CCITT-FALSE of the sample record (2 bytes BE)
+
+FRAME_SYNC = b'\xa5\x5a'
+FRAME_CRC_LENGTH = 2
+FRAME_LENGTH = len(FRAME_SYNC) + SAMPLE_RECORD_LENGTH + FRAME_CRC_LENGTH
+
+DEFAULT_ADS_STATUS = 0xc00000  # 1100 + no lead-off + GPIO 0
+
+
+def _make_crc16_table():
+    table = []
+    for byte in range(256):
+        crc = byte << 8
+        for _ in range(8):
+            if crc & 0x8000:
+                crc = ((crc << 1) ^ 0x1021) & 0xffff
+            else:
+                crc = (crc << 1) & 0xffff
+        table.append(crc)
+    return table
+
+
+CRC16_TABLE = _make_crc16_table()
+_CRC16_TABLE_ARRAY = np.array(CRC16_TABLE, dtype=np.uint16)
+
+
+def crc16(data):
+    """CRC-16/CCITT-FALSE (polynomial 0x1021, initial value 0xFFFF)"""
+    crc = 0xffff
+    for byte in data:
+        crc = ((crc << 8) & 0xffff) ^ CRC16_TABLE[((crc >> 8) ^ byte) & 0xff]
+    return crc
+
+
+def _crc16_position_tables(length):
+    """per-byte-position tables for ``length``-byte messages, and the CRC of ``length`` zero bytes.
+
+    The CRC is linear: the CRC of a message is the CRC of the same number of zero bytes XORed with
+    the zero-initialised CRC of each byte on its own at its position. Row ``i`` of the table holds
+    the latter for every value of byte ``i``, so the CRC of a row of bytes is one lookup per byte
+    and an XOR-reduce."""
+    tables = np.empty((length, 256), dtype=np.uint16)
+    tables[-1] = _CRC16_TABLE_ARRAY
+    for position in range(length - 2, -1, -1):
+        # run the following byte's entries through one more zero byte
+        crc = tables[position + 1]
+        tables[position] = (crc << 8) ^ _CRC16_TABLE_ARRAY[crc >> 8]
+    return tables.ravel(), np.arange(length, dtype=np.intp) * 256, crc16(bytes(length))
+
+
+_crc16_position_cache = {}
+
+
+def crc16_block(records):
+    """CRC-16/CCITT-FALSE of every row of an (N, L) uint8 array, computed for all rows at once"""
+    length = records.shape[1]
+    if length not in _crc16_position_cache:
+        _crc16_position_cache[length] = _crc16_position_tables(length)
+    tables, offsets, zeros_crc = _crc16_position_cache[length]
+    return np.bitwise_xor.reduce(tables[offsets + records], axis=1) ^ np.uint16(zeros_crc)
+
+
+def encode_frame(timestamp, sample_number, channel_data, ads_status=DEFAULT_ADS_STATUS):
+    """build one binary rdatac frame, as the driver would send it"""
+    record = struct.pack('<II', timestamp & 0xffffffff, sample_number & 0xffffffff)
+    record += ads_status.to_bytes(3, byteorder='big')
+    record += b"".join(int(sample).to_bytes(3, byteorder='big', signed=True) for sample in channel_data)
+    return FRAME_SYNC + record + struct.pack('>H', crc16(record))
+
+
+def encode_frames(records):
+    """build the binary rdatac frames for an (N, SAMPLE_RECORD_LENGTH) uint8 array of sample
+    records (see hackeeg.decoder.encode_block) at once; returns them back to back as bytes"""
+    number_of_frames = len(records)
+    frames = np.empty((number_of_frames, FRAME_LENGTH), dtype=np.uint8)
+    frames[:, 0] = FRAME_SYNC[0]
+    frames[:, 1] = FRAME_SYNC[1]
+    frames[:, len(FRAME_SYNC):-FRAME_CRC_LENGTH] = records
+    crc = crc16_block(records)
+    frames[:, -2] = crc >> 8
+    frames[:, -1] = crc & 0xff
+    return frames.tobytes()
+
+
+class BinaryFrameParser:
+    """Extracts sample records from a stream of binary rdatac frames.
+
+    ``feed()`` takes raw bytes in whatever chunks they arrive from the serial port and returns the
+    sample records of all complete frames with a valid CRC, back to back in one bytes object. Whole
+    runs of aligned frames are checked at once with NumPy; the stream is only searched for the sync
+    word after a bad frame."""
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.crc_errors = 0
+        self.resyncs = 0
+
+    def feed(self, chunk):
+        buffer = self.buffer
+        buffer += chunk
+        records = []
+        while True:
+            start = buffer.find(FRAME_SYNC)
+            if start < 0:
+                # keep a trailing byte that might be the first half of a sync word
+                del buffer[:-1]
+                break
+            if start > 0:
+                del buffer[:start]
+                self.resyncs += 1
+            number_of_frames = len(buffer) // FRAME_LENGTH
+            if number_of_frames == 0:
+                break
+            frames = np.frombuffer(bytes(buffer[:number_of_frames * FRAME_LENGTH]),
+                                   dtype=np.uint8).reshape(number_of_frames, FRAME_LENGTH)
+            payloads = frames[:, len(FRAME_SYNC):len(FRAME_SYNC) + SAMPLE_RECORD_LENGTH]
+            crc = (frames[:, -2].astype(np.uint16) << 8) | frames[:, -1]
+            synced = (frames[:, 0] == FRAME_SYNC[0]) & (frames[:, 1] == FRAME_SYNC[1])
+            bad = np.flatnonzero(~synced | (crc16_block(payloads) != crc))
+            good = bad[0] if len(bad) else number_of_frames
+            records.append(payloads[:good].tobytes())
+            if good < number_of_frames:
+                # a bad sync word or CRC means alignment may be lost (or the frame is damaged);
+                # skip past the start of the bad frame and search for the next sync word
+                if synced[good]:
+                    self.crc_errors += 1
+                del buffer[:good * FRAME_LENGTH + 1]
+            else:
+                del buffer[:number_of_frames * FRAME_LENGTH]
+                break
+        return b"".join(records)
@@ -0,0 +1,124 @@
+import numpy as np
+
+# deviation of the device's inter-sample interval from the nominal one, in microseconds
+DEFAULT_JITTER_BIN_EDGES = (-1000, -500, -100, -50, -10, 10, 50, 100, 500, 1000)
+
+SAMPLE_NUMBER_MODULUS = 2 ** 32
+BACKWARDS_THRESHOLD = 2 ** 31  # a step this big is the counter going backwards, not a gap
+
+
+class GapDetector:
+    """Tracks the continuity of a stream of decoded samples, block by block.
+
+    The driver numbers samples with a 32-bit counter; every step other than +1 (modulo 2**32, so
+    wraparound is not a gap) is counted: a larger step is a gap of ``step - 1`` missing samples, a
+    zero step is a repeated sample and a step of more than 2**31 is the counter going backwards
+    (e.g. the driver restarted). Inter-sample intervals of the device timestamps (microseconds,
+    also 32-bit) between consecutive samples go into a histogram of their deviation from the
+    nominal interval ``1e6 / samples_per_second``, or from the running mean interval if the sample
+    rate isn't known. Samples that arrived but couldn't be decoded (see
+    RdatacStreamParser.take_errors()) are counted as ``corrupt``.
+
+    Only the last sample number and timestamp are kept between blocks, so the state doesn't grow
+    with the length of the capture."""
+
+    def __init__(self, samples_per_second=None, jitter_bin_edges=DEFAULT_JITTER_BIN_EDGES):
+        self.samples_per_second = samples_per_second
+        self.jitter_bin_edges = np.array(jitter_bin_edges, dtype=np.float64)
+        self.reset()
+
+    def reset(self):
+        self.last_sample_number = None
+        self.last_timestamp = None
+        self.samples = 0
+        self.gaps = 0
+        self.missing = 0
+        self.max_gap = 0
+        self.repeated = 0
+        self.backwards = 0
+        self.corrupt = 0
+        self.jitter_histogram = np.zeros(len(self.jitter_bin_edges) + 1, dtype=np.int64)
+        self.intervals = 0
+        self.interval_total = 0
+        self.max_jitter = 0.0
+
+    @property
+    def nominal_interval(self):
+        """expected microseconds between samples"""
+        if self.samples_per_second:
+            return 1e6 / self.samples_per_second
+        if self.intervals:
+            return self.interval_total / self.intervals
+        return None
+
+    def update(self, sample_numbers, timestamps=None):
+        """account for the next block of samples; returns the number of samples missing in it
+        (including any missing between the previous block and this one)"""
+        number_of_samples = len(sample_numbers)
+        if number_of_samples == 0:
+            return 0
+        sample_numbers = np.asarray(sample_numbers, dtype=np.int64)
+        steps = _steps(sample_numbers, self.last_sample_number)
+
+        consecutive = steps == 1
+        gap_steps = steps[(steps > 1) & (steps < BACKWARDS_THRESHOLD)]
+        missing = int((gap_steps - 1).sum())
+        self.gaps += len(gap_steps)
+        self.missing += missing
+        if len(gap_steps):
+            self.max_gap = max(self.max_gap, int(gap_steps.max()) - 1)
+        self.repeated += int(np.count_nonzero(steps == 0))
+        self.backwards += int(np.count_nonzero(steps >= BACKWARDS_THRESHOLD))
+        self.samples += number_of_samples
+        self.last_sample_number = int(sample_numbers[-1])
+
+        if timestamps is not None:
+            timestamps = np.asarray(timestamps, dtype=np.int64)
+            intervals = _steps(timestamps, self.last_timestamp)
+            intervals = intervals[consecutive[len(consecutive) - len(intervals):]]
+            if len(intervals):
+                self.intervals += len(intervals)
+                self.interval_total += int(intervals.sum())
+                jitter = intervals - self.nominal_interval
+                self.jitter_histogram += np.bincount(np.searchsorted(self.jitter_bin_edges, jitter, side='right'),
+                                                     minlength=len(self.jitter_histogram))
+                self.max_jitter = max(self.max_jitter, float(np.abs(jitter).max()))
+            self.last_timestamp = int(timestamps[-1])
+        return missing
+
+    def update_block(self, block, corrupt=0):
+        """account for a SampleBlock, and for ``corrupt`` samples dropped before it because they
+        couldn't be decoded"""
+        self.corrupt += corrupt
+        return self.update(block.sample_number, block.timestamp)
+
+    def counters(self):
+        """the running counters as a JSON-friendly dict"""
+        edges = self.jitter_bin_edges.tolist()
+        labels = [f"<{edges[0]:g}"] + [f"{low:g}..{high:g}" for low, high in zip(edges, edges[1:])] + \
+                 [f">={edges[-1]:g}"]
+        return {"samples": self.samples,
+                "gaps": self.gaps,
+                "missing": self.missing,
+                "max_gap": self.max_gap,
+                "repeated": self.repeated,
+                "backwards": self.backwards,
+                "corrupt": self.corrupt,
+                "mean_interval_us": self.interval_total / self.intervals if self.intervals else None,
+                "max_jitter_us": self.max_jitter,
+                "jitter_histogram_us": dict(zip(labels, self.jitter_histogram.tolist()))}
+
+    def summary(self):
+        loss = 100 * self.missing / (self.samples + self.missing) if self.samples else 0
+        return (f"samples: {self.samples}  missing: {self.missing} ({loss:.3f}%) in {self.gaps} gaps, "
+                f"largest gap: {self.max_gap}  repeated: {self.repeated}  backwards: {self.backwards}  "
+                f"corrupt: {self.corrupt}  "
+                f"max jitter: {self.max_jitter:.0f} us")
+
+
+def _steps(values, last):
+    """differences between successive 32-bit counter values, modulo 2**32, starting from ``last``
+    (if known)"""
+    if last is None:
+        return (values[1:] - values[:-1]) % SAMPLE_NUMBER_MODULUS
+    return np.diff(values, prepend=last) % SAMPLE_NUMBER_MODULUS
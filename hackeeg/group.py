@@ -0,0 +1,352 @@
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from .decoder import NUMBER_OF_CHANNELS, DECODE_CHANNELS, SampleBlock
+from .driver import HackEEGBoard, HackEEGException, DEFAULT_BAUDRATE
+
+TIMESTAMP_MODULUS = 2 ** 32  # device timestamps are 32-bit microsecond counters
+DEFAULT_SYNC_ROUNDS = 16  # micros round trips per clock offset estimate
+DRIFT_WINDOW = 2.0  # seconds of blocks each arrival latency minimum is taken over
+DRIFT_WINDOWS = 8  # latency minima the drift estimate is taken over
+DEFAULT_MAX_LATENCY = 0.5  # seconds a board may fall behind before its samples are marked missing
+READ_TIMEOUT = 0.05  # seconds; how often reader threads check whether they should stop
+
+
+class BoardClock:
+    """Maps one board's device timestamps (microseconds, 32-bit) to host time (``time.perf_counter()``
+    seconds).
+
+    ``estimate()`` measures the offset between the clocks with ``micros`` round trips, keeping the
+    one with the shortest round trip (its error is at most half of it). While streaming, commands
+    can't be sent, so drift is followed from the samples themselves: the arrival time of each block
+    minus the device time of its last sample is the offset plus the transfer latency, and its
+    minimum over a few seconds (the latency floor) moves with the drift between the clocks. The
+    offset is corrected by how far that minimum has moved since the stream started."""
+
+    def __init__(self, offset=None, round_trip=None):
+        self.offset = offset  # host microseconds - device microseconds
+        self.round_trip = round_trip
+        self.reset()
+
+    def reset(self):
+        self.last_raw = None
+        self.last_unwrapped = None
+        self.reference_latency = None
+        self.window_start = None
+        self.window_minimum = None
+        self.minima = []
+        self.drift = 0.0
+
+    def estimate(self, board, rounds=DEFAULT_SYNC_ROUNDS):
+        """estimate the offset with ``rounds`` micros commands; the board must not be in rdatac mode"""
+        best = None
+        for _ in range(rounds):
+            before = time.perf_counter()
+            response = board.micros()
+            after = time.perf_counter()
+            if not board.ok(response):
+                raise HackEEGException(f"micros failed: {response}")
+            round_trip = (after - before) * 1e6
+            if best is None or round_trip < best[0]:
+                best = (round_trip, (before + after) / 2 * 1e6 - response.get(board.DataKey))
+        self.round_trip, self.offset = best
+        self.reset()
+        return self.offset
+
+    def unwrap(self, timestamps):
+        """device timestamps as a continuous int64 count of microseconds (they wrap every 71 minutes)"""
+        raw = np.asarray(timestamps, dtype=np.int64)
+        if len(raw) == 0:
+            return raw
+        if self.last_raw is None:
+            self.last_raw = self.last_unwrapped = int(raw[0])
+        steps = np.diff(raw, prepend=self.last_raw) % TIMESTAMP_MODULUS
+        unwrapped = self.last_unwrapped + np.cumsum(steps)
+        self.last_raw, self.last_unwrapped = int(raw[-1]), int(unwrapped[-1])
+        return unwrapped
+
+    def host_times(self, timestamps, arrival=None):
+        """host times in seconds of a block's device timestamps; ``arrival`` (host seconds) is when
+        the block was read, for following the drift"""
+        if self.offset is None:
+            raise HackEEGException("the clock offset hasn't been estimated")
+        unwrapped = self.unwrap(timestamps)
+        if arrival is not None and len(unwrapped):
+            self._follow(arrival, arrival * 1e6 - unwrapped[-1] - self.offset)
+        return (unwrapped + (self.offset + self.drift)) / 1e6
+
+    def _follow(self, arrival, latency):
+        if self.window_start is None or arrival - self.window_start >= DRIFT_WINDOW:
+            if self.window_minimum is not None and self.reference_latency is None:
+                self.reference_latency = self.window_minimum
+            elif self.window_minimum is not None:
+                self.minima = (self.minima + [self.window_minimum])[-DRIFT_WINDOWS:]
+                self.drift = float(min(self.minima) - self.reference_latency)
+            self.window_start = arrival
+            self.window_minimum = latency
+        else:
+            self.window_minimum = min(self.window_minimum, latency)
+
+
+class StreamMerger:
+    """Merges the sample streams of several boards into one time-aligned stream.
+
+    Blocks are added per board with their samples' host times (see BoardClock). The merged stream
+    is sampled on a common grid, ``1 / samples_per_second`` apart, starting when the last board
+    started (or, if a board is still silent ``max_latency`` seconds after the first one started,
+    when the last of the others started). At each grid time every board contributes its sample
+    nearest in time, so boards whose sample clocks run slightly fast or slow have a sample skipped
+    or repeated now and then instead of drifting apart. A board with no sample within a sample
+    period of a grid time (a silent or stalled board, or several dropped samples) is marked
+    missing there and contributes zeros; a single dropped sample is filled by its neighbour, and
+    counted by the board's gap detector. Grid times are only emitted once every board has data
+    past them, unless a board falls more than ``max_latency`` seconds behind the others; it is then
+    marked missing rather than holding up the rest. So only about ``max_latency`` seconds of
+    samples are ever held, whatever the boards do.
+
+    Added blocks are only queued; they are joined into each board's samples once per ``take()``."""
+
+    def __init__(self, boards, samples_per_second, channels=NUMBER_OF_CHANNELS, max_latency=DEFAULT_MAX_LATENCY):
+        self.boards = boards
+        self.samples_per_second = samples_per_second
+        self.channels = channels
+        self.period = 1.0 / samples_per_second
+        self.max_latency = max_latency
+        self.reset()
+
+    def reset(self):
+        self.times = [np.zeros(0) for _ in range(self.boards)]
+        self.data = [np.zeros((0, self.channels), dtype=np.int32) for _ in range(self.boards)]
+        self.pending = [[] for _ in range(self.boards)]  # (host times, channel data) blocks not yet joined
+        self.start_time = None
+        self.emitted = 0
+        self.missing = np.zeros(self.boards, dtype=np.int64)
+
+    def add(self, board, host_times, channel_data):
+        """add a block of board ``board``'s samples: their host times in seconds and (N, channels) data"""
+        if len(host_times) == 0:
+            return
+        self.pending[board].append((host_times, channel_data))
+
+    def _join_pending(self):
+        for board, blocks in enumerate(self.pending):
+            if blocks:
+                self.times[board] = np.concatenate([self.times[board]] + [times for times, _ in blocks])
+                self.data[board] = np.concatenate([self.data[board]] + [data for _, data in blocks])
+                blocks.clear()
+
+    def take(self):
+        """the merged samples that are complete, as a SampleBlock: ``timestamp`` is the host time in
+        seconds of each grid point, ``sample_number`` its index, ``channel_data`` an (N, boards *
+        channels) array (board by board) and ``missing`` an (N, boards) array of flags"""
+        self._join_pending()
+        latest = [times[-1] if len(times) else -np.inf for times in self.times]
+        if self.start_time is None:
+            firsts = [times[0] for times in self.times if len(times)]
+            if not firsts or (len(firsts) < self.boards and max(latest) - min(firsts) < self.max_latency):
+                return self._block(np.zeros(0), [], np.zeros((0, self.boards), dtype=bool))
+            # boards that are still silent are marked missing until they start
+            self.start_time = max(firsts)
+        horizon = max(min(latest), max(latest) - self.max_latency)
+        count = int(np.floor((horizon - self.start_time) / self.period + 0.5)) + 1 - self.emitted
+        if count <= 0:
+            return self._block(np.zeros(0), [], np.zeros((0, self.boards), dtype=bool))
+        grid = self.start_time + (self.emitted + np.arange(count)) * self.period
+        columns = []
+        missing = np.zeros((count, self.boards), dtype=bool)
+        for board in range(self.boards):
+            times, data = self.times[board], self.data[board]
+            if len(times) == 0:
+                missing[:, board] = True
+                columns.append(np.zeros((count, self.channels), dtype=np.int32))
+                continue
+            after = np.clip(np.searchsorted(times, grid), 1, len(times) - 1) if len(times) > 1 else \
+                np.zeros(count, dtype=np.int64)
+            before = np.maximum(after - 1, 0)
+            nearest = np.where(np.abs(times[before] - grid) <= np.abs(times[after] - grid), before, after)
+            missing[:, board] = np.abs(times[nearest] - grid) > self.period
+            column = data[nearest]
+            column[missing[:, board]] = 0
+            columns.append(column)
+            # keep the samples that may still be nearest to the next grid times
+            keep = max(int(nearest[-1]) - 1, 0)
+            self.times[board], self.data[board] = times[keep:], data[keep:]
+        self.missing += missing.sum(axis=0)
+        self.emitted += count
+        return self._block(grid, columns, missing)
+
+    def _block(self, grid, columns, missing):
+        channel_data = np.hstack(columns) if columns else np.zeros((0, self.boards * self.channels), dtype=np.int32)
+        sample_number = np.arange(self.emitted - len(grid), self.emitted, dtype=np.int64)
+        return SampleBlock(grid, sample_number, channel_data, missing=missing)
+
+
+class BoardGroup:
+    """Several HackEEG boards acquiring together, merged into one stream.
+
+    Boards are connected, configured and stopped in parallel, one thread per board. ``start()``
+    estimates each board's clock offset with ``micros`` round trips (see BoardClock), then releases
+    all the boards at once (a barrier) to start converting, and from then on each board is read by
+    its own reader thread, so a slow board doesn't hold up the others and the serial reads don't
+    wait on the merging. ``read_block()`` merges what the readers have read into time-aligned
+    blocks (see StreamMerger), with the channels of board 0 first::
+
+        with BoardGroup(["/dev/ttyACM0", "/dev/ttyACM1"]) as group:
+            group.connect()
+            group.configure(load_profile("electrodes", samples_per_second=4000))
+            group.start()
+            while ...:
+                block = group.read_block()
+
+    Binary mode is used by default; it has the least framing and decoding work per sample of the
+    three protocol modes (see bin/hackeeg_benchmark.py), which matters with several boards at high
+    sample rates. Per-board dropped samples are in each board's ``gap_detector``."""
+
+    def __init__(self, serial_port_paths, baudrate=DEFAULT_BAUDRATE, debug=False, decode_profile=DECODE_CHANNELS,
+                 max_latency=DEFAULT_MAX_LATENCY):
+        if not serial_port_paths:
+            raise HackEEGException("a board group needs at least one board")
+        self.boards = [HackEEGBoard(path, baudrate=baudrate, debug=debug, decode_profile=decode_profile)
+                       for path in serial_port_paths]
+        self.clocks = [BoardClock() for _ in self.boards]
+        self.max_latency = max_latency
+        self.samples_per_second = None
+        self.merger = None
+        self.incoming = queue.Queue()
+        self.readers = []
+        self.running = threading.Event()
+        self.executor = ThreadPoolExecutor(max_workers=len(self.boards))
+
+    def __len__(self):
+        return len(self.boards)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def channels(self):
+        return NUMBER_OF_CHANNELS * len(self.boards)
+
+    def parallel(self, function, *args):
+        """call ``function(board, *args)`` for every board at once; returns the results in board
+        order, or raises the first board's exception"""
+        futures = [self.executor.submit(function, board, *args) for board in self.boards]
+        return [future.result() for future in futures]
+
+    def connect(self):
+        def connect(board):
+            board.connect()
+            board.sdatac()
+        self.parallel(connect)
+
+    def configure(self, profiles):
+        """apply an acquisition profile (see hackeeg.profiles) to every board, or one profile per
+        board; all profiles must have the same sample rate"""
+        if not isinstance(profiles, (list, tuple)):
+            profiles = [profiles] * len(self.boards)
+        if len(profiles) != len(self.boards):
+            raise HackEEGException(f"{len(self.boards)} boards but {len(profiles)} profiles")
+        rates = {profile.samples_per_second for profile in profiles}
+        if len(rates) > 1:
+            raise HackEEGException(f"all boards must have the same sample rate, got {sorted(rates)}")
+        futures = [self.executor.submit(profile.apply, board) for board, profile in zip(self.boards, profiles)]
+        for future in futures:
+            future.result()
+        self.samples_per_second = rates.pop()
+
+    def estimate_clock_offsets(self, rounds=DEFAULT_SYNC_ROUNDS):
+        """estimate every board's clock offset (host - device, in microseconds); not in rdatac mode"""
+        futures = [self.executor.submit(clock.estimate, board, rounds)
+                   for board, clock in zip(self.boards, self.clocks)]
+        return [future.result() for future in futures]
+
+    def start(self, mode=HackEEGBoard.BinaryMode):
+        """estimate the clock offsets, start all boards together and start the reader threads"""
+        if self.samples_per_second is None:
+            raise HackEEGException("configure() the boards before starting them")
+        if self.running.is_set():
+            return
+        self.estimate_clock_offsets()
+        modes = {HackEEGBoard.BinaryMode: HackEEGBoard.binary_mode,
+                 HackEEGBoard.MessagePackMode: HackEEGBoard.messagepack_mode,
+                 HackEEGBoard.JsonLinesMode: HackEEGBoard.jsonlines_mode}
+        barrier = threading.Barrier(len(self.boards))
+
+        def start(board):
+            modes[mode](board)
+            barrier.wait()
+            board.start()
+            result = board.rdatac()
+            if not board.ok(result):
+                raise HackEEGException(f"rdatac failed: {result}")
+        self.parallel(start)
+
+        self.merger = StreamMerger(len(self.boards), self.samples_per_second, max_latency=self.max_latency)
+        self.incoming = queue.Queue()
+        self.running.set()
+        self.readers = [threading.Thread(target=self._read, args=(index,), daemon=True)
+                        for index in range(len(self.boards))]
+        for reader in self.readers:
+            reader.start()
+
+    def _read(self, index):
+        board = self.boards[index]
+        while self.running.is_set():
+            try:
+                block = board.read_rdatac_block(timeout=READ_TIMEOUT)
+            except Exception as e:
+                self.incoming.put((index, e, None))
+                return
+            if len(block):
+                self.incoming.put((index, block, time.perf_counter()))
+
+    def read_block(self, timeout=None):
+        """merge everything the reader threads have read so far; waits up to ``timeout`` seconds
+        (default: forever) for at least one block to arrive. Returns a SampleBlock, see
+        StreamMerger.take()."""
+        try:
+            items = [self.incoming.get(timeout=timeout)]
+        except queue.Empty:
+            items = []
+        while True:
+            try:
+                items.append(self.incoming.get_nowait())
+            except queue.Empty:
+                break
+        for index, block, arrival in items:
+            if isinstance(block, Exception):
+                raise HackEEGException(f"board {index} failed: {block}") from block
+            host_times = self.clocks[index].host_times(block.timestamp, arrival)
+            self.merger.add(index, host_times, block.channel_data)
+        return self.merger.take()
+
+    def stop(self):
+        """stop the reader threads and take the boards out of rdatac mode"""
+        if not self.running.is_set():
+            return
+        self.running.clear()
+        for reader in self.readers:
+            reader.join()
+        self.readers = []
+
+        def stop(board):
+            board.stop_and_sdatac_messagepack()
+            board.sdatac()
+        self.parallel(stop)
+
+    def gap_counters(self):
+        """the dropped-sample and timing counters of each board"""
+        return [board.gap_detector.counters() for board in self.boards]
+
+    def close(self):
+        self.stop()
+        self.executor.shutdown()
+        for board in self.boards:
+            board.raw_serial_port.close()
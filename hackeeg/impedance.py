@@ -0,0 +1,190 @@
+import numpy as np
+
+from . import ads1299
+from .bdf import REFERENCE_VOLTAGE
+from .decoder import NUMBER_OF_CHANNELS
+from .driver import HackEEGException
+
+# ADS1299 LOFF register fields (datasheet, p47). The ILEAD_OFF_* and FLEAD_OFF_* constants in
+# ads1299 follow the ADS1298 datasheet; on the ADS1299 the currents and frequencies are these.
+LEAD_OFF_CURRENTS = {6e-9: 0x00,
+                     24e-9: ads1299.ILEAD_OFF0,
+                     6e-6: ads1299.ILEAD_OFF1,
+                     24e-6: ads1299.ILEAD_OFF1 | ads1299.ILEAD_OFF0}
+ILEAD_OFF_MASK = ads1299.ILEAD_OFF1 | ads1299.ILEAD_OFF0
+EXCITATION_DC = 0x00
+EXCITATION_7_8_HZ = ads1299.FLEAD_OFF0  # fCLK / 2**18
+EXCITATION_31_2_HZ = ads1299.FLEAD_OFF1  # fCLK / 2**16
+EXCITATION_FDR_4 = ads1299.FLEAD_OFF1 | ads1299.FLEAD_OFF0  # a quarter of the data rate
+FLEAD_OFF_MASK = ads1299.FLEAD_OFF1 | ads1299.FLEAD_OFF0
+COMPARATOR_THRESHOLDS = {95: ads1299.COMP_TH_95,
+                         92.5: ads1299.COMP_TH_92_5,
+                         90: ads1299.COMP_TH_90,
+                         87.5: ads1299.COMP_TH_87_5,
+                         85: ads1299.COMP_TH_85,
+                         80: ads1299.COMP_TH_80,
+                         75: ads1299.COMP_TH_75,
+                         70: ads1299.COMP_TH_70}
+
+CLOCK_FREQUENCY = 2.048e6  # Hz, ADS1299 internal oscillator
+DEFAULT_LEAD_OFF_CURRENT = 6e-9
+DEFAULT_REPORT_INTERVAL = 1.0  # seconds
+
+
+def excitation_frequency(loff, samples_per_second):
+    """frequency in Hz of the lead-off excitation selected by a LOFF register value (0 for DC)"""
+    flead_off = loff & FLEAD_OFF_MASK
+    if flead_off == EXCITATION_7_8_HZ:
+        return CLOCK_FREQUENCY / 2 ** 18
+    if flead_off == EXCITATION_31_2_HZ:
+        return CLOCK_FREQUENCY / 2 ** 16
+    if flead_off == EXCITATION_FDR_4:
+        return samples_per_second / 4
+    return 0.0
+
+
+def lead_off_current(loff):
+    """lead-off excitation current in amperes selected by a LOFF register value"""
+    bits = loff & ILEAD_OFF_MASK
+    return next(current for current, value in LEAD_OFF_CURRENTS.items() if value == bits)
+
+
+class LeadOffMonitor:
+    """Electrode impedance and lead-off monitoring from the streaming samples.
+
+    ``configure()`` sets up AC lead-off detection through ``wreg``: an excitation current of
+    ``current`` amperes, reversing at ``excitation`` (a quarter of the data rate by default, out of
+    the way of the EEG band), on the inputs of ``channels``, with the lead-off comparators at
+    ``threshold`` percent. The excitation shows up in each channel as a square wave of
+    ``current * impedance`` volts.
+
+    ``process()`` demodulates the excitation tone from each block, for all channels at once, by
+    accumulating the samples against a complex reference indexed by sample number (so the phase is
+    right across blocks and dropped samples), together with the lead-off comparator bits from the
+    status word. Every ``report_interval`` seconds the accumulators are turned into a report: the
+    amplitude of the tone, less the DC offset of the window, gives each channel's impedance (of
+    its electrode pair, minus ``series_resistance``) and a lead is reported off if its comparator
+    tripped for more than half of the window. The cost is one small matrix product per block.
+
+    Impedances assume the square wave as it is sampled; calibrate against a known resistor if
+    absolute values matter. Channel data in counts are converted with ``gains`` (one ADS1299 gain
+    for all channels or one per channel)."""
+
+    def __init__(self, samples_per_second, channels=NUMBER_OF_CHANNELS, current=DEFAULT_LEAD_OFF_CURRENT,
+                 excitation=EXCITATION_FDR_4, threshold=95, gains=1, report_interval=DEFAULT_REPORT_INTERVAL,
+                 series_resistance=0.0):
+        if current not in LEAD_OFF_CURRENTS:
+            raise HackEEGException(f"lead-off current must be one of {sorted(LEAD_OFF_CURRENTS)} A, got {current}")
+        if threshold not in COMPARATOR_THRESHOLDS:
+            raise HackEEGException(f"comparator threshold must be one of {sorted(COMPARATOR_THRESHOLDS)} %, "
+                                   f"got {threshold}")
+        if excitation not in (EXCITATION_7_8_HZ, EXCITATION_31_2_HZ, EXCITATION_FDR_4):
+            raise HackEEGException("impedance monitoring needs AC lead-off excitation")
+        self.samples_per_second = samples_per_second
+        self.channels = channels
+        self.current = current
+        self.excitation = excitation
+        self.threshold = threshold
+        self.series_resistance = series_resistance
+        self.report_samples = max(int(report_interval * samples_per_second), 1)
+        self.volts_per_count = (REFERENCE_VOLTAGE / np.broadcast_to(np.asarray(gains, dtype=np.float64), (channels,))
+                                / 2 ** 23)
+        self.frequency = excitation_frequency(self.loff, samples_per_second)
+        # one period of the excitation, in samples (a whole number for every ADS1299 data rate),
+        # as the reference the samples are demodulated against
+        self.period = max(int(round(samples_per_second / self.frequency)), 2)
+        self.reference = np.exp(-2j * np.pi * np.arange(self.period) / self.period)
+        square = np.where(np.arange(self.period) < self.period / 2, 1.0, -1.0)
+        self.square_wave_amplitude = 2 * np.abs(square @ self.reference) / self.period
+        self.latest = None
+        self.reset()
+
+    @property
+    def loff(self):
+        return COMPARATOR_THRESHOLDS[self.threshold] | LEAD_OFF_CURRENTS[self.current] | self.excitation
+
+    def registers(self, channels=None):
+        """(register, value) pairs that enable lead-off detection on ``channels`` (default: all);
+        CONFIG4 is left out, see configure()"""
+        if channels is None:
+            channels = range(self.channels)
+        mask = 0
+        for channel in channels:
+            mask |= 1 << channel
+        return [(ads1299.LOFF, self.loff),
+                (ads1299.LOFF_SENSP, mask),
+                (ads1299.LOFF_SENSN, mask),
+                (ads1299.LOFF_FLIP, 0x00)]
+
+    def _set_comparators(self, board, enable):
+        response = board.rreg(ads1299.CONFIG4)
+        if not board.ok(response):
+            raise HackEEGException(f"could not read CONFIG4: {response}")
+        config4 = response.get(board.DataKey)
+        config4 = config4 | ads1299.PD_LOFF_COMP if enable else config4 & ~ads1299.PD_LOFF_COMP
+        board.wreg(ads1299.CONFIG4, config4)
+
+    def configure(self, board, channels=None):
+        """enable lead-off detection on a HackEEGBoard; the board must not be in rdatac mode"""
+        board.apply_registers(self.registers(channels))
+        self._set_comparators(board, True)
+        self.reset()
+
+    def disable(self, board):
+        """turn lead-off detection off again"""
+        board.apply_registers([(ads1299.LOFF_SENSP, 0x00), (ads1299.LOFF_SENSN, 0x00)])
+        self._set_comparators(board, False)
+
+    def reset(self):
+        self.accumulator = np.zeros(self.channels, dtype=np.complex128)
+        self.reference_sum = 0j
+        self.sample_sum = np.zeros(self.channels)
+        self.leads_off_p = np.zeros(self.channels, dtype=np.int64)
+        self.leads_off_n = np.zeros(self.channels, dtype=np.int64)
+        self.status_samples = 0
+        self.samples = 0
+
+    def process(self, sample_numbers, channel_data, loff_statp=None, loff_statn=None):
+        """account for N samples (sample numbers, an (N, channels) block of channel data in counts and,
+        if decoded, the lead-off status bits); returns a report each time a report interval is
+        complete, None otherwise"""
+        if len(sample_numbers) == 0:
+            return None
+        reference = self.reference[np.asarray(sample_numbers, dtype=np.int64) % self.period]
+        channel_data = np.asarray(channel_data).reshape(-1, self.channels)
+        self.accumulator += reference @ channel_data
+        self.reference_sum += reference.sum()
+        self.sample_sum += channel_data.sum(axis=0)
+        if loff_statp is not None and loff_statn is not None:
+            bits = np.stack((loff_statp, loff_statn), axis=1).astype(np.uint8)[:, :, np.newaxis]
+            counts = np.unpackbits(bits, axis=2, bitorder='little').sum(axis=0, dtype=np.int64)
+            self.leads_off_p += counts[0, :self.channels]
+            self.leads_off_n += counts[1, :self.channels]
+            self.status_samples += len(sample_numbers)
+        self.samples += len(sample_numbers)
+        if self.samples < self.report_samples:
+            return None
+        self.latest = self.report()
+        self.reset()
+        return self.latest
+
+    def process_sample_block(self, block):
+        """account for a SampleBlock, as returned by HackEEGBoard.read_rdatac_block()"""
+        return self.process(block.sample_number, block.channel_data, block.loff_statp, block.loff_statn)
+
+    def report(self):
+        """the current window as a JSON-friendly dict: the excitation amplitude in volts, the impedance
+        in ohms and the lead-off flags of each channel"""
+        mean = self.sample_sum / self.samples if self.samples else 0
+        tone = self.accumulator - mean * self.reference_sum  # without the DC offset
+        amplitude = 2 * np.abs(tone) / max(self.samples, 1) * self.volts_per_count
+        impedance = amplitude / (self.square_wave_amplitude * self.current) - self.series_resistance
+        report = {"samples": self.samples,
+                  "excitation_hz": self.frequency,
+                  "current_a": self.current,
+                  "amplitude_v": amplitude.tolist(),
+                  "impedance_ohms": np.maximum(impedance, 0).tolist()}
+        if self.status_samples:
+            report["leads_off_p"] = (self.leads_off_p * 2 > self.status_samples).tolist()
+            report["leads_off_n"] = (self.leads_off_n * 2 > self.status_samples).tolist()
+        return report
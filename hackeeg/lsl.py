@@ -0,0 +1,139 @@
+import uuid
+
+import numpy as np
+
+try:
+    from pylsl import StreamInfo, StreamOutlet, local_clock
+except (ImportError, RuntimeError):  # pylsl missing, or liblsl can't be loaded
+    StreamInfo = StreamOutlet = local_clock = None
+
+from .bdf import REFERENCE_VOLTAGE
+from .decoder import NUMBER_OF_CHANNELS
+
+DEFAULT_STREAM_NAME = "HackEEG"
+DEFAULT_STREAM_TYPE = "EEG"
+DEFAULT_CLOCK_DRIFT = 100e-6  # how fast the device and host clocks may drift apart, in seconds per second
+
+TIMESTAMP_MODULUS = 2 ** 32
+
+
+class LSLException(Exception):
+    pass
+
+
+class DeviceClock:
+    """Maps the device's sample timestamps onto the LSL clock.
+
+    Device timestamps are microseconds since the Arduino booted, in a 32-bit counter that wraps
+    every 71 minutes; they are unwrapped and shifted by an offset to ``local_clock()`` time. The
+    offset is the smallest difference seen between a block's arrival time and the device time of its
+    last sample, i.e. the one with the least transport delay, so it doesn't jitter with the serial
+    port and USB scheduling; it is allowed to creep up by ``drift`` seconds per second so that a
+    device clock running slow relative to the host's is followed."""
+
+    def __init__(self, clock=None, drift=DEFAULT_CLOCK_DRIFT):
+        self.clock = clock if clock is not None else local_clock
+        self.drift = drift
+        self.reset()
+
+    def reset(self):
+        self.last_timestamp = None
+        self.wrap_offset = 0
+        self.offset = None
+        self.last_update = None
+
+    def unwrap(self, timestamps):
+        """device timestamps as a monotonic int64 microsecond count"""
+        timestamps = np.asarray(timestamps, dtype=np.int64)
+        previous = timestamps[0] if self.last_timestamp is None else self.last_timestamp
+        wraps = np.cumsum(np.diff(timestamps, prepend=previous) < -TIMESTAMP_MODULUS // 2)
+        unwrapped = timestamps + self.wrap_offset + wraps * TIMESTAMP_MODULUS
+        self.wrap_offset += int(wraps[-1]) * TIMESTAMP_MODULUS
+        self.last_timestamp = int(timestamps[-1])
+        return unwrapped
+
+    def to_local(self, timestamps, arrival_time=None):
+        """LSL times (seconds) of the samples with these device timestamps; ``arrival_time`` is the
+        local_clock() time the block was read (default: now)"""
+        if len(timestamps) == 0:
+            return np.zeros(0)
+        device_seconds = self.unwrap(timestamps) / 1e6
+        if arrival_time is None:
+            arrival_time = self.clock()
+        observed = arrival_time - device_seconds[-1]
+        if self.offset is None:
+            self.offset = observed
+        else:
+            self.offset = min(observed, self.offset + self.drift * (arrival_time - self.last_update))
+        self.last_update = arrival_time
+        return device_seconds + self.offset
+
+
+class LSLOutlet:
+    """LSL output stage: pushes decoded blocks to an LSL outlet with ``push_chunk``.
+
+    Each sample is time stamped with its device timestamp mapped onto the LSL clock (see
+    DeviceClock), so consumers see when it was taken rather than when the host got around to it.
+    With ``microvolts=True`` the stream carries float32 microvolts (using ``gains``, one ADS1299
+    gain for all channels or one per channel), otherwise raw int32 ADC counts; with ``filtered=True``
+    (for blocks that have been through a filter, which aren't whole counts any more) the counts are
+    float32 too, so the filter output isn't truncated. Blocks are pushed in
+    chunks of at most ``chunk_size`` samples (default: the whole block), which is also the outlet's
+    transmission chunk size. Needs pylsl."""
+
+    def __init__(self, samples_per_second, channels=NUMBER_OF_CHANNELS, name=DEFAULT_STREAM_NAME,
+                 stream_type=DEFAULT_STREAM_TYPE, source_id=None, microvolts=False, gains=1, chunk_size=None,
+                 labels=None, clock_drift=DEFAULT_CLOCK_DRIFT, filtered=False):
+        if StreamOutlet is None:
+            raise LSLException("LSL output needs pylsl (pip install pylsl)")
+        if source_id is None:
+            source_id = str(uuid.uuid4())
+        if labels is None:
+            labels = [f"Ch{channel + 1}" for channel in range(channels)]
+        self.samples_per_second = samples_per_second
+        self.channels = channels
+        self.microvolts = microvolts
+        self.filtered = filtered
+        self.chunk_size = chunk_size
+        self.scale = (REFERENCE_VOLTAGE * 1e6 / np.broadcast_to(np.asarray(gains, dtype=np.float64), (channels,))
+                      / 2 ** 23).astype(np.float32)
+        self.info = StreamInfo(name, stream_type, channels, samples_per_second,
+                               'float32' if microvolts or filtered else 'int32', source_id)
+        description = self.info.desc()
+        description.append_child_value("manufacturer", "Starcat")
+        description_channels = description.append_child("channels")
+        for label in labels:
+            channel = description_channels.append_child("channel")
+            channel.append_child_value("label", label)
+            channel.append_child_value("unit", "microvolts" if microvolts else "counts")
+            channel.append_child_value("type", stream_type)
+        self.outlet = StreamOutlet(self.info, chunk_size=chunk_size or 0)
+        self.clock = DeviceClock(drift=clock_drift)
+        self.nominal_interval = 1.0 / samples_per_second
+
+    def push_block(self, timestamps, channel_data, arrival_time=None):
+        """push N device timestamps and an (N, channels) block of channel data"""
+        number_of_samples = len(timestamps)
+        if number_of_samples == 0:
+            return
+        times = self.clock.to_local(timestamps, arrival_time)
+        if self.microvolts:
+            data = np.multiply(channel_data, self.scale, dtype=np.float32)
+        elif self.filtered:
+            data = np.ascontiguousarray(channel_data, dtype=np.float32)
+        else:
+            data = np.ascontiguousarray(channel_data, dtype=np.int32)
+        chunk_size = self.chunk_size or number_of_samples
+        for offset in range(0, number_of_samples, chunk_size):
+            chunk_times = times[offset:offset + chunk_size]
+            if len(chunk_times) > 1 and np.ptp(chunk_times) > 1.5 * self.nominal_interval * (len(chunk_times) - 1):
+                # samples are missing; LSL can't derive these time stamps from the sample rate
+                timestamp = chunk_times.tolist()
+            else:
+                # the time stamp of the last sample; LSL derives the others from the sample rate
+                timestamp = float(chunk_times[-1])
+            self.outlet.push_chunk(data[offset:offset + chunk_size], timestamp)
+
+    def push_sample_block(self, block, arrival_time=None):
+        """push a SampleBlock, as returned by HackEEGBoard.read_rdatac_block()"""
+        self.push_block(block.timestamp, block.channel_data, arrival_time)
@@ -0,0 +1,327 @@
+import json
+import os
+
+try:
+    import tomllib
+except ImportError:  # Python < 3.11
+    try:
+        import tomli as tomllib
+    except ImportError:
+        tomllib = None
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+from . import ads1299
+from .decoder import NUMBER_OF_CHANNELS
+from .driver import SPEEDS, GAINS
+from .impedance import LEAD_OFF_CURRENTS, COMPARATOR_THRESHOLDS, DEFAULT_LEAD_OFF_CURRENT, EXCITATION_DC, \
+    EXCITATION_7_8_HZ, EXCITATION_31_2_HZ, EXCITATION_FDR_4
+from .registers import RegisterMap
+
+# channel input multiplexer settings (CHnSET MUX bits); the bias names are the ADS1299's for the
+# ADS1298 RLD_* constants
+INPUTS = {"electrode": ads1299.ELECTRODE_INPUT,
+          "shorted": ads1299.SHORTED,
+          "bias_measure": ads1299.RLD_INPUT,
+          "mvdd": ads1299.MVDD,
+          "temperature": ads1299.TEMP,
+          "test": ads1299.TEST_SIGNAL,
+          "bias_drp": ads1299.BIAS_DRP,
+          "bias_drn": ads1299.BIAS_DRN}
+# internal test signal frequencies (CONFIG2)
+TEST_SIGNALS = {"4hz": ads1299.INT_TEST_4HZ,
+                "8hz": ads1299.INT_TEST_8HZ,
+                "dc": ads1299.INT_TEST_DC}
+# test signal amplitudes, in multiples of VREF / 2.4 mV (CONFIG2)
+TEST_AMPLITUDES = {1: 0x00, 2: ads1299.TEST_AMP}
+# which of a channel's inputs take part in the bias derivation (BIAS_SENSP, BIAS_SENSN)
+BIAS_INPUTS = {False: (False, False), True: (True, True),
+               "p": (True, False), "n": (False, True), "both": (True, True)}
+EXCITATIONS = {"dc": EXCITATION_DC,
+               "7.8hz": EXCITATION_7_8_HZ,
+               "31.2hz": EXCITATION_31_2_HZ,
+               "fdr/4": EXCITATION_FDR_4}
+
+PROFILE_EXTENSIONS = ('.json', '.yaml', '.yml', '.toml')
+PROFILE_KEYS = ("name", "description", "samples_per_second", "gain", "input", "channels", "srb1", "bias",
+                "test_signal", "test_amplitude", "lead_off")
+CHANNEL_KEYS = ("enabled", "gain", "input", "srb2", "bias", "lead_off")
+LEAD_OFF_KEYS = ("current", "excitation", "threshold")
+
+# the setups of the scripts, by name (the gain and sample rate can be overridden, see load_profile())
+BUILTIN_PROFILES = {
+    "electrodes": {"name": "electrodes",
+                   "description": "channels 1-4 on the electrode inputs at the profile gain, 5-8 at 1x",
+                   "channels": {str(channel): {"gain": 1} for channel in range(5, 9)}},
+    "electrodes5": {"name": "electrodes5",
+                    "description": "channels 1-5 on the electrode inputs at the profile gain, 6-8 at 1x",
+                    "channels": {str(channel): {"gain": 1} for channel in range(6, 9)}},
+    "all-electrodes": {"name": "all-electrodes",
+                       "description": "all channels on the electrode inputs at the profile gain"},
+    "shorted": {"name": "shorted",
+                "description": "all inputs shorted, for measuring the noise floor",
+                "input": "shorted"},
+    "test": {"name": "test",
+             "description": "internal test settings for software testing",
+             "test_signal": "4hz",
+             # channel 1 is the value the original setup wrote, INT_TEST_DC | GAIN_1X (0x13)
+             "channels": {"1": {"input": "mvdd", "gain": 2},
+                          "2": {"input": "shorted", "gain": 1},
+                          "3": {"input": "mvdd", "gain": 1},
+                          "4": {"input": "bias_drn", "gain": 1},
+                          "5": {"input": "bias_drp", "gain": 1},
+                          "6": {"input": "temperature", "gain": 1},
+                          "7": {"input": "test", "gain": 1},
+                          "8": "off"}},
+    "shell": {"name": "shell",
+              "description": "the hackeeg_shell setup: single-ended, test signal on channel 5",
+              "samples_per_second": 250,
+              "srb1": True,
+              "channels": {"1": "off",
+                           "2": {"gain": 24},
+                           "3": "off",
+                           "4": "off",
+                           "5": {"input": "test", "gain": 2},
+                           "6": "off",
+                           "7": {"gain": 2},
+                           "8": {"enabled": False, "bias": "p"}}},
+}
+
+
+class ProfileException(Exception):
+    pass
+
+
+def _check_keys(spec, allowed, what):
+    unknown = sorted(set(spec) - set(allowed))
+    if unknown:
+        raise ProfileException(f"unknown {what} setting{'s' if len(unknown) > 1 else ''}: {', '.join(unknown)}")
+
+
+def _choice(value, choices, what):
+    key = value.lower() if isinstance(value, str) else value
+    if key not in choices:
+        raise ProfileException(f"{value!r} is not a valid {what}; valid values are {sorted(choices, key=str)}")
+    return key
+
+
+class AcquisitionProfile:
+    """A declarative ADS1299 acquisition setup, compiled into a register image.
+
+    A profile gives the sample rate, a default ``gain`` and ``input`` for all channels, and for
+    each channel (numbered 1-8) whether it is ``enabled`` and its ``gain``, ``input`` (see INPUTS),
+    ``srb2`` routing, which of its inputs take part in the ``bias`` derivation ("p", "n" or "both")
+    and whether its inputs have ``lead_off`` detection (on for enabled channels if the profile has
+    a ``lead_off`` setting). Globally: ``srb1`` routing, the ``bias`` buffer (power it up, with the
+    internal mid-supply reference), the internal ``test_signal`` and ``test_amplitude``, and the
+    ``lead_off`` excitation (``current``, ``excitation`` and comparator ``threshold``, see
+    hackeeg.impedance). Everything is validated against the SPEEDS and GAINS tables and the ads1299
+    constants when the profile is made; errors raise ProfileException.
+
+    Profiles come from dicts or from JSON, YAML or TOML files (see load_profile()), e.g.::
+
+        {"samples_per_second": 500, "gain": 24,
+         "channels": {"7": {"input": "test", "gain": 1}, "8": "off"},
+         "lead_off": {"current": 6e-9, "excitation": "fdr/4"}}
+
+    ``registers()`` compiles the profile into a RegisterMap, and ``apply()`` brings a board to it
+    with HackEEGBoard.apply_registers(), which writes only the registers that differ, so switching
+    profiles mid-session costs a handful of pipelined writes."""
+
+    def __init__(self, spec=None):
+        spec = dict(spec or {})
+        _check_keys(spec, PROFILE_KEYS, "profile")
+        self.name = spec.get("name")
+        self.description = spec.get("description")
+        self.samples_per_second = spec.get("samples_per_second", 500)
+        if self.samples_per_second not in SPEEDS:
+            raise ProfileException(f"{self.samples_per_second} is not a valid speed; valid speeds are "
+                                   f"{sorted(SPEEDS)}")
+        self.gain = self._gain(spec.get("gain", 1))
+        self.input = _choice(spec.get("input", "electrode"), INPUTS, "input")
+        self.srb1 = bool(spec.get("srb1", False))
+        bias = spec.get("bias", False)
+        self.bias = bool(bias.get("enabled", True) if isinstance(bias, dict) else bias)
+        test_signal = spec.get("test_signal")
+        self.test_signal = None if test_signal is None else _choice(test_signal, TEST_SIGNALS, "test signal")
+        self.test_amplitude = _choice(spec.get("test_amplitude", 1), TEST_AMPLITUDES, "test amplitude")
+        self.lead_off = self._lead_off(spec.get("lead_off"))
+        self.channels = self._channels(spec.get("channels"))
+
+    @staticmethod
+    def _gain(gain):
+        if gain not in GAINS:
+            raise ProfileException(f"{gain} is not a valid gain; valid gains are {sorted(GAINS)}")
+        return gain
+
+    def _lead_off(self, lead_off):
+        if not lead_off:
+            return None
+        if lead_off is True:
+            lead_off = {}
+        _check_keys(lead_off, LEAD_OFF_KEYS, "lead-off")
+        current = lead_off.get("current", DEFAULT_LEAD_OFF_CURRENT)
+        if current not in LEAD_OFF_CURRENTS:
+            raise ProfileException(f"{current} is not a valid lead-off current; valid currents are "
+                                   f"{sorted(LEAD_OFF_CURRENTS)} A")
+        return {"current": current,
+                "excitation": _choice(lead_off.get("excitation", "fdr/4"), EXCITATIONS, "lead-off excitation"),
+                "threshold": _choice(lead_off.get("threshold", 95), COMPARATOR_THRESHOLDS, "comparator threshold")}
+
+    def _channels(self, channels):
+        if channels is None:
+            channels = {}
+        elif isinstance(channels, (list, tuple)):
+            if len(channels) > NUMBER_OF_CHANNELS:
+                raise ProfileException(f"at most {NUMBER_OF_CHANNELS} channels, got {len(channels)}")
+            channels = {channel: settings for channel, settings in enumerate(channels, start=1)}
+        settings_by_channel = {}
+        for channel, settings in channels.items():
+            try:
+                number = int(channel)
+            except ValueError:
+                number = 0
+            if not 1 <= number <= NUMBER_OF_CHANNELS:
+                raise ProfileException(f"channels are numbered 1 to {NUMBER_OF_CHANNELS}, got {channel!r}")
+            settings_by_channel[number] = settings
+        result = []
+        for number in range(1, NUMBER_OF_CHANNELS + 1):
+            settings = settings_by_channel.get(number, {})
+            if settings in ("off", False, None):
+                settings = {"enabled": False}
+            elif settings in ("on", True):
+                settings = {}
+            if not isinstance(settings, dict):
+                raise ProfileException(f"channel {number}: expected settings or 'off', got {settings!r}")
+            _check_keys(settings, CHANNEL_KEYS, f"channel {number}")
+            enabled = bool(settings.get("enabled", True))
+            lead_off = bool(settings.get("lead_off", enabled and self.lead_off is not None))
+            if lead_off and self.lead_off is None:
+                raise ProfileException(f"channel {number}: lead-off detection needs a lead_off setting in the profile")
+            result.append({"enabled": enabled,
+                           "gain": self._gain(settings.get("gain", self.gain)),
+                           "input": _choice(settings.get("input", self.input), INPUTS, "input"),
+                           "srb2": bool(settings.get("srb2", False)),
+                           "bias": _choice(settings.get("bias", False), BIAS_INPUTS, "bias setting"),
+                           "lead_off": lead_off})
+        return result
+
+    def __repr__(self):
+        return f"AcquisitionProfile({self.to_dict()!r})"
+
+    @property
+    def gains(self):
+        """the gain of each channel"""
+        return [channel["gain"] for channel in self.channels]
+
+    def to_dict(self):
+        """the profile as a spec with every setting filled in (JSON friendly)"""
+        return {"name": self.name,
+                "description": self.description,
+                "samples_per_second": self.samples_per_second,
+                "gain": self.gain,
+                "input": self.input,
+                "srb1": self.srb1,
+                "bias": self.bias,
+                "test_signal": self.test_signal,
+                "test_amplitude": self.test_amplitude,
+                "lead_off": self.lead_off,
+                "channels": {str(number): dict(channel) for number, channel in enumerate(self.channels, start=1)}}
+
+    def registers(self):
+        """the register image of this profile, as a RegisterMap; registers a profile doesn't cover
+        (ID, the lead-off status, GPIO, RESP and WCT) are left unknown, so they are never written"""
+        registers = RegisterMap()
+        registers[ads1299.CONFIG1] = SPEEDS[self.samples_per_second] | ads1299.CONFIG1_const
+        config2 = ads1299.CONFIG2_const
+        if self.test_signal is not None:
+            config2 |= TEST_SIGNALS[self.test_signal] | TEST_AMPLITUDES[self.test_amplitude]
+        registers[ads1299.CONFIG2] = config2
+        config3 = ads1299.PD_REFBUF | ads1299.CONFIG3_const
+        if self.bias:
+            config3 |= ads1299.PD_RLD | ads1299.RLDREF_INT
+        registers[ads1299.CONFIG3] = config3
+        if self.lead_off is not None:
+            registers[ads1299.LOFF] = (COMPARATOR_THRESHOLDS[self.lead_off["threshold"]]
+                                       | LEAD_OFF_CURRENTS[self.lead_off["current"]]
+                                       | EXCITATIONS[self.lead_off["excitation"]])
+        else:
+            registers[ads1299.LOFF] = ads1299.LOFF_const
+        bias_p_mask = bias_n_mask = lead_off_mask = 0
+        for index, channel in enumerate(self.channels):
+            if channel["enabled"]:
+                setting = INPUTS[channel["input"]] | GAINS[channel["gain"]]
+            else:
+                setting = ads1299.PDn | ads1299.SHORTED
+            if channel["srb2"]:
+                setting |= ads1299.SRB2n0
+            registers[ads1299.CHnSET + 1 + index] = setting
+            bias_p, bias_n = BIAS_INPUTS[channel["bias"]]
+            if bias_p:
+                bias_p_mask |= 1 << index
+            if bias_n:
+                bias_n_mask |= 1 << index
+            if channel["lead_off"]:
+                lead_off_mask |= 1 << index
+        registers[ads1299.BIAS_SENSP] = bias_p_mask
+        registers[ads1299.BIAS_SENSN] = bias_n_mask
+        registers[ads1299.LOFF_SENSP] = lead_off_mask
+        registers[ads1299.LOFF_SENSN] = lead_off_mask
+        registers[ads1299.LOFF_FLIP] = 0x00
+        registers[ads1299.MISC1] = ads1299.SRB1 if self.srb1 else ads1299.MISC1_const
+        registers[ads1299.CONFIG4] = ads1299.PD_LOFF_COMP if lead_off_mask else ads1299.CONFIG4_const
+        return registers
+
+    def apply(self, board):
+        """bring a HackEEGBoard (not in rdatac mode) to this profile, writing only the registers that
+        differ from its register cache; returns the (register, value) writes made"""
+        return board.apply_registers(self.registers())
+
+    def save(self, path):
+        """write the profile to a JSON file"""
+        with open(path, 'w') as file:
+            json.dump(self.to_dict(), file, indent=4)
+
+
+def read_profile_spec(path):
+    """read a profile spec from a .json, .yaml/.yml or .toml file"""
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.json':
+        with open(path) as file:
+            spec = json.load(file)
+    elif extension in ('.yaml', '.yml'):
+        if yaml is None:
+            raise ProfileException("YAML profiles need PyYAML (pip install pyyaml)")
+        with open(path) as file:
+            spec = yaml.safe_load(file)
+    elif extension == '.toml':
+        if tomllib is None:
+            raise ProfileException("TOML profiles need Python 3.11 or tomli (pip install tomli)")
+        with open(path, 'rb') as file:
+            spec = tomllib.load(file)
+    else:
+        raise ProfileException(f"{path}: profiles must be one of {', '.join(PROFILE_EXTENSIONS)} files")
+    if not isinstance(spec, dict):
+        raise ProfileException(f"{path} does not hold a profile")
+    return spec
+
+
+def load_profile(profile, **overrides):
+    """an AcquisitionProfile from the name of a built-in profile (see BUILTIN_PROFILES), the path of
+    a profile file or a spec dict; ``overrides`` replace top-level settings, e.g.
+    ``load_profile("electrodes", samples_per_second=1000, gain=24)`` (None values are ignored)"""
+    if isinstance(profile, dict):
+        spec = dict(profile)
+    elif profile in BUILTIN_PROFILES:
+        spec = dict(BUILTIN_PROFILES[profile])
+    elif os.path.exists(profile):
+        spec = read_profile_spec(profile)
+        spec.setdefault("name", os.path.splitext(os.path.basename(profile))[0])
+    else:
+        raise ProfileException(f"{profile} is neither a profile file nor one of the built-in profiles "
+                               f"{sorted(BUILTIN_PROFILES)}")
+    spec.update({key: value for key, value in overrides.items() if value is not None})
+    return AcquisitionProfile(spec)
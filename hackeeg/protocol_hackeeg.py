@@ -0,0 +1,138 @@
+# pyserial URL handler for the HackEEG emulator; pyserial finds it as the ``hackeeg`` protocol once
+# ``hackeeg`` is in serial.protocol_handler_packages, which importing hackeeg takes care of.
+#
+# URL format:  hackeeg://[?option=value[&option=value...]]
+# options:
+# - samples_per_second=N  fixed sample rate, overriding the CONFIG1 data rate
+# - realtime=0|1          0: produce samples as fast as they are read (default: 1)
+# - line_frequency=N      line noise frequency in Hz (default: 60)
+# - noise=X               noise amplitude in uV RMS (default: 1.0)
+# - seed=N                random seed, for reproducible samples
+# - electrode_impedance=X electrode impedance in ohms seen by lead-off detection (default: 5000)
+
+import time
+import urllib.parse
+
+from serial.serialutil import SerialBase, SerialException, PortNotOpenError
+
+from .emulator import HackEEGEmulator
+
+
+class Serial(SerialBase):
+    """Serial port implementation connected to an in-process HackEEGEmulator."""
+
+    BAUDRATES = (9600, 19200, 38400, 57600, 115200, 230400, 460800, 921600, 2000000)
+
+    def __init__(self, *args, **kwargs):
+        self.emulator = None
+        super().__init__(*args, **kwargs)
+
+    def open(self):
+        if self.is_open:
+            raise SerialException("Port is already open.")
+        if self._port is None:
+            raise SerialException("Port must be configured before it can be used.")
+        self.emulator = HackEEGEmulator(**self.from_url(self.port))
+        self.is_open = True
+
+    def close(self):
+        self.is_open = False
+        self.emulator = None
+
+    def _reconfigure_port(self):
+        pass
+
+    def from_url(self, url):
+        """parse the URL options into HackEEGEmulator keyword arguments"""
+        parts = urllib.parse.urlsplit(url)
+        if parts.scheme != "hackeeg":
+            raise SerialException(f'expected a string in the form "hackeeg://[?options]": not starting '
+                                  f'with hackeeg:// ({parts.scheme!r})')
+        options = {}
+        try:
+            for option, values in urllib.parse.parse_qs(parts.query).items():
+                value = values[0]
+                if option in ("samples_per_second", "seed", "line_frequency"):
+                    options[option] = int(value)
+                elif option in ("noise", "electrode_impedance"):
+                    options[option] = float(value)
+                elif option == "realtime":
+                    options[option] = value.lower() not in ("0", "false", "no")
+                else:
+                    raise ValueError(f"unknown option: {option!r}")
+        except ValueError as e:
+            raise SerialException(f'expected a string in the form "hackeeg://[?options]": {e}')
+        return options
+
+    @property
+    def in_waiting(self):
+        if not self.is_open:
+            raise PortNotOpenError()
+        return self.emulator.in_waiting
+
+    def read(self, size=1):
+        if not self.is_open:
+            raise PortNotOpenError()
+        data = bytearray(self.emulator.read(size))
+        if self._timeout is not None:
+            deadline = time.perf_counter() + self._timeout
+        while len(data) < size:
+            remaining = None if self._timeout is None else deadline - time.perf_counter()
+            if remaining is not None and remaining <= 0:
+                break
+            wait = self.emulator.time_to_next_sample()
+            if wait is None:
+                # nothing is streaming, so nothing more will arrive until the next write
+                if remaining is None:
+                    wait = 0.01
+                else:
+                    break
+            if remaining is not None:
+                wait = min(wait, remaining)
+            time.sleep(wait)
+            data += self.emulator.read(size - len(data))
+        return bytes(data)
+
+    def write(self, data):
+        if not self.is_open:
+            raise PortNotOpenError()
+        return self.emulator.write(bytes(data))
+
+    def reset_input_buffer(self):
+        if not self.is_open:
+            raise PortNotOpenError()
+        with self.emulator.lock:
+            self.emulator.output_buffer.clear()
+
+    def reset_output_buffer(self):
+        if not self.is_open:
+            raise PortNotOpenError()
+
+    @property
+    def out_waiting(self):
+        return 0
+
+    def _update_break_state(self):
+        pass
+
+    def _update_rts_state(self):
+        pass
+
+    def _update_dtr_state(self):
+        pass
+
+    @property
+    def cts(self):
+        return True
+
+    @property
+    def dsr(self):
+        return True
+
+    @property
+    def ri(self):
+        return False
+
+    @property
+    def cd(self):
+        return True
@@ -0,0 +1,160 @@
+import os
+
+import numpy as np
+
+from .bdf import BDF_VERSION, BDFException, REFERENCE_VOLTAGE
+from .recorder import read_recording, recording_gains
+from .registers import RegisterMap
+
+BDF_HEADER_LENGTH = 256
+
+
+class RecordingReader:
+    """Random access to a recorded session, by sample index or by time.
+
+    Time is measured in seconds from the first sample and maps to sample index ``t * samples_per_second``,
+    so finding a window costs nothing and reading it costs O(window), whatever the size of the file.
+    Subclasses memory-map the file when it is opened and only touch the pages a read needs."""
+
+    samples_per_second = None
+    channels = None
+    number_of_samples = 0
+
+    @property
+    def duration(self):
+        return self.number_of_samples / self.samples_per_second
+
+    def time_to_index(self, t):
+        index = int(round(t * self.samples_per_second))
+        return min(max(index, 0), self.number_of_samples)
+
+    def index_to_time(self, index):
+        return index / self.samples_per_second
+
+    def read(self, channel_slice=slice(None), t_start=0, t_stop=None, microvolts=False):
+        """channel data from ``t_start`` up to ``t_stop`` seconds (default: the end) as an
+        (N, channels) array; ``channel_slice`` is a slice or a list of channel indexes"""
+        start = self.time_to_index(t_start)
+        stop = self.number_of_samples if t_stop is None else self.time_to_index(t_stop)
+        return self.read_samples(channel_slice, start, stop, microvolts=microvolts)
+
+    def read_samples(self, channel_slice=slice(None), start=0, stop=None, microvolts=False):
+        """channel data for sample indexes ``start`` up to ``stop``"""
+        if stop is None:
+            stop = self.number_of_samples
+        start = min(max(start, 0), self.number_of_samples)
+        stop = min(max(stop, start), self.number_of_samples)
+        data = self._read_counts(channel_slice, start, stop)
+        if microvolts:
+            return data * self.scale[channel_slice] + self.offset[channel_slice]
+        return data
+
+    def _read_counts(self, channel_slice, start, stop):
+        raise NotImplementedError
+
+
+class BinaryRecordingReader(RecordingReader):
+    """Reader for HackEEG binary recordings (see hackeeg.recorder)."""
+
+    def __init__(self, path):
+        self.path = path
+        self.metadata, self.records = read_recording(path)
+        self.samples_per_second = self.metadata["samples_per_second"]
+        self.channels = self.metadata["channels"]
+        self.number_of_samples = len(self.records)
+        registers = self.metadata.get("registers")
+        # the ADS1299 register snapshot the recording was made with, if it has one
+        self.registers = RegisterMap.fromhex(registers) if registers else None
+        self.gains = recording_gains(self.metadata)
+        self.scale = REFERENCE_VOLTAGE * 1e6 / np.asarray(self.gains, dtype=np.float64) / 2 ** 23
+        self.offset = np.zeros(self.channels)
+
+    def _read_counts(self, channel_slice, start, stop):
+        return self.records['channel_data'][start:stop, channel_slice]
+
+    def timestamps(self, start=0, stop=None):
+        """device timestamps (microseconds, wrapping at 2**32) for sample indexes ``start`` up to ``stop``"""
+        return self.records['timestamp'][start:stop]
+
+    def sample_numbers(self, start=0, stop=None):
+        return self.records['sample_number'][start:stop]
+
+
+class BDFReader(RecordingReader):
+    """Reader for 24-bit BDF files in which every signal has the same sample rate, like the ones
+    written by hackeeg.bdf.BDFWriter."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as file:
+            header = file.read(BDF_HEADER_LENGTH)
+            if header[:8] != BDF_VERSION:
+                raise BDFException(f"{path} is not a BDF file")
+            header_length = int(header[184:192])
+            number_of_records = int(header[236:244])
+            record_duration = float(header[244:252])
+            channels = int(header[252:256])
+            signal_header = file.read(header_length - BDF_HEADER_LENGTH)
+
+        def fields(offset, length):
+            return [signal_header[offset + i * length:offset + (i + 1) * length].decode('ascii').strip()
+                    for i in range(channels)], offset + channels * length
+
+        offset = 0
+        self.labels, offset = fields(offset, 16)
+        _, offset = fields(offset, 80)
+        self.units, offset = fields(offset, 8)
+        physical_minimum, offset = fields(offset, 8)
+        physical_maximum, offset = fields(offset, 8)
+        digital_minimum, offset = fields(offset, 8)
+        digital_maximum, offset = fields(offset, 8)
+        _, offset = fields(offset, 80)
+        samples_per_record, offset = fields(offset, 8)
+        samples_per_record = set(int(samples) for samples in samples_per_record)
+        if len(samples_per_record) != 1:
+            raise BDFException(f"{path} has signals with different sample rates")
+        self.samples_per_record = samples_per_record.pop()
+
+        self.channels = channels
+        self.samples_per_second = self.samples_per_record / record_duration
+        if self.samples_per_second.is_integer():
+            self.samples_per_second = int(self.samples_per_second)
+        record_length = channels * self.samples_per_record * 3
+        complete_records = (os.path.getsize(path) - header_length) // record_length
+        if number_of_records < 0 or number_of_records > complete_records:
+            # still being written, or cut short
+            number_of_records = complete_records
+        self.number_of_samples = number_of_records * self.samples_per_record
+        if number_of_records:
+            self.data = np.memmap(path, dtype=np.uint8, mode='r', offset=header_length,
+                                  shape=(number_of_records, channels, self.samples_per_record, 3))
+        else:
+            self.data = np.zeros((0, channels, self.samples_per_record, 3), dtype=np.uint8)
+
+        physical_minimum = np.array(physical_minimum, dtype=float)
+        physical_maximum = np.array(physical_maximum, dtype=float)
+        digital_minimum = np.array(digital_minimum, dtype=float)
+        digital_maximum = np.array(digital_maximum, dtype=float)
+        self.scale = (physical_maximum - physical_minimum) / (digital_maximum - digital_minimum)
+        self.offset = physical_minimum - digital_minimum * self.scale
+
+    def _read_counts(self, channel_slice, start, stop):
+        first_record = start // self.samples_per_record
+        last_record = -(-stop // self.samples_per_record)
+        records = self.data[first_record:last_record, channel_slice]
+        number_of_records, channels = records.shape[:2]
+        # sign-extend the 24-bit little-endian samples through a 32-bit view
+        padded = np.zeros((number_of_records, channels, self.samples_per_record, 4), dtype=np.uint8)
+        padded[..., 1:] = records
+        samples = (padded.view('<i4')[..., 0] >> 8).transpose(0, 2, 1).reshape(-1, channels)
+        skip = start - first_record * self.samples_per_record
+        return samples[skip:skip + stop - start]
+
+
+def open_recording(path):
+    """open a HackEEG binary recording or a BDF file for random access reading"""
+    with open(path, 'rb') as file:
+        magic = file.read(len(BDF_VERSION))
+    if magic == BDF_VERSION:
+        return BDFReader(path)
+    return BinaryRecordingReader(path)
@@ -0,0 +1,182 @@
+import json
+import os
+import struct
+import time
+
+import numpy as np
+
+from .decoder import NUMBER_OF_CHANNELS
+from .registers import RegisterMap
+
+# HackEEG binary recording format
+#
+# header:  magic (8 bytes) + format version (uint16 LE) + header length (uint32 LE)
+#          + JSON metadata (UTF-8), padded with spaces to HEADER_ALIGNMENT bytes
+# records: one fixed-size record per sample, see record_dtype(), back to back until the end of the file
+#
+# The metadata holds samples_per_second, gains (the ADS1299 gain of each channel), gain (the gain
+# of all channels if they are the same, for readers of older files), channels, channel_config,
+# registers (a dump of the ADS1299 register map as a hex string, one byte per register from ID to
+# WCT2, see RegisterMap.hex(), if known), device_sample_numbers and the creation time; callers can
+# add more.
+
+RECORDING_MAGIC = b'HACKEEG\x00'
+RECORDING_VERSION = 1
+RECORDING_EXTENSION = '.hackeeg'
+HEADER_STRUCT = struct.Struct('<8sHI')
+HEADER_ALIGNMENT = 512
+
+DEFAULT_BUFFER_SECONDS = 1.0
+DEFAULT_FSYNC_INTERVAL = 5.0
+
+
+class RecordingException(Exception):
+    pass
+
+
+def record_dtype(channels=NUMBER_OF_CHANNELS):
+    return np.dtype([('timestamp', '<u4'),
+                     ('sample_number', '<u4'),
+                     ('channel_data', '<i4', (channels,))])
+
+
+class BinaryRecorder:
+    """Streams sample blocks to a HackEEG binary recording.
+
+    Blocks are collected in a preallocated in-memory buffer and written out with one large
+    sequential write whenever it fills up (by default, once a second's worth of samples); the file
+    is fsync'ed at most every ``fsync_interval`` seconds.
+
+    Callers that don't have the device's sample numbers should pass ``device_sample_numbers=False``;
+    the recorder then numbers the samples itself, and the metadata says so.
+
+    ``gains`` is either one ADS1299 gain for all channels or one gain per channel."""
+
+    def __init__(self, path, samples_per_second, gains=None, channels=NUMBER_OF_CHANNELS, channel_config=None,
+                 registers=None, device_sample_numbers=True, buffer_samples=None,
+                 fsync_interval=DEFAULT_FSYNC_INTERVAL, metadata=None):
+        self.path = path
+        self.channels = channels
+        self.fsync_interval = fsync_interval
+        self.dtype = record_dtype(channels)
+        if buffer_samples is None:
+            buffer_samples = max(int(samples_per_second * DEFAULT_BUFFER_SECONDS), 1)
+        self.buffer = np.zeros(buffer_samples, dtype=self.dtype)
+        self.buffered = 0
+        self.samples_written = 0
+        if isinstance(registers, RegisterMap):
+            registers = registers.hex()
+        if gains is not None and not isinstance(gains, (list, tuple)):
+            gains = [gains] * channels
+        if gains is not None and len(gains) != channels:
+            raise RecordingException(f"got {len(gains)} gains for {channels} channels")
+        self.metadata = {"samples_per_second": samples_per_second,
+                         "gains": None if gains is None else list(gains),
+                         "gain": gains[0] if gains and len(set(gains)) == 1 else None,
+                         "channels": channels,
+                         "channel_config": channel_config,
+                         "registers": registers,
+                         "device_sample_numbers": device_sample_numbers,
+                         "created": time.strftime("%Y-%m-%dT%H:%M:%S%z")}
+        if metadata:
+            self.metadata.update(metadata)
+        self.file = open(path, 'wb')
+        self._write_header()
+        self.last_fsync = time.monotonic()
+
+    def _write_header(self):
+        metadata = json.dumps(self.metadata).encode('utf-8')
+        header_length = HEADER_STRUCT.size + len(metadata)
+        header_length += -header_length % HEADER_ALIGNMENT
+        self.header_length = header_length
+        self.file.write(HEADER_STRUCT.pack(RECORDING_MAGIC, RECORDING_VERSION, header_length))
+        self.file.write(metadata.ljust(header_length - HEADER_STRUCT.size))
+
+    def write_block(self, timestamps, channel_data, sample_numbers=None):
+        """append N timestamps and an (N, channels) block of channel data"""
+        number_of_samples = len(timestamps)
+        if sample_numbers is None:
+            start = self.samples_written + self.buffered
+            sample_numbers = np.arange(start, start + number_of_samples, dtype=np.uint64)
+        offset = 0
+        while offset < number_of_samples:
+            count = min(number_of_samples - offset, len(self.buffer) - self.buffered)
+            records = self.buffer[self.buffered:self.buffered + count]
+            records['timestamp'] = timestamps[offset:offset + count]
+            records['sample_number'] = sample_numbers[offset:offset + count]
+            records['channel_data'] = channel_data[offset:offset + count]
+            self.buffered += count
+            offset += count
+            if self.buffered == len(self.buffer):
+                self.flush()
+
+    def flush(self, fsync=False):
+        if self.buffered:
+            self.file.write(self.buffer[:self.buffered].tobytes())
+            self.samples_written += self.buffered
+            self.buffered = 0
+        now = time.monotonic()
+        if fsync or now - self.last_fsync >= self.fsync_interval:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.last_fsync = now
+
+    def close(self):
+        if self.file.closed:
+            return
+        self.flush(fsync=True)
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def read_recording_header(path):
+    """read the metadata of a HackEEG binary recording; returns (metadata, header_length)"""
+    with open(path, 'rb') as file:
+        fixed = file.read(HEADER_STRUCT.size)
+        if len(fixed) < HEADER_STRUCT.size:
+            raise RecordingException(f"{path} is too short to be a HackEEG recording")
+        magic, version, header_length = HEADER_STRUCT.unpack(fixed)
+        if magic != RECORDING_MAGIC:
+            raise RecordingException(f"{path} is not a HackEEG recording")
+        if version > RECORDING_VERSION:
+            raise RecordingException(f"{path} has unsupported format version {version}")
+        metadata = json.loads(file.read(header_length - HEADER_STRUCT.size).decode('utf-8'))
+    return metadata, header_length
+
+
+def read_recording_registers(path):
+    """the ADS1299 register snapshot of a HackEEG binary recording, as a RegisterMap (None if the
+    recording doesn't have one); HackEEGBoard.restore_registers() puts it back on the board"""
+    metadata, header_length = read_recording_header(path)
+    registers = metadata.get("registers")
+    return RegisterMap.fromhex(registers) if registers else None
+
+
+def recording_gains(metadata):
+    """the ADS1299 gain of each channel of a recording, from its metadata: the recorded gains, else
+    the CHnSET registers of its register snapshot, else (older recordings) its one gain, else 1"""
+    channels = metadata["channels"]
+    if metadata.get("gains"):
+        return list(metadata["gains"])
+    if metadata.get("registers") and channels <= NUMBER_OF_CHANNELS:
+        gains = RegisterMap.fromhex(metadata["registers"]).channel_gains()[:channels]
+        if None not in gains:
+            return gains
+    return [metadata.get("gain") or 1] * channels
+
+
+def read_recording(path):
+    """memory-map a HackEEG binary recording; returns (metadata, records), where records is a
+    read-only structured array with timestamp, sample_number and channel_data fields"""
+    metadata, header_length = read_recording_header(path)
+    dtype = record_dtype(metadata["channels"])
+    number_of_samples = (os.path.getsize(path) - header_length) // dtype.itemsize
+    if number_of_samples == 0:
+        return metadata, np.zeros(0, dtype=dtype)
+    records = np.memmap(path, dtype=dtype, mode='r', offset=header_length, shape=(number_of_samples,))
+    return metadata, records
@@ -0,0 +1,131 @@
+from . import ads1299
+
+# the ADS1299 register file in address order, ID through WCT2
+REGISTER_NAMES = ("ID", "CONFIG1", "CONFIG2", "CONFIG3", "LOFF",
+                  "CH1SET", "CH2SET", "CH3SET", "CH4SET", "CH5SET", "CH6SET", "CH7SET", "CH8SET",
+                  "BIAS_SENSP", "BIAS_SENSN", "LOFF_SENSP", "LOFF_SENSN", "LOFF_FLIP",
+                  "LOFF_STATP", "LOFF_STATN", "GPIO", "MISC1", "RESP", "CONFIG4", "WCT1", "WCT2")
+REGISTERS = {name: getattr(ads1299, name) for name in REGISTER_NAMES}
+NUMBER_OF_REGISTERS = len(REGISTER_NAMES)
+READ_ONLY_REGISTERS = (ads1299.ID, ads1299.LOFF_STATP, ads1299.LOFF_STATN)
+CHANNEL_SET_REGISTERS = tuple(REGISTERS[f"CH{channel}SET"] for channel in range(1, 9))
+GAIN_MASK = ads1299.GAINn2 | ads1299.GAINn1 | ads1299.GAINn0
+# PGA gain selected by the GAINn bits of a CHnSET register
+CHANNEL_GAINS = {ads1299.GAIN_1X: 1,
+                 ads1299.GAIN_2X: 2,
+                 ads1299.GAIN_4X: 4,
+                 ads1299.GAIN_6X: 6,
+                 ads1299.GAIN_8X: 8,
+                 ads1299.GAIN_12X: 12,
+                 ads1299.GAIN_24X: 24}
+
+
+class RegisterMap:
+    """Mirror of the ADS1299 register file, ID through WCT2.
+
+    Each register holds its value, or None if it isn't known (or, in a map of desired settings,
+    doesn't matter). Registers are addressed by number or by name::
+
+        desired = RegisterMap()
+        desired[ads1299.CONFIG1] = SPEEDS[500] | ads1299.CONFIG1_const
+        desired["MISC1"] = ads1299.MISC1_const
+
+    HackEEGBoard keeps one as a cache of the values it last wrote to or read from the board;
+    ``changes()`` diffs a map of desired settings against it, so that only the registers that differ
+    have to be written (see HackEEGBoard.apply_registers()).
+
+    A complete map (e.g. from HackEEGBoard.snapshot_registers()) packs into one byte per register
+    with ``to_bytes()``, or a hex string with ``hex()``, which is how recordings store it."""
+
+    def __init__(self, values=None):
+        self.values = [None] * NUMBER_OF_REGISTERS
+        if values is not None:
+            self.update(values)
+
+    @staticmethod
+    def address(register):
+        if isinstance(register, str):
+            try:
+                return REGISTERS[register]
+            except KeyError:
+                raise KeyError(f"unknown register: {register}") from None
+        if not 0 <= register < NUMBER_OF_REGISTERS:
+            raise KeyError(f"register address out of range: {register:#04x}")
+        return register
+
+    def __getitem__(self, register):
+        return self.values[self.address(register)]
+
+    def __setitem__(self, register, value):
+        if value is not None and not 0 <= value <= 0xff:
+            raise ValueError(f"register value out of range: {value}")
+        self.values[self.address(register)] = value
+
+    def __eq__(self, other):
+        return isinstance(other, RegisterMap) and self.values == other.values
+
+    def __repr__(self):
+        known = ", ".join(f"{name}={value:#04x}" for name, value in zip(REGISTER_NAMES, self.values)
+                          if value is not None)
+        return f"RegisterMap({known})"
+
+    def items(self):
+        """(address, value) pairs of the registers whose value is known"""
+        return [(address, value) for address, value in enumerate(self.values) if value is not None]
+
+    def update(self, values):
+        """set the registers from another RegisterMap, a dict or (register, value) pairs; None values
+        are skipped"""
+        if isinstance(values, (RegisterMap, dict)):
+            values = values.items()
+        for register, value in values:
+            if value is not None:
+                self[register] = value
+
+    def copy(self):
+        registers = RegisterMap()
+        registers.values = list(self.values)
+        return registers
+
+    def invalidate(self):
+        """forget every value, e.g. after a reset"""
+        self.values = [None] * NUMBER_OF_REGISTERS
+
+    def changes(self, desired):
+        """the (address, value) writes that bring these registers to the ``desired`` ones (a
+        RegisterMap, dict or pairs), in address order; registers that are already at the desired
+        value, unknown in ``desired`` or read-only are left out"""
+        if not isinstance(desired, RegisterMap):
+            desired = RegisterMap(desired)
+        return [(address, value) for address, value in desired.items()
+                if address not in READ_ONLY_REGISTERS and self.values[address] != value]
+
+    def to_bytes(self):
+        """the register values as bytes, in address order; every value must be known"""
+        if None in self.values:
+            unknown = [name for name, value in zip(REGISTER_NAMES, self.values) if value is None]
+            raise ValueError(f"register values unknown: {', '.join(unknown)}")
+        return bytes(self.values)
+
+    @classmethod
+    def from_bytes(cls, data):
+        if len(data) != NUMBER_OF_REGISTERS:
+            raise ValueError(f"expected {NUMBER_OF_REGISTERS} register values, got {len(data)}")
+        return cls(enumerate(data))
+
+    def hex(self):
+        return self.to_bytes().hex()
+
+    @classmethod
+    def fromhex(cls, text):
+        return cls.from_bytes(bytes.fromhex(text))
+
+    def channel_gains(self):
+        """the PGA gain of each channel, from its CHnSET register (None where the register isn't known;
+        the reserved gain setting reads as None too)"""
+        return [None if self.values[address] is None else CHANNEL_GAINS.get(self.values[address] & GAIN_MASK)
+                for address in CHANNEL_SET_REGISTERS]
+
+    def as_dict(self):
+        """register name to value (None if unknown)"""
+        return dict(zip(REGISTER_NAMES, self.values))
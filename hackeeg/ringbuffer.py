@@ -0,0 +1,105 @@
+import numpy as np
+
+from .decoder import NUMBER_OF_CHANNELS
+
+
+class SampleRingBuffer:
+    """Preallocated, fixed-capacity ring buffer of sample timestamps and channel data.
+
+    A single producer appends blocks with ``append_block()``; any number of consumers read with
+    ``latest()`` or ``since()``. Readers never take a lock or block the writer: the writer fills in
+    the samples first and only then advances the write counter, and each reader keeps its own cursor
+    (the value of the write counter up to which it has read).
+
+    Views returned by ``latest()`` and ``since()`` point straight into the buffer when the requested
+    range does not wrap around its end. They are only valid until the writer laps them, so copy
+    anything that has to be kept for longer than about ``capacity`` samples.
+
+    The arrays can live in any writable buffer (``buffer=``), e.g. shared memory; use
+    ``buffer_size()`` to find out how big it has to be."""
+
+    HEADER_DTYPE = np.dtype(np.int64)
+    HEADER_LENGTH = 2  # write counter, reserved
+    TIMESTAMP_DTYPE = np.dtype(np.uint32)
+
+    def __init__(self, capacity, channels=NUMBER_OF_CHANNELS, dtype=np.int32, buffer=None):
+        self.capacity = capacity
+        self.channels = channels
+        self.dtype = np.dtype(dtype)
+        if buffer is None:
+            buffer = bytearray(self.buffer_size(capacity, channels, dtype))
+        header_size, timestamps_size, _ = self._layout(capacity, channels, dtype)
+        self._header = np.ndarray((self.HEADER_LENGTH,), dtype=self.HEADER_DTYPE, buffer=buffer)
+        self.timestamps = np.ndarray((capacity,), dtype=self.TIMESTAMP_DTYPE, buffer=buffer, offset=header_size)
+        self.data = np.ndarray((capacity, channels), dtype=self.dtype, buffer=buffer,
+                               offset=header_size + timestamps_size)
+
+    @classmethod
+    def _layout(cls, capacity, channels, dtype):
+        header_size = cls.HEADER_LENGTH * cls.HEADER_DTYPE.itemsize
+        timestamps_size = capacity * cls.TIMESTAMP_DTYPE.itemsize
+        timestamps_size += -timestamps_size % cls.HEADER_DTYPE.itemsize  # keep the channel data aligned
+        data_size = capacity * channels * np.dtype(dtype).itemsize
+        return header_size, timestamps_size, data_size
+
+    @classmethod
+    def buffer_size(cls, capacity, channels=NUMBER_OF_CHANNELS, dtype=np.int32):
+        """number of bytes needed to hold a ring buffer of this shape"""
+        return sum(cls._layout(capacity, channels, dtype))
+
+    @property
+    def written(self):
+        """total number of samples ever appended"""
+        return int(self._header[0])
+
+    def __len__(self):
+        return min(self.written, self.capacity)
+
+    def append_block(self, timestamps, channel_data):
+        """append N timestamps and an (N, channels) block of channel data"""
+        number_of_samples = len(timestamps)
+        written = self.written
+        if number_of_samples > self.capacity:
+            # only the newest samples fit; the older ones would be overwritten straight away
+            skip = number_of_samples - self.capacity
+            timestamps = timestamps[skip:]
+            channel_data = channel_data[skip:]
+            written += skip
+        count = len(timestamps)
+        start = written % self.capacity
+        first = min(count, self.capacity - start)
+        self.timestamps[start:start + first] = timestamps[:first]
+        self.data[start:start + first] = channel_data[:first]
+        if first < count:
+            self.timestamps[:count - first] = timestamps[first:]
+            self.data[:count - first] = channel_data[first:]
+        self._header[0] = written + count
+
+    def _read(self, start_count, stop_count):
+        start = start_count % self.capacity
+        count = stop_count - start_count
+        if start + count <= self.capacity:
+            return self.timestamps[start:start + count], self.data[start:start + count]
+        first = self.capacity - start
+        return (np.concatenate((self.timestamps[start:], self.timestamps[:count - first])),
+                np.concatenate((self.data[start:], self.data[:count - first])))
+
+    def latest(self, n):
+        """the newest n samples (or fewer, if fewer are available) as (timestamps, channel_data)"""
+        written = self.written
+        n = min(n, written, self.capacity)
+        return self._read(written - n, written)
+
+    def since(self, cursor):
+        """all samples appended after ``cursor`` as (timestamps, channel_data, new_cursor).
+        Start with a cursor of 0; if the reader fell more than ``capacity`` samples behind,
+        the samples that were overwritten are skipped. A cursor from before a reset() starts over."""
+        written = self.written
+        if cursor > written:
+            cursor = 0
+        cursor = max(cursor, written - self.capacity)
+        timestamps, channel_data = self._read(cursor, written)
+        return timestamps, channel_data, written
+
+    def reset(self):
+        self._header[0] = 0
@@ -0,0 +1,50 @@
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from .decoder import NUMBER_OF_CHANNELS
+from .ringbuffer import SampleRingBuffer
+
+
+class SharedSampleRingBuffer(SampleRingBuffer):
+    """A SampleRingBuffer that lives in a ``multiprocessing.shared_memory`` segment.
+
+    The acquisition process creates it and appends decoded blocks; other processes attach to the
+    same segment with ``attach(**buffer.spec())`` and read with their own cursors, with no per-sample
+    IPC at all. The ring buffer's write counter, which is only advanced after a block has been
+    written, is the handshake between writer and readers.
+
+    The process that created the segment should ``unlink()`` it when acquisition is over;
+    every process should ``close()`` its own mapping."""
+
+    def __init__(self, capacity, channels=NUMBER_OF_CHANNELS, dtype=np.int32, name=None, create=True):
+        size = self.buffer_size(capacity, channels, dtype)
+        self.shared_memory = shared_memory.SharedMemory(name=name, create=create, size=size if create else 0)
+        super().__init__(capacity, channels=channels, dtype=dtype, buffer=self.shared_memory.buf)
+        if create:
+            self.reset()
+
+    @classmethod
+    def attach(cls, name, capacity, channels=NUMBER_OF_CHANNELS, dtype=np.int32):
+        """map an existing shared ring buffer, created by another process"""
+        return cls(capacity, channels=channels, dtype=dtype, name=name, create=False)
+
+    @property
+    def name(self):
+        return self.shared_memory.name
+
+    def spec(self):
+        """everything another process needs to attach() to this buffer"""
+        return {"name": self.name, "capacity": self.capacity, "channels": self.channels, "dtype": self.dtype.str}
+
+    def close(self):
+        # the arrays must let go of the segment's memory before it can be unmapped
+        self._header = self.timestamps = self.data = None
+        try:
+            self.shared_memory.close()
+        except BufferError:
+            # a reader still holds a view; the mapping goes away when that view is garbage collected
+            pass
+
+    def unlink(self):
+        self.shared_memory.unlink()
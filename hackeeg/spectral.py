@@ -0,0 +1,108 @@
+import numpy as np
+from scipy import signal
+
+from .decoder import NUMBER_OF_CHANNELS
+
+DEFAULT_BANDS = {"delta": (1, 4),
+                 "theta": (4, 8),
+                 "alpha": (8, 13),
+                 "beta": (13, 30),
+                 "gamma": (30, 45)}
+LINE_FREQUENCIES = (50, 60)
+DEFAULT_AVERAGE = 8  # segments in the rolling Welch average
+LINE_WIDTH = 1.0  # Hz either side of the line frequency counted as line noise
+LINE_FLOOR = (2.0, 6.0)  # Hz either side of the line frequency the noise floor is taken from
+
+
+class StreamingSpectrum:
+    """Rolling Welch power spectral density of a stream of (N, channels) blocks.
+
+    Incoming samples are cut into segments of ``segment_length`` samples, ``hop`` samples apart (by
+    default half a segment, i.e. 50% overlap); each segment is detrended (mean removed), windowed and
+    transformed for all channels at once, and the PSD is the mean of the last ``average`` segments,
+    scaled like ``scipy.signal.welch(..., scaling='density')``. Only the samples of the unfinished
+    segment are kept between blocks.
+
+    ``segment_length`` defaults to one second of samples (1 Hz resolution). Values are in the units
+    of the input times ``scale`` (e.g. the microvolts per count), so the PSD is in units**2 / Hz."""
+
+    def __init__(self, samples_per_second, channels=NUMBER_OF_CHANNELS, segment_length=None, hop=None,
+                 average=DEFAULT_AVERAGE, window='hann', bands=None, scale=1.0):
+        self.samples_per_second = samples_per_second
+        self.channels = channels
+        self.segment_length = segment_length or int(samples_per_second)
+        self.hop = hop or self.segment_length // 2
+        self.average = average
+        self.bands = dict(DEFAULT_BANDS if bands is None else bands)
+        self.scale = scale
+        self.window = signal.get_window(window, self.segment_length)
+        density = 1.0 / (samples_per_second * np.sum(self.window ** 2))
+        self.frequencies = np.fft.rfftfreq(self.segment_length, 1.0 / samples_per_second)
+        # one-sided spectrum: double everything but DC and (for even lengths) Nyquist
+        self.weights = np.full(len(self.frequencies), 2 * density)
+        self.weights[0] = density
+        if self.segment_length % 2 == 0:
+            self.weights[-1] = density
+        self.resolution = self.frequencies[1] - self.frequencies[0]
+        self.reset()
+
+    def reset(self):
+        self.pending = np.zeros((0, self.channels))
+        self.segment_psds = np.zeros((self.average, self.channels, len(self.frequencies)))
+        self.segments = 0
+
+    def process(self, block):
+        """add an (N, channels) block; returns the PSDs of the segments it completed, as an
+        (M, channels, frequencies) array (M may be 0)"""
+        block = np.asarray(block, dtype=np.float64).reshape(-1, self.channels)
+        samples = np.concatenate((self.pending, block)) if len(self.pending) else block
+        count = (len(samples) - self.segment_length) // self.hop + 1 if len(samples) >= self.segment_length else 0
+        self.pending = samples[count * self.hop:].copy()
+        if count == 0:
+            return np.zeros((0, self.channels, len(self.frequencies)))
+        segments = np.lib.stride_tricks.sliding_window_view(samples, self.segment_length, axis=0)
+        segments = segments[:count * self.hop:self.hop]  # (count, channels, segment_length)
+        segments = (segments - segments.mean(axis=-1, keepdims=True)) * self.window
+        psds = np.abs(np.fft.rfft(segments, axis=-1)) ** 2 * (self.weights * self.scale ** 2)
+        positions = np.arange(self.segments, self.segments + count) % self.average
+        self.segment_psds[positions[-self.average:]] = psds[-self.average:]
+        self.segments += count
+        return psds
+
+    def process_sample_block(self, block):
+        """add a SampleBlock, as returned by HackEEGBoard.read_rdatac_block()"""
+        return self.process(block.channel_data)
+
+    @property
+    def psd(self):
+        """the rolling Welch PSD, (channels, frequencies); zeros until the first segment is complete"""
+        filled = min(self.segments, self.average)
+        if filled == 0:
+            return np.zeros((self.channels, len(self.frequencies)))
+        return self.segment_psds[:filled].mean(axis=0)
+
+    def _power(self, psd, low, high):
+        mask = (self.frequencies >= low) & (self.frequencies < high)
+        return psd[:, mask].sum(axis=1) * self.resolution
+
+    def band_powers(self):
+        """power in each of ``bands`` per channel, as a dict of band name to an array of channels"""
+        psd = self.psd
+        return {name: self._power(psd, low, high) for name, (low, high) in self.bands.items()}
+
+    def line_noise(self):
+        """how far the line noise peak stands above the noise floor around it, in dB per channel,
+        for each of 50 and 60 Hz (as a dict); compare the two to tell which mains the noise is from"""
+        psd = self.psd
+        noise = {}
+        for frequency in LINE_FREQUENCIES:
+            if frequency + LINE_FLOOR[1] > self.samples_per_second / 2:
+                continue
+            distance = np.abs(self.frequencies - frequency)
+            line_mask = distance <= LINE_WIDTH
+            floor_mask = (distance >= LINE_FLOOR[0]) & (distance <= LINE_FLOOR[1])
+            line = psd[:, line_mask].sum(axis=1)
+            floor = psd[:, floor_mask].mean(axis=1) * np.count_nonzero(line_mask)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                noise[frequency] = 10 * np.log10(line / floor)
+        return noise
@@ -30,6 +30,7 @@ setup(name='hackeeg',
 			"pyserial",
 			"bitstring",
 			"numpy",
+			"scipy",
 			"jsonlines",
 			"msgpack",
 			"autopep8",
@@ -40,6 +41,7 @@ setup(name='hackeeg',
       ],
       scripts=[
             "bin/example.py",
+            "bin/hackeeg_benchmark.py",
             "bin/hackeeg_shell",
             "bin/hackeeg_shell.py",
             "bin/hackeeg_stream",
@@ -0,0 +1,131 @@
+import asyncio
+
+import pytest
+
+from hackeeg import ads1299
+from hackeeg.aio import AsyncHackEEGBoard
+from hackeeg.driver import HackEEGBoard, HackEEGException
+from hackeeg.decoder import DECODE_CHANNELS
+
+EMULATOR_URL = "hackeeg://?samples_per_second=1000&realtime=0&seed=1"
+
+
+def test_board():
+    board = HackEEGBoard(EMULATOR_URL, decode_profile=DECODE_CHANNELS)
+    try:
+        board.connect()
+        assert board.ok(board.nop())
+        snapshot = board.snapshot_registers()
+        assert snapshot[ads1299.ID] is not None
+        assert board.registers == snapshot
+        board.wreg(ads1299.CH1SET, ads1299.ELECTRODE_INPUT | ads1299.GAIN_12X)
+        assert board.registers[ads1299.CH1SET] == ads1299.ELECTRODE_INPUT | ads1299.GAIN_12X
+        assert board.apply_registers({ads1299.CH1SET: ads1299.ELECTRODE_INPUT | ads1299.GAIN_12X}) == []
+
+        board.binary_mode()
+        board.start()
+        board.rdatac()
+        received = 0
+        for _ in range(20):
+            block = board.read_rdatac_block(timeout=0.1)
+            received += len(block)
+            if received >= 100:
+                break
+        assert received >= 100
+        assert board.gap_detector.missing == 0
+        board.stop_and_sdatac_messagepack()
+        assert board.ok(board.nop())
+    finally:
+        board.raw_serial_port.close()
+
+
+def test_async_board():
+    async def run():
+        board = AsyncHackEEGBoard(EMULATOR_URL, decode_profile=DECODE_CHANNELS)
+        try:
+            await board.connect()
+            assert board.ok(await board.nop())
+            snapshot = await board.snapshot_registers()
+            assert snapshot[ads1299.ID] is not None
+            await board.wreg(ads1299.CH1SET, ads1299.ELECTRODE_INPUT | ads1299.GAIN_12X)
+            await board.restore_registers(snapshot)
+            assert await board.snapshot_registers() == snapshot
+
+            await board.messagepack_mode()
+            await board.start()
+            await board.rdatac()
+            received = 0
+            async for block in board.sample_blocks():
+                received += len(block)
+                if received >= 100:
+                    break
+            assert received >= 100
+            await board.sdatac()
+            await board.stop()
+            assert board.ok(await board.nop())
+        finally:
+            await board.close()
+
+    asyncio.run(asyncio.wait_for(run(), timeout=30))
+
+
+def test_pipeline_resyncs_after_timeout(monkeypatch):
+    board = HackEEGBoard(EMULATOR_URL)
+    try:
+        board.connect()
+        board.snapshot_registers()
+        read_response = board.read_response
+        late = []
+
+        def first_response_late(*args, **kwargs):
+            # the first response is still in the serial port when the pipeline gives up on it
+            if not late:
+                late.append(True)
+                return None
+            return read_response(*args, **kwargs)
+
+        monkeypatch.setattr(board, "read_response", first_response_late)
+        with board.pipeline() as pipeline:
+            writes = [pipeline.submit("wreg", [ads1299.CH1SET, 0x05]),
+                      pipeline.submit("wreg", [ads1299.CH2SET, 0x06])]
+            read = pipeline.submit("rreg", [ads1299.CONFIG1])
+        for future in writes + [read]:
+            assert isinstance(future.exception(), HackEEGException)
+        assert board.registers[ads1299.CH1SET] is None
+        assert board.registers[ads1299.CH2SET] is None
+        assert board.registers[ads1299.CONFIG1] is not None
+
+        # the late responses were read up to the barrier, so nothing is out of step
+        assert board.rreg(ads1299.CH2SET)[board.DataKey] == 0x06
+        assert board.registers[ads1299.CH2SET] == 0x06
+        assert board.execute_commands([("rreg", [ads1299.CH1SET]), ("nop", None)])[0][board.DataKey] == 0x05
+    finally:
+        board.raw_serial_port.close()
+
+
+def test_async_resyncs_after_timeout():
+    async def run():
+        board = AsyncHackEEGBoard(EMULATOR_URL)
+        try:
+            await board.connect()
+            await board.snapshot_registers()
+            read_response = board._read_response
+            late = []
+
+            async def first_response_late(timeout=None):
+                if not late:
+                    late.append(True)
+                    raise asyncio.TimeoutError()
+                return await read_response(timeout)
+
+            board._read_response = first_response_late
+            with pytest.raises(asyncio.TimeoutError):
+                await board.execute_commands([("wreg", [ads1299.CH1SET, 0x05]), ("wreg", [ads1299.CH2SET, 0x06])])
+            assert board.registers[ads1299.CH1SET] is None
+            assert board.registers[ads1299.CH2SET] is None
+            assert (await board.rreg(ads1299.CH2SET))[board.DataKey] == 0x06
+            assert board.registers[ads1299.CH2SET] == 0x06
+        finally:
+            await board.close()
+
+    asyncio.run(asyncio.wait_for(run(), timeout=30))
@@ -0,0 +1,62 @@
+import numpy as np
+
+from hackeeg.decoder import decode_block, encode_block, SampleBlock, DECODE_CHANNELS, DECODE_STATUS, DECODE_FULL, \
+    NUMBER_OF_CHANNELS, SAMPLE_RECORD_LENGTH
+
+
+def make_samples(number_of_samples, seed=0):
+    rng = np.random.default_rng(seed)
+    timestamps = rng.integers(0, 2 ** 32, number_of_samples, dtype=np.int64)
+    sample_numbers = np.arange(number_of_samples) + 2 ** 32 - number_of_samples // 2  # wraps halfway through
+    channel_data = rng.integers(-2 ** 23, 2 ** 23, (number_of_samples, NUMBER_OF_CHANNELS), dtype=np.int64)
+    return timestamps, sample_numbers, channel_data
+
+
+def test_round_trip():
+    timestamps, sample_numbers, channel_data = make_samples(100)
+    records = encode_block(timestamps, sample_numbers, channel_data, 0xc12345)
+    assert records.shape == (100, SAMPLE_RECORD_LENGTH)
+    block = decode_block(records.tobytes(), profile=DECODE_STATUS)
+    assert len(block) == 100
+    assert np.array_equal(block.timestamp, timestamps)
+    assert np.array_equal(block.sample_number, sample_numbers % 2 ** 32)
+    assert np.array_equal(block.channel_data, channel_data)
+    assert block.channel_data.dtype == np.int32
+    assert np.all(block.ads_status == 0xc12345)
+    assert np.all(block.ads_gpio == 0x5)
+    assert np.all(block.loff_statn == 0x34)
+    assert np.all(block.loff_statp == 0x12)
+    assert np.all(block.extra == 0xc)
+
+
+def test_sign_extension():
+    extremes = [0, 1, -1, 2 ** 23 - 1, -2 ** 23, 0x7f0000, -0x10000, -2]
+    records = encode_block([0], [0], [extremes], 0)
+    # 24-bit big-endian two's complement on the wire
+    assert records[0, 11:14].tobytes() == b"\x00\x00\x00"
+    assert records[0, 17:20].tobytes() == b"\xff\xff\xff"
+    assert records[0, 23:26].tobytes() == b"\x80\x00\x00"
+    block = decode_block(records.tobytes(), profile=DECODE_CHANNELS)
+    assert block.channel_data[0].tolist() == extremes
+
+
+def test_profiles():
+    records = encode_block(*make_samples(3), 0xc00000).tobytes()
+    block = decode_block(records, profile=DECODE_CHANNELS)
+    assert block.ads_status is None and block.extra is None and block.data_raw is None
+    block = decode_block(records, profile=DECODE_FULL)
+    assert block.data_raw.tobytes() == records
+
+
+def test_individual_payloads():
+    records = encode_block(*make_samples(4), 0xc00000)
+    payloads = [bytes(record) for record in records]
+    payloads.insert(2, b"short")  # payloads of the wrong length are skipped
+    block = decode_block(payloads, profile=DECODE_CHANNELS)
+    assert np.array_equal(block.channel_data, decode_block(records.tobytes()).channel_data)
+
+
+def test_empty():
+    block = SampleBlock.empty()
+    assert len(block) == 0
+    assert block.channel_data.shape == (0, NUMBER_OF_CHANNELS)
@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+from hackeeg.filters import StreamingMedianFilter, FilterException
+
+
+def reference_windows(samples, kernel_size):
+    padded = np.concatenate((np.repeat(samples[:1], kernel_size - 1, axis=0), samples))
+    return np.lib.stride_tricks.sliding_window_view(padded, kernel_size, axis=0)
+
+
+def process_in_blocks(median_filter, samples, seed=0):
+    rng = np.random.default_rng(seed)
+    outputs = []
+    offset = 0
+    while offset < len(samples):
+        size = int(rng.integers(1, 50))
+        outputs.append(median_filter.process(samples[offset:offset + size]))
+        offset += size
+    return np.concatenate(outputs)
+
+
+@pytest.mark.parametrize("kernel_size", [1, 3, 9, 31])
+def test_median(kernel_size):
+    samples = np.random.default_rng(1).integers(-20, 20, (500, 4)).astype(np.float64)  # plenty of ties
+    median_filter = StreamingMedianFilter(kernel_size, channels=4)
+    output = process_in_blocks(median_filter, samples)
+    assert np.array_equal(output, np.median(reference_windows(samples, kernel_size), axis=-1))
+
+
+@pytest.mark.parametrize("kernel_size", [3, 9, 31])
+def test_hampel(kernel_size):
+    rng = np.random.default_rng(2)
+    samples = rng.normal(size=(600, 3)).round(1)
+    samples[::41] += 50
+    median_filter = StreamingMedianFilter(kernel_size, channels=3, spike_threshold=3)
+    output = process_in_blocks(median_filter, samples)
+
+    windows = reference_windows(samples, kernel_size)
+    median = np.median(windows, axis=-1)
+    deviation = 1.4826 * np.median(np.abs(windows - median[:, :, np.newaxis]), axis=-1)
+    centers = windows[:, :, kernel_size // 2]
+    spikes = np.abs(centers - median) > 3 * deviation
+    assert np.array_equal(output, np.where(spikes, median, centers))
+    assert median_filter.spikes == np.count_nonzero(spikes) >= 3 * 15
+
+
+def test_reset():
+    median_filter = StreamingMedianFilter(5, channels=1)
+    median_filter.process(np.full((10, 1), 100.0))
+    median_filter.reset()
+    assert median_filter.process(np.zeros((3, 1))).tolist() == [[0.0]] * 3
+
+
+def test_even_kernel():
+    with pytest.raises(FilterException):
+        StreamingMedianFilter(4)
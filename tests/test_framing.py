@@ -0,0 +1,75 @@
+import numpy as np
+
+from hackeeg.driver import HackEEGBoard, RdatacStreamParser
+from hackeeg.decoder import encode_block, decode_block, NUMBER_OF_CHANNELS, SAMPLE_RECORD_LENGTH
+from hackeeg.framing import crc16, crc16_block, encode_frame, encode_frames, BinaryFrameParser, FRAME_LENGTH
+
+
+def make_records(number_of_samples, seed=0):
+    rng = np.random.default_rng(seed)
+    channel_data = rng.integers(-2 ** 23, 2 ** 23, (number_of_samples, NUMBER_OF_CHANNELS))
+    return encode_block(np.arange(number_of_samples) * 2000, np.arange(number_of_samples), channel_data, 0xc00000)
+
+
+def test_crc16():
+    assert crc16(b"123456789") == 0x29b1  # CRC-16/CCITT-FALSE check value
+    records = np.random.default_rng(1).integers(0, 256, (50, SAMPLE_RECORD_LENGTH), dtype=np.uint8)
+    assert crc16_block(records).tolist() == [crc16(bytes(record)) for record in records]
+
+
+def test_encode_frames_matches_encode_frame():
+    records = make_records(5)
+    block = decode_block(records.tobytes())
+    frames = b"".join(encode_frame(int(timestamp), int(sample_number), channel_data)
+                      for timestamp, sample_number, channel_data
+                      in zip(block.timestamp, block.sample_number, block.channel_data))
+    assert encode_frames(records) == frames
+
+
+def test_parser_chunks():
+    records = make_records(100)
+    stream = encode_frames(records)
+    parser = BinaryFrameParser()
+    received = b"".join(parser.feed(stream[offset:offset + 7]) for offset in range(0, len(stream), 7))
+    assert received == records.tobytes()
+    assert parser.crc_errors == 0 and parser.resyncs == 0
+
+
+def test_parser_rejects_bad_crc():
+    records = make_records(10)
+    frames = bytearray(encode_frames(records))
+    frames[3 * FRAME_LENGTH + 10] ^= 0x01  # damage the payload of the fourth frame
+    parser = BinaryFrameParser()
+    received = parser.feed(bytes(frames))
+    assert received == np.delete(records, 3, axis=0).tobytes()
+    assert parser.crc_errors == 1
+    assert parser.resyncs == 1
+
+
+def test_parser_resyncs_after_garbage():
+    records = make_records(20)
+    frames = encode_frames(records)
+    garbage = bytes(range(7, 40)) + b"\xa5"  # includes half a sync word
+    stream = garbage + frames[:5 * FRAME_LENGTH] + garbage + frames[5 * FRAME_LENGTH:]
+    parser = BinaryFrameParser()
+    received = parser.feed(stream[:100]) + parser.feed(stream[100:])
+    assert received == records.tobytes()
+    assert parser.crc_errors == 0
+    assert parser.resyncs >= 2
+
+
+def test_stream_parser_counts_errors(capsys):
+    records = make_records(4)
+    frames = bytearray(encode_frames(records))
+    frames[FRAME_LENGTH + 10] ^= 0x01
+    parser = RdatacStreamParser(HackEEGBoard.BinaryMode)
+    parser.feed(bytes(frames))
+    assert parser.pending() == 3
+    assert parser.take_errors() == 1
+    assert parser.take_errors() == 0
+
+    parser = RdatacStreamParser(HackEEGBoard.JsonLinesMode)
+    parser.feed(b'{"C": 200, "D": "AAAA"}\n{"C": 200, "D"\n\xff\xfe\n{"C": 200, "D": "AAAA"}\n')
+    assert parser.pending() == 2
+    assert parser.take_errors() == 2
+    assert capsys.readouterr().out == ""  # only printed with debug
@@ -0,0 +1,62 @@
+import numpy as np
+
+from hackeeg.decoder import decode_block, encode_block
+from hackeeg.gaps import GapDetector, SAMPLE_NUMBER_MODULUS
+
+
+def test_continuous_stream():
+    detector = GapDetector(samples_per_second=500)
+    sample_numbers = np.arange(1000)
+    for start in range(0, 1000, 100):
+        assert detector.update(sample_numbers[start:start + 100], sample_numbers[start:start + 100] * 2000) == 0
+    counters = detector.counters()
+    assert counters["samples"] == 1000
+    assert counters["gaps"] == counters["missing"] == counters["repeated"] == counters["backwards"] == 0
+    assert counters["mean_interval_us"] == 2000
+    assert counters["max_jitter_us"] == 0
+
+
+def test_gaps_within_and_between_blocks():
+    detector = GapDetector()
+    assert detector.update([0, 1, 2, 5, 6]) == 2
+    assert detector.update([10, 11]) == 3
+    assert detector.gaps == 2
+    assert detector.missing == 5
+    assert detector.max_gap == 3
+
+
+def test_wraparound():
+    detector = GapDetector()
+    top = SAMPLE_NUMBER_MODULUS - 1
+    assert detector.update([top - 2, top - 1, top]) == 0
+    assert detector.update([0, 1, 2]) == 0
+    assert detector.gaps == 0 and detector.backwards == 0
+    detector.reset()
+    assert detector.update([top - 1, top, 1, 2]) == 1  # sample 0 is missing across the wrap
+    assert detector.gaps == 1 and detector.backwards == 0
+
+
+def test_timestamp_wraparound():
+    detector = GapDetector(samples_per_second=1000)
+    timestamps = (np.arange(10) * 1000 + 2 ** 32 - 5000) % 2 ** 32
+    detector.update(np.arange(10), timestamps)
+    assert detector.intervals == 9
+    assert detector.max_jitter == 0
+
+
+def test_repeated_and_backwards():
+    detector = GapDetector()
+    assert detector.update([5, 5, 6, 3, 4]) == 0
+    assert detector.repeated == 1
+    assert detector.backwards == 1
+    assert detector.missing == 0
+
+
+def test_corrupt_samples():
+    detector = GapDetector()
+    detector.update_block(decode_block(b""), corrupt=2)
+    detector.update_block(decode_block(encode_block([0, 1], [0, 1], np.zeros((2, 8)), 0).tobytes()), corrupt=1)
+    assert detector.corrupt == 3
+    assert detector.counters()["corrupt"] == 3
+    detector.reset()
+    assert detector.corrupt == 0
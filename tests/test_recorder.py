@@ -0,0 +1,89 @@
+import numpy as np
+import pytest
+
+from hackeeg.bdf import BDFWriter, BDFException, physical_range
+from hackeeg.reader import BDFReader, BinaryRecordingReader, open_recording
+from hackeeg.recorder import BinaryRecorder, RecordingException, read_recording, read_recording_header, \
+    recording_gains
+from hackeeg.registers import RegisterMap
+
+
+def make_samples(number_of_samples, channels=8, seed=0):
+    rng = np.random.default_rng(seed)
+    timestamps = np.arange(number_of_samples, dtype=np.uint32) * 4000
+    channel_data = rng.integers(-2 ** 23, 2 ** 23, (number_of_samples, channels)).astype(np.int32)
+    return timestamps, channel_data
+
+
+def test_binary_recording_round_trip(tmp_path):
+    path = tmp_path / "test.hackeeg"
+    timestamps, channel_data = make_samples(1234)
+    sample_numbers = np.arange(1234, dtype=np.uint32) + 10
+    with BinaryRecorder(path, 250, gains=[1, 2, 4, 6, 8, 12, 24, 24], buffer_samples=100,
+                        metadata={"subject": "x"}) as recorder:
+        for start in range(0, 1234, 99):
+            recorder.write_block(timestamps[start:start + 99], channel_data[start:start + 99],
+                                 sample_numbers[start:start + 99])
+    metadata, records = read_recording(path)
+    assert metadata["samples_per_second"] == 250
+    assert metadata["subject"] == "x"
+    assert recording_gains(metadata) == [1, 2, 4, 6, 8, 12, 24, 24]
+    assert np.array_equal(records["timestamp"], timestamps)
+    assert np.array_equal(records["sample_number"], sample_numbers)
+    assert np.array_equal(records["channel_data"], channel_data)
+
+    reader = open_recording(path)
+    assert isinstance(reader, BinaryRecordingReader)
+    assert np.array_equal(reader.read_samples(start=100, stop=200), channel_data[100:200])
+
+
+def test_binary_recording_own_sample_numbers(tmp_path):
+    path = tmp_path / "test.hackeeg"
+    timestamps, channel_data = make_samples(10, channels=2)
+    with BinaryRecorder(path, 500, channels=2, device_sample_numbers=False) as recorder:
+        recorder.write_block(timestamps[:4], channel_data[:4])
+        recorder.write_block(timestamps[4:], channel_data[4:])
+    metadata, records = read_recording(path)
+    assert metadata["device_sample_numbers"] is False
+    assert records["sample_number"].tolist() == list(range(10))
+
+
+def test_recording_gains_from_registers():
+    registers = RegisterMap.fromhex("3e96d0ec00" + "60" * 4 + "00" * 4 + "00" * 13)
+    metadata = {"channels": 8, "gains": None, "gain": None, "registers": registers.hex()}
+    assert recording_gains(metadata) == [24] * 4 + [1] * 4
+    assert recording_gains({"channels": 2, "gain": 6}) == [6, 6]
+
+
+def test_not_a_recording(tmp_path):
+    path = tmp_path / "test.hackeeg"
+    path.write_bytes(b"not a recording, but long enough")
+    with pytest.raises(RecordingException):
+        read_recording_header(path)
+
+
+def test_bdf_round_trip(tmp_path):
+    path = tmp_path / "test.bdf"
+    timestamps, channel_data = make_samples(1100, channels=3)
+    with BDFWriter(path, 500, gains=[1, 12, 24], channels=3, labels=["Fp1", "Fp2", "Cz"]) as writer:
+        for start in range(0, 1100, 333):
+            writer.write_block(timestamps[start:start + 333], channel_data[start:start + 333])
+    reader = BDFReader(path)
+    assert reader.labels == ["Fp1", "Fp2", "Cz"]
+    assert reader.units == ["uV"] * 3
+    assert reader.samples_per_second == 500
+    assert reader.channels == 3
+    assert reader.number_of_samples == 1500  # three one-second data records, the last one padded
+    samples = reader.read_samples()
+    assert np.array_equal(samples[:1100], channel_data)
+    assert not samples[1100:].any()
+    assert np.array_equal(reader.read_samples(channel_slice=slice(1, 2), start=490, stop=510),
+                          channel_data[490:510, 1:2])
+    # the physical range follows the gain: full scale is 4.5 V / gain
+    _, maximum = physical_range(12)
+    assert reader.scale[1] * (2 ** 23 - 1) + reader.offset[1] == pytest.approx(maximum, rel=1e-6)
+
+
+def test_bdf_record_duration(tmp_path):
+    with pytest.raises(BDFException):
+        BDFWriter(tmp_path / "test.bdf", 250, record_duration=0.002)
@@ -0,0 +1,47 @@
+import pytest
+
+from hackeeg import ads1299
+from hackeeg.registers import RegisterMap, NUMBER_OF_REGISTERS
+
+
+def test_changes():
+    current = RegisterMap({ads1299.CONFIG1: 0x96, ads1299.CH1SET: 0x60, ads1299.CH2SET: 0x60})
+    desired = RegisterMap({ads1299.ID: 0x3e,  # read-only
+                           ads1299.CONFIG1: 0x96,  # already there
+                           ads1299.CH1SET: 0x00,
+                           ads1299.LOFF_STATP: 0xff,  # read-only
+                           ads1299.MISC1: 0x20})  # not known yet
+    assert current.changes(desired) == [(ads1299.CH1SET, 0x00), (ads1299.MISC1, 0x20)]
+
+
+def test_changes_skips_unknown_desired_registers():
+    current = RegisterMap({ads1299.CH2SET: 0x60})
+    # CH2SET isn't in the desired map, so it doesn't matter what it is
+    assert current.changes({"CH1SET": 0x05, "CH2SET": None}) == [(ads1299.CH1SET, 0x05)]
+    assert current.changes(RegisterMap()) == []
+
+
+def test_addressing():
+    registers = RegisterMap()
+    registers["CONFIG3"] = 0xe0
+    assert registers[ads1299.CONFIG3] == 0xe0
+    with pytest.raises(KeyError):
+        registers["NOPE"]
+    with pytest.raises(KeyError):
+        registers[NUMBER_OF_REGISTERS]
+    with pytest.raises(ValueError):
+        registers["CONFIG3"] = 0x100
+
+
+def test_bytes_round_trip():
+    registers = RegisterMap(enumerate(range(NUMBER_OF_REGISTERS)))
+    assert RegisterMap.fromhex(registers.hex()) == registers
+    registers.invalidate()
+    with pytest.raises(ValueError):
+        registers.to_bytes()
+
+
+def test_channel_gains():
+    registers = RegisterMap({ads1299.CH1SET: ads1299.ELECTRODE_INPUT | ads1299.GAIN_24X,
+                             ads1299.CH2SET: ads1299.PDn | ads1299.SHORTED | ads1299.GAIN_1X})
+    assert registers.channel_gains() == [24, 1] + [None] * 6
@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+
+from hackeeg.ringbuffer import SampleRingBuffer
+from hackeeg.sharedmem import SharedSampleRingBuffer
+
+
+def make_block(start, number_of_samples, channels=8):
+    timestamps = np.arange(start, start + number_of_samples, dtype=np.uint32)
+    channel_data = np.arange(start, start + number_of_samples, dtype=np.int32)[:, None] * np.ones(channels, np.int32)
+    return timestamps, channel_data
+
+
+@pytest.fixture(params=["local", "shared"])
+def ring_buffer(request):
+    if request.param == "local":
+        yield SampleRingBuffer(10)
+    else:
+        buffer = SharedSampleRingBuffer(10)
+        yield buffer
+        buffer.close()
+        buffer.unlink()
+
+
+def test_wrap(ring_buffer):
+    ring_buffer.append_block(*make_block(0, 7))
+    ring_buffer.append_block(*make_block(7, 6))  # wraps around the end
+    assert ring_buffer.written == 13
+    assert len(ring_buffer) == 10
+    timestamps, channel_data = ring_buffer.latest(8)
+    assert timestamps.tolist() == list(range(5, 13))
+    assert channel_data[:, 3].tolist() == list(range(5, 13))
+    assert ring_buffer.latest(100)[0].tolist() == list(range(3, 13))
+
+
+def test_since(ring_buffer):
+    ring_buffer.append_block(*make_block(0, 4))
+    timestamps, _, cursor = ring_buffer.since(0)
+    assert timestamps.tolist() == [0, 1, 2, 3] and cursor == 4
+    ring_buffer.append_block(*make_block(4, 3))
+    timestamps, _, cursor = ring_buffer.since(cursor)
+    assert timestamps.tolist() == [4, 5, 6] and cursor == 7
+    assert len(ring_buffer.since(cursor)[0]) == 0
+
+
+def test_lapped_reader(ring_buffer):
+    ring_buffer.append_block(*make_block(0, 5))
+    _, _, cursor = ring_buffer.since(0)
+    ring_buffer.append_block(*make_block(5, 8))
+    ring_buffer.append_block(*make_block(13, 8))  # the reader is now lapped
+    timestamps, channel_data, cursor = ring_buffer.since(cursor)
+    assert timestamps.tolist() == list(range(11, 21))
+    assert channel_data[:, 0].tolist() == list(range(11, 21))
+    assert cursor == 21
+
+
+def test_block_larger_than_capacity(ring_buffer):
+    ring_buffer.append_block(*make_block(0, 25))
+    assert ring_buffer.written == 25
+    assert ring_buffer.latest(10)[0].tolist() == list(range(15, 25))
+
+
+def test_reset(ring_buffer):
+    ring_buffer.append_block(*make_block(0, 6))
+    ring_buffer.reset()
+    ring_buffer.append_block(*make_block(100, 2))
+    timestamps, _, cursor = ring_buffer.since(6)  # a cursor from before the reset starts over
+    assert timestamps.tolist() == [100, 101] and cursor == 2
+
+
+def test_shared_attach():
+    writer = SharedSampleRingBuffer(16, channels=4)
+    reader = SharedSampleRingBuffer.attach(**writer.spec())
+    try:
+        writer.append_block(*make_block(0, 20, channels=4))
+        timestamps, channel_data, cursor = reader.since(0)
+        assert timestamps.tolist() == list(range(4, 20))
+        assert channel_data.shape == (16, 4)
+        assert cursor == 20
+    finally:
+        del timestamps, channel_data
+        reader.close()
+        writer.close()
+        writer.unlink()